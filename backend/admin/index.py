@@ -1,319 +1,417 @@
-import json
-import os
-import psycopg2
-import hashlib
+import base64
+from datetime import datetime
+import instrumentation
+import ledger
+import rate_limit
+import response
+import router
+import security
+import settings_cache
 
-def handler(event: dict, context) -> dict:
-    '''API для административных операций такси-платформы'''
+TRANSACTION_COLUMNS = ('id', 'user', 'type', 'amount', 'status', 'date')
+
+USER_COLUMNS = ('id', 'phone', 'full_name', 'role', 'created_at',
+                'rub_balance', 'bonus_balance', 'driver_balance', 'shift_active')
+USERS_DEFAULT_LIMIT = 50
+USERS_MAX_LIMIT = 200
+# Триграммный GIN-индекс не отвечает на образцы короче трёх символов: такой
+# поиск читал бы users целиком, поэтому он не применяется
+USERS_SEARCH_MIN_LENGTH = 3
+
+BATCH_MAX_ITEMS = 1000
+
+# Смена действует, пока выполнено это условие; копия balance/shifts.py
+SHIFT_ON_SQL = "shift_active = true AND COALESCE(shift_ends_at > CURRENT_TIMESTAMP, false)"
+
+LOGIN_LIMITER = rate_limit.LoginLimiter('admin')
+
+ROUTER = router.Router(
+    'GET, POST, PUT, OPTIONS', 'Content-Type, X-Admin-Token',
+    roles=('admin',), unauthorized='Требуется авторизация администратора'
+)
+
+# Пакетная обработка заявок одним запросом: переводим в approved/rejected только
+# строки в статусе pending (повторная обработка пропускается), суммируем одобренные
+# суммы по пользователю и типу и применяем их к балансам по одному UPDATE на таблицу.
+# Проводки пишутся только по тем заявкам, чей баланс действительно изменился.
+# Вывод одобряется, только если баланс водителя (строка блокируется до конца
+# транзакции) покрывает все его одобряемые в пачке выводы; иначе заявки водителя
+# остаются pending. Основной SELECT видит снимок до изменений, поэтому
+# previous_status — исходный статус. Граница since — самая ранняя дата заявок
+# пачки: секции transactions до неё не читаются.
+PROCESS_BATCH_SQL = f"""WITH input AS (
+           SELECT * FROM unnest(%(ids)s::INTEGER[], %(actions)s::TEXT[]) AS i(id, action)
+       ),
+       withdrawals AS (
+           SELECT t.user_id, t.amount FROM transactions t
+           JOIN input ON input.id = t.id AND input.action = 'approve'
+           WHERE t.status = 'pending' AND t.type = 'withdrawal' AND t.created_at >= %(since)s::TIMESTAMP
+       ),
+       locked AS (
+           SELECT user_id, balance FROM driver_balances
+           WHERE user_id IN (SELECT user_id FROM withdrawals)
+           FOR UPDATE
+       ),
+       overdrawn AS (
+           SELECT w.user_id FROM withdrawals w
+           LEFT JOIN locked l ON l.user_id = w.user_id
+           GROUP BY w.user_id
+           HAVING COALESCE(MAX(l.balance), 0) < SUM(w.amount)
+       ),
+       processed AS (
+           UPDATE transactions t
+           SET status = CASE WHEN input.action = 'approve' THEN 'approved' ELSE 'rejected' END,
+               processed_at = CURRENT_TIMESTAMP
+           FROM input
+           WHERE t.id = input.id AND t.status = 'pending' AND t.created_at >= %(since)s::TIMESTAMP
+             AND NOT (input.action = 'approve' AND t.type = 'withdrawal'
+                      AND t.user_id IN (SELECT user_id FROM overdrawn))
+           RETURNING t.id, t.user_id, t.type, t.amount, t.status
+       ),
+       approved AS (
+           SELECT user_id,
+                  SUM(amount) FILTER (WHERE type = 'deposit_rub') AS rub,
+                  SUM(amount) FILTER (WHERE type = 'deposit_bonus') AS bonus,
+                  SUM(amount) FILTER (WHERE type = 'withdrawal') AS withdrawal
+           FROM processed
+           WHERE status = 'approved'
+           GROUP BY user_id
+       ),
+       passenger_updates AS (
+           UPDATE passenger_balances pb
+           SET rub_balance = pb.rub_balance + COALESCE(a.rub, 0),
+               bonus_balance = pb.bonus_balance + COALESCE(a.bonus, 0),
+               updated_at = CURRENT_TIMESTAMP
+           FROM approved a
+           WHERE pb.user_id = a.user_id AND (a.rub IS NOT NULL OR a.bonus IS NOT NULL)
+           RETURNING pb.user_id
+       ),
+       driver_updates AS (
+           UPDATE driver_balances db
+           SET balance = db.balance - a.withdrawal, updated_at = CURRENT_TIMESTAMP
+           FROM approved a
+           WHERE db.user_id = a.user_id AND a.withdrawal IS NOT NULL
+           RETURNING db.user_id
+       ),
+       posted AS (
+           {ledger.transaction_postings('''(
+               SELECT p.id, p.user_id, p.type, p.amount FROM processed p
+               WHERE p.status = 'approved'
+                 AND ((p.type IN ('deposit_rub', 'deposit_bonus') AND p.user_id IN (SELECT user_id FROM passenger_updates))
+                      OR (p.type = 'withdrawal' AND p.user_id IN (SELECT user_id FROM driver_updates)))
+           )''')}
+       )
+       SELECT input.id, processed.status, t.status,
+              input.action = 'approve' AND t.type = 'withdrawal' AND t.user_id IN (SELECT user_id FROM overdrawn)
+       FROM input
+       LEFT JOIN processed ON processed.id = input.id
+       LEFT JOIN transactions t ON t.id = input.id AND t.created_at >= %(since)s::TIMESTAMP
+       ORDER BY input.id"""
+
+
+def batch_since(created_at: list):
+    '''Нижняя граница created_at для пачки по датам заявок (поле date списка); без них — все секции'''
+    if not created_at or None in created_at:
+        return '-infinity'
+    return min(datetime.fromisoformat(value) for value in created_at)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    '''Курсор страницы: ключ (created_at, id) последней строки'''
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def users_query(query_params: dict) -> tuple:
+    '''SQL страницы справочника пользователей по параметрам запроса; ValueError при ошибке.
+
+    Поиск по подстроке телефона или имени идёт по триграммным индексам,
+    балансы присоединяются к странице, а не считаются подзапросом на строку.
+    '''
+    limit = min(max(int(query_params.get('limit', USERS_DEFAULT_LIMIT)), 1), USERS_MAX_LIMIT)
+    conditions = []
+    args = {'limit': limit + 1}
+
+    search = query_params.get('q', '').strip()
+    if len(search) >= USERS_SEARCH_MIN_LENGTH:
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        args['contains'] = f'%{escaped}%'
+        conditions.append("(u.phone LIKE %(contains)s OR u.full_name ILIKE %(contains)s)")
+
+    role = query_params.get('role')
+    if role:
+        if role not in ('passenger', 'driver'):
+            raise ValueError('invalid role')
+        args['role'] = role
+        conditions.append("u.role = %(role)s")
+
+    if query_params.get('shift_active'):
+        args['shift_active'] = query_params['shift_active'] == 'true'
+        conditions.append("db.shift_active = %(shift_active)s")
+
+    for name, operator in (('min_balance', '>='), ('max_balance', '<=')):
+        if query_params.get(name):
+            args[name] = float(query_params[name])
+            conditions.append(f"COALESCE(pb.rub_balance, db.balance) {operator} %({name})s")
+
+    if query_params.get('cursor'):
+        args['cursor_created_at'], args['cursor_id'] = decode_cursor(query_params['cursor'])
+        conditions.append("(u.created_at, u.id) < (%(cursor_created_at)s, %(cursor_id)s)")
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = f"""SELECT u.id, u.phone, u.full_name, u.role, u.created_at,
+               pb.rub_balance, pb.bonus_balance, db.balance, db.shift_active
+           FROM users u
+           LEFT JOIN passenger_balances pb ON pb.user_id = u.id
+           LEFT JOIN driver_balances db ON db.user_id = u.id
+           {where}
+           ORDER BY u.created_at DESC, u.id DESC
+           LIMIT %(limit)s"""
+    return sql, args, limit
+
+
+@ROUTER.route('POST', 'login', public=True)
+def login(request: router.Request) -> dict:
+    username = str(request.body.get('username', '')).strip()
+    password = str(request.body.get('password', '')).strip()
+    
+    login_ip = rate_limit.client_ip(request.event)
+    limited = LOGIN_LIMITER.check_local(username, login_ip)
+    if limited:
+        return limited
+    
+    if not username or not password:
+        return response.error(400, 'Логин и пароль обязательны')
+    
+    limited = LOGIN_LIMITER.check_shared(request.conn, username, login_ip)
+    if limited:
+        return limited
+    
+    cur = request.cur
+    cur.execute(
+        "SELECT id, username, full_name, password_hash FROM admins WHERE username = %s",
+        (username,)
+    )
+    admin = cur.fetchone()
     
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+    password_ok, needs_rehash = security.verify_password(password, admin[3]) if admin else (False, False)
+    
+    if not password_ok:
+        return response.error(401, 'Неверный логин или пароль')
+    
+    admin_id, username, full_name = admin[:3]
+    
+    if needs_rehash:
+        cur.execute(
+            "UPDATE admins SET password_hash = %s WHERE id = %s",
+            (security.hash_password(password), admin_id)
+        )
+        request.conn.commit()
+    
+    cur.execute("SELECT balance FROM admin_balance")
+    balance_row = cur.fetchone()
+    admin_balance = float(balance_row[0]) if balance_row else 0.00
+    
+    return response.json_response(200, {
+        'success': True,
+        'token': security.issue_token(admin_id, 'admin'),
+        'admin': {
+            'id': admin_id,
+            'username': username,
+            'full_name': full_name,
+            'balance': admin_balance
         }
+    })
+
+
+@ROUTER.route('GET', 'stats', read_only=True)
+def system_stats(request: router.Request) -> dict:
+    cur = request.cur
+    cur.execute(
+        f"""SELECT COALESCE(SUM(new_users), 0),
+           COALESCE(SUM(new_drivers), 0),
+           (SELECT COUNT(*) FROM driver_balances WHERE {SHIFT_ON_SQL}),
+           COALESCE(SUM(orders_count) FILTER (WHERE day = CURRENT_DATE), 0),
+           COALESCE(SUM(income) FILTER (WHERE day = CURRENT_DATE), 0),
+           (SELECT balance FROM admin_balance)
+           FROM daily_stats"""
+    )
+    stats = cur.fetchone()
+    total_users, total_drivers, active_shifts, today_orders = stats[0], stats[1], stats[2], stats[3]
+    today_income = float(stats[4])
+    admin_balance = float(stats[5]) if stats[5] is not None else 0.00
+    
+    return response.json_response(200, {
+        'total_users': total_users,
+        'total_drivers': total_drivers,
+        'active_shifts': active_shifts,
+        'today_orders': today_orders,
+        'today_income': today_income,
+        'admin_balance': admin_balance
+    })
+
+
+@ROUTER.route('POST', 'rebuild_stats')
+def rebuild_stats(request: router.Request) -> dict:
+    request.cur.execute("SELECT rebuild_daily_stats()")
+    days_count = request.cur.fetchone()[0]
+    
+    request.conn.commit()
+    
+    return response.json_response(200, {'success': True, 'days': days_count})
+
+
+@ROUTER.route('GET', 'users', read_only=True)
+def list_users(request: router.Request) -> dict:
+    try:
+        sql, args, limit = users_query(request.query)
+    except ValueError:
+        return response.error(400, 'Некорректные параметры фильтра, cursor или limit')
+    
+    cur = request.cur
+    cur.execute(sql, args)
+    users = cur.fetchall()
+    
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1][4], users[-1][0])
+    
+    return response.json_response(200, {'users': response.rows(USER_COLUMNS, users), 'next_cursor': next_cursor})
+
+
+@ROUTER.route('GET', 'transactions', read_only=True)
+def pending_transactions(request: router.Request) -> dict:
+    cur = request.cur
+    cur.execute(
+        """SELECT t.id, u.phone, t.type, t.amount, t.status, t.created_at
+           FROM transactions t
+           JOIN users u ON t.user_id = u.id
+           WHERE t.status = 'pending'
+           ORDER BY t.created_at DESC LIMIT 50"""
+    )
+    transactions = cur.fetchall()
+    
+    return response.json_response(200, {'transactions': response.rows(TRANSACTION_COLUMNS, transactions)})
+
+
+@ROUTER.route('POST', 'process_transactions')
+def process_transactions(request: router.Request) -> dict:
+    items = request.body.get('items')
+    
+    batch = {}
+    created_at = []
+    if isinstance(items, list) and 0 < len(items) <= BATCH_MAX_ITEMS:
+        for item in items:
+            tx_id = item.get('transaction_id') if isinstance(item, dict) else None
+            tx_action = item.get('action') if isinstance(item, dict) else None
+            if not isinstance(tx_id, int) or tx_action not in ('approve', 'reject'):
+                batch = {}
+                break
+            batch.setdefault(tx_id, tx_action)
+            created_at.append(item.get('created_at'))
     
     try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor()
-        
-        query_params = event.get('queryStringParameters') or {}
-        action = query_params.get('action', '')
-        
-        if action == 'login' and method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            username = body.get('username', '').strip()
-            password = body.get('password', '').strip()
-            
-            if not username or not password:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Логин и пароль обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cur.execute(
-                "SELECT id, username, full_name FROM admins WHERE username = %s AND password_hash = %s",
-                (username, password_hash)
-            )
-            admin = cur.fetchone()
-            
-            if not admin:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неверный логин или пароль'}),
-                    'isBase64Encoded': False
-                }
-            
-            admin_id, username, full_name = admin
-            
-            cur.execute("SELECT balance FROM admin_balance ORDER BY id LIMIT 1")
-            balance_row = cur.fetchone()
-            admin_balance = float(balance_row[0]) if balance_row else 0.00
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'admin': {
-                        'id': admin_id,
-                        'username': username,
-                        'full_name': full_name,
-                        'balance': admin_balance
-                    }
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'stats' and method == 'GET':
-            cur.execute("SELECT COUNT(*) FROM users")
-            total_users = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM users WHERE role = 'driver'")
-            total_drivers = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM driver_balances WHERE shift_active = true")
-            active_shifts = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM orders WHERE DATE(created_at) = CURRENT_DATE")
-            today_orders = cur.fetchone()[0]
-            
-            cur.execute("SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'shift_payment' AND status = 'approved' AND DATE(created_at) = CURRENT_DATE")
-            today_income = float(cur.fetchone()[0])
-            
-            cur.execute("SELECT balance FROM admin_balance ORDER BY id LIMIT 1")
-            balance_row = cur.fetchone()
-            admin_balance = float(balance_row[0]) if balance_row else 0.00
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'total_users': total_users,
-                    'total_drivers': total_drivers,
-                    'active_shifts': active_shifts,
-                    'today_orders': today_orders,
-                    'today_income': today_income,
-                    'admin_balance': admin_balance
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'users' and method == 'GET':
-            cur.execute(
-                """SELECT u.id, u.phone, u.role, u.created_at,
-                   CASE 
-                       WHEN u.role = 'passenger' THEN 
-                           (SELECT CONCAT(pb.rub_balance, '₽ / ', pb.bonus_balance, 'Б') 
-                            FROM passenger_balances pb WHERE pb.user_id = u.id)
-                       WHEN u.role = 'driver' THEN 
-                           (SELECT CONCAT(db.balance, '₽') 
-                            FROM driver_balances db WHERE db.user_id = u.id)
-                   END as balance
-                   FROM users u ORDER BY u.created_at DESC LIMIT 100"""
-            )
-            users = cur.fetchall()
-            
-            users_list = []
-            for user in users:
-                users_list.append({
-                    'id': user[0],
-                    'phone': user[1],
-                    'role': user[2],
-                    'balance': user[4] or '0₽',
-                    'status': 'active',
-                    'created_at': user[3].isoformat() if user[3] else None
-                })
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'users': users_list}),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'transactions' and method == 'GET':
-            cur.execute(
-                """SELECT t.id, u.phone, t.type, t.amount, t.status, t.created_at
-                   FROM transactions t
-                   JOIN users u ON t.user_id = u.id
-                   WHERE t.status = 'pending'
-                   ORDER BY t.created_at DESC LIMIT 50"""
-            )
-            transactions = cur.fetchall()
-            
-            tx_list = []
-            for tx in transactions:
-                tx_list.append({
-                    'id': tx[0],
-                    'user': tx[1],
-                    'type': tx[2],
-                    'amount': float(tx[3]),
-                    'status': tx[4],
-                    'date': tx[5].isoformat() if tx[5] else None
-                })
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'transactions': tx_list}),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'process_transaction' and method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            transaction_id = body.get('transaction_id')
-            tx_action = body.get('action')
-            
-            if not transaction_id or not tx_action:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'transaction_id и action обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "SELECT user_id, type, amount FROM transactions WHERE id = %s",
-                (transaction_id,)
-            )
-            tx = cur.fetchone()
-            
-            if not tx:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Транзакция не найдена'}),
-                    'isBase64Encoded': False
-                }
-            
-            user_id, tx_type, amount = tx
-            
-            if tx_action == 'approve':
-                if tx_type == 'deposit_rub':
-                    cur.execute(
-                        "UPDATE passenger_balances SET rub_balance = rub_balance + %s WHERE user_id = %s",
-                        (amount, user_id)
-                    )
-                elif tx_type == 'deposit_bonus':
-                    cur.execute(
-                        "UPDATE passenger_balances SET bonus_balance = bonus_balance + %s WHERE user_id = %s",
-                        (amount, user_id)
-                    )
-                elif tx_type == 'withdrawal':
-                    cur.execute(
-                        "UPDATE driver_balances SET balance = balance - %s WHERE user_id = %s",
-                        (amount, user_id)
-                    )
-                
-                cur.execute(
-                    "UPDATE transactions SET status = 'approved', processed_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (transaction_id,)
-                )
-            else:
-                cur.execute(
-                    "UPDATE transactions SET status = 'rejected', processed_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (transaction_id,)
-                )
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Транзакция обработана'}),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'settings' and method == 'GET':
-            cur.execute("SELECT setting_key, setting_value FROM system_settings")
-            settings = cur.fetchall()
-            
-            settings_dict = {row[0]: row[1] for row in settings}
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(settings_dict),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'update_settings' and method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            
-            for key, value in body.items():
-                cur.execute(
-                    """INSERT INTO system_settings (setting_key, setting_value, updated_at) 
-                       VALUES (%s, %s, CURRENT_TIMESTAMP)
-                       ON CONFLICT (setting_key) DO UPDATE 
-                       SET setting_value = EXCLUDED.setting_value, updated_at = CURRENT_TIMESTAMP""",
-                    (key, str(value))
-                )
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Настройки обновлены'}),
-                'isBase64Encoded': False
-            }
-        
+        since = batch_since(created_at)
+    except (TypeError, ValueError):
+        batch = {}
+    
+    if not batch:
+        return response.error(400, f'Передайте от 1 до {BATCH_MAX_ITEMS} элементов items с transaction_id и action (approve/reject)')
+    
+    cur = request.cur
+    cur.execute(PROCESS_BATCH_SQL, {'ids': list(batch.keys()), 'actions': list(batch.values()), 'since': since})
+    rows = cur.fetchall()
+    
+    request.conn.commit()
+    
+    results = []
+    for tx_id, new_status, previous_status, overdrawn in rows:
+        if new_status:
+            results.append({'transaction_id': tx_id, 'result': new_status})
+        elif overdrawn:
+            results.append({'transaction_id': tx_id, 'result': 'insufficient_funds'})
+        elif previous_status:
+            results.append({'transaction_id': tx_id, 'result': 'skipped', 'status': previous_status})
         else:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Endpoint not found'}),
-                'isBase64Encoded': False
-            }
-    
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+            results.append({'transaction_id': tx_id, 'result': 'not_found'})
+    
+    return response.json_response(200, {
+        'success': True,
+        'processed': sum(1 for r in results if r['result'] in ('approved', 'rejected')),
+        'results': results
+    })
+
+
+@ROUTER.route('POST', 'process_transaction')
+def process_transaction(request: router.Request) -> dict:
+    transaction_id = request.body.get('transaction_id')
+    tx_action = request.body.get('action')
+    
+    try:
+        since = batch_since([request.body.get('created_at')])
+    except (TypeError, ValueError):
+        since = None
+    
+    if (not isinstance(transaction_id, int) or isinstance(transaction_id, bool)
+            or tx_action not in ('approve', 'reject') or since is None):
+        return response.error(400, 'transaction_id и action (approve/reject) обязательны')
+    
+    # Та же пачка из одного элемента: повторное одобрение не меняет баланс дважды
+    cur = request.cur
+    cur.execute(PROCESS_BATCH_SQL, {'ids': [transaction_id], 'actions': [tx_action], 'since': since})
+    _, new_status, previous_status, overdrawn = cur.fetchone()
+    
+    if not new_status:
+        request.conn.rollback()
+        if overdrawn:
+            return response.error(409, 'Недостаточно средств на балансе водителя')
+        if previous_status:
+            return response.error(409, f'Транзакция уже обработана: {previous_status}')
+        return response.error(404, 'Транзакция не найдена')
+    
+    request.conn.commit()
+    
+    return response.json_response(200, {'success': True, 'message': 'Транзакция обработана', 'status': new_status})
+
+
+@ROUTER.route('POST', 'reconcile_ledger')
+def reconcile_ledger(request: router.Request) -> dict:
+    return response.json_response(200, ledger.reconcile(request.conn, bool(request.body.get('full'))))
+
+
+@ROUTER.route('GET', 'settings', read_only=True)
+def get_settings(request: router.Request) -> dict:
+    return response.json_response(200, settings_cache.get_settings(request.cur))
+
+
+@ROUTER.route('POST', 'update_settings')
+def update_settings(request: router.Request) -> dict:
+    cur = request.cur
+    for key, value in request.body.items():
+        cur.execute(
+            """INSERT INTO system_settings (setting_key, setting_value, updated_at) 
+               VALUES (%s, %s, CURRENT_TIMESTAMP)
+               ON CONFLICT (setting_key) DO UPDATE 
+               SET setting_value = EXCLUDED.setting_value, updated_at = CURRENT_TIMESTAMP""",
+            (key, str(value))
+        )
+    
+    request.conn.commit()
+    settings_cache.invalidate()
+    
+    return response.json_response(200, {'success': True, 'message': 'Настройки обновлены'})
+
+
+@instrumentation.instrumented('admin')
+def handler(event: dict, context) -> dict:
+    '''API для административных операций такси-платформы'''
+    return ROUTER.dispatch(event)
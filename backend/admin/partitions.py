@@ -0,0 +1,208 @@
+import csv
+import gzip
+import io
+import os
+import re
+from datetime import date
+
+PARTITIONED_TABLES = ('orders', 'transactions')
+MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', '3'))
+KEEP_MONTHS = int(os.environ.get('PARTITION_KEEP_MONTHS', '24'))
+MIN_KEEP_MONTHS = 2
+ARCHIVE_DIR = os.environ.get('PARTITION_ARCHIVE_DIR', 'archive')
+DETACH_LOCK_TIMEOUT = os.environ.get('PARTITION_LOCK_TIMEOUT', '5s')
+
+# Строки, которые ещё могут измениться: секция с ними в архив не уходит. Брошенные
+# заказы и зависшие поездки заранее закрывает backend/orders/lifecycle.py; заявки
+# pending решает администратор, их список по старым секциям выводит команда open
+OPEN_ROWS = {
+    'orders': "status IN ('pending', 'accepted', 'in_progress')",
+    'transactions': "status = 'pending'"
+}
+
+# Секции <таблица>_pYYYYMM, как их называет create_monthly_partitions, в том числе
+# отсоединённые прошлым прогоном, который не успел выгрузить их и удалить
+PARTITIONS_SQL = """SELECT c.relname, c.relispartition, c.reltuples::BIGINT, pg_total_relation_size(c.oid)
+       FROM pg_class c
+       JOIN pg_namespace n ON n.oid = c.relnamespace
+       WHERE n.nspname = current_schema() AND c.relkind = 'r' AND c.relname ~ %s
+       ORDER BY c.relname"""
+
+
+OPEN_ROWS_LIMIT = 100
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def list_partitions(cur, table: str) -> list:
+    '''[(имя, первый день месяца, присоединена ли, оценка числа строк, байт)] по порядку месяцев'''
+    cur.execute(PARTITIONS_SQL, (f'^{table}_p[0-9]{{6}}$',))
+    partitions = []
+    for name, attached, rows, size in cur.fetchall():
+        suffix = re.search(r'(\d{4})(\d{2})$', name)
+        partitions.append((name, date(int(suffix[1]), int(suffix[2]), 1), attached, max(rows, 0), size))
+    return partitions
+
+
+def ensure(conn, months_ahead: int = MONTHS_AHEAD) -> dict:
+    '''Создаёт недостающие секции от текущего месяца на months_ahead вперёд: {таблица: создано}'''
+    cur = conn.cursor()
+    created = {}
+    for table in PARTITIONED_TABLES:
+        cur.execute(
+            "SELECT create_monthly_partitions(%s, CURRENT_DATE, (CURRENT_DATE + %s * INTERVAL '1 month')::DATE)",
+            (table, months_ahead)
+        )
+        created[table] = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return created
+
+
+def export(cur, name: str, path: str) -> int:
+    '''COPY секции в CSV.gz через временный файл; число записей проверяется чтением архива'''
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wb') as archive_file:
+        cur.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', archive_file)
+    with gzip.open(tmp_path, 'rt', encoding='utf-8', newline='') as archive_file:
+        written = sum(1 for _ in csv.reader(archive_file)) - 1
+    with open(tmp_path, 'rb') as archive_file:
+        os.fsync(archive_file.fileno())
+    os.replace(tmp_path, path)
+    return written
+
+
+def archive_partition(conn, table: str, name: str, month: date, attached: bool, directory: str):
+    '''Отсоединяет секцию, выгружает её в directory/<имя>.csv.gz и удаляет; None — секция пропущена.
+
+    Отсоединение — короткая транзакция с lock_timeout: DETACH берёт на родителе
+    блокировку, которая ждёт текущие запросы и задерживает новые. Выгрузка
+    идёт уже из отдельной таблицы, обработчики её не видят и не пишут в неё.
+    Если выгрузка прервалась, секция остаётся отсоединённой и подбирается
+    следующим прогоном; удаляется она только после сверки числа строк.
+    '''
+    cur = conn.cursor()
+    cur.execute(f'SELECT EXISTS (SELECT 1 FROM "{name}" WHERE {OPEN_ROWS[table]})')
+    if cur.fetchone()[0]:
+        conn.rollback()
+        cur.close()
+        return None
+
+    if attached:
+        cur.execute("SET LOCAL lock_timeout = %s", (DETACH_LOCK_TIMEOUT,))
+        cur.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+        conn.commit()
+
+    path = os.path.join(directory, f'{name}.csv.gz')
+    written = export(cur, name, path)
+    cur.execute(f'SELECT COUNT(*) FROM "{name}"')
+    rows = cur.fetchone()[0]
+    if written != rows:
+        conn.rollback()
+        cur.close()
+        raise RuntimeError(f'{name}: в архиве {written} строк из {rows}, секция не удалена')
+
+    cur.execute(
+        """INSERT INTO archived_partitions (partition_name, parent_table, range_from, range_to, rows_count, archive_file)
+           VALUES (%s, %s, %s, %s, %s, %s)
+           ON CONFLICT (partition_name) DO UPDATE
+           SET rows_count = EXCLUDED.rows_count, archive_file = EXCLUDED.archive_file,
+               archived_at = CURRENT_TIMESTAMP""",
+        (name, table, month, add_months(month, 1), rows, os.path.abspath(path))
+    )
+    cur.execute(f'DROP TABLE "{name}"')
+    conn.commit()
+    cur.close()
+    return rows, path
+
+
+def stale_partitions(cur, keep_months: int) -> list:
+    '''[(таблица, секция, месяц, присоединена ли)] старше keep_months полных месяцев и отсоединённые остатки'''
+    cutoff = add_months(date.today().replace(day=1), -keep_months)
+    return [
+        (table, name, month, attached)
+        for table in PARTITIONED_TABLES
+        for name, month, attached, _, _ in list_partitions(cur, table)
+        if month < cutoff or not attached
+    ]
+
+
+def open_rows(conn, keep_months: int = KEEP_MONTHS, limit: int = OPEN_ROWS_LIMIT) -> list:
+    '''Строки, из-за которых старые секции не выгружаются: [(секция, id, статус, created_at)]'''
+    cur = conn.cursor()
+    rows = []
+    for table, name, _, _ in stale_partitions(cur, keep_months):
+        cur.execute(
+            f'SELECT id, status, created_at FROM "{name}" WHERE {OPEN_ROWS[table]} ORDER BY created_at LIMIT %s',
+            (limit,)
+        )
+        rows.extend((name, *row) for row in cur.fetchall())
+    conn.rollback()
+    cur.close()
+    return rows
+
+
+def archive(conn, directory: str = ARCHIVE_DIR, keep_months: int = KEEP_MONTHS, dry_run: bool = False) -> list:
+    '''Выгружает секции месяцев старше keep_months полных месяцев и отсоединённые остатки.
+
+    Возвращает [(секция, строк или None, файл или причина пропуска)].
+    '''
+    if keep_months < MIN_KEEP_MONTHS:
+        raise ValueError(f'keep_months не меньше {MIN_KEEP_MONTHS}: в последних месяцах ещё идут поездки')
+    os.makedirs(directory, exist_ok=True)
+
+    cur = conn.cursor()
+    candidates = stale_partitions(cur, keep_months)
+    conn.rollback()
+    cur.close()
+
+    results = []
+    for table, name, month, attached in candidates:
+        if dry_run:
+            results.append((name, None, 'будет выгружена'))
+            continue
+        archived = archive_partition(conn, table, name, month, attached, directory)
+        results.append((name, *archived) if archived else (name, None, 'есть незавершённые строки, см. команду open'))
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Помесячные секции orders и transactions: создание и архивирование')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ensure_parser = commands.add_parser('ensure', help='создать секции на месяцы вперёд (запускать ежедневно)')
+    ensure_parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD)
+    commands.add_parser('list', help='секции, их размер и оценка числа строк')
+    open_parser = commands.add_parser('open', help='незавершённые строки, которые держат старые секции')
+    open_parser.add_argument('--keep-months', type=int, default=KEEP_MONTHS)
+    open_parser.add_argument('--limit', type=int, default=OPEN_ROWS_LIMIT, help='строк на секцию')
+    archive_parser = commands.add_parser('archive', help='выгрузить старые секции в CSV.gz и удалить')
+    archive_parser.add_argument('--keep-months', type=int, default=KEEP_MONTHS)
+    archive_parser.add_argument('--dir', default=ARCHIVE_DIR)
+    archive_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    if args.command == 'ensure':
+        for table, created in ensure(conn, args.months_ahead).items():
+            print(f'{table}: создано секций {created}')
+    elif args.command == 'list':
+        cur = conn.cursor()
+        for table in PARTITIONED_TABLES:
+            for name, month, attached, rows, size in list_partitions(cur, table):
+                state = '' if attached else ' (отсоединена)'
+                print(f'{name}: {month:%Y-%m}, ~{rows} строк, {size / 2 ** 20:.1f} МБ{state}')
+        cur.close()
+    elif args.command == 'open':
+        for name, row_id, status, created_at in open_rows(conn, args.keep_months, args.limit):
+            print(f'{name}: id {row_id}, {status}, создана {created_at:%Y-%m-%d %H:%M}')
+    else:
+        ensure(conn)
+        for name, rows, detail in archive(conn, args.dir, args.keep_months, args.dry_run):
+            print(f'{name}: {detail}' if rows is None else f'{name}: {rows} строк -> {detail}')
+    conn.close()
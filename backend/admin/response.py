@@ -0,0 +1,101 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+_preflight_cache = {}
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+if orjson is not None:
+    def dumps(payload) -> str:
+        '''JSON через orjson: datetime кодируется нативно, Decimal — через float'''
+        return orjson.dumps(payload, default=_default).decode()
+else:
+    _encoder = json.JSONEncoder(default=_default)
+
+    def dumps(payload) -> str:
+        '''JSON со встроенной обработкой Decimal и datetime из строк psycopg2'''
+        return _encoder.encode(payload)
+
+
+def json_response(status_code: int, payload) -> dict:
+    return {
+        'statusCode': status_code,
+        'headers': JSON_HEADERS,
+        'body': dumps(payload),
+        'isBase64Encoded': False
+    }
+
+
+def error(status_code: int, message: str) -> dict:
+    return json_response(status_code, {'error': message})
+
+
+def rows(columns: tuple, result) -> list:
+    return [dict(zip(columns, row)) for row in result]
+
+
+def preflight(methods: str, headers: str) -> dict:
+    '''Ответ на CORS preflight; заголовки собираются один раз на контейнер'''
+    key = (methods, headers)
+    if key not in _preflight_cache:
+        _preflight_cache[key] = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': headers,
+            'Access-Control-Max-Age': '86400'
+        }
+    return {
+        'statusCode': 200,
+        'headers': _preflight_cache[key],
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+
+if __name__ == '__main__':
+    import timeit
+
+    columns = ('id', 'from_address', 'to_address', 'amount', 'final_price', 'discount',
+               'payment_method', 'status', 'created_at')
+    sample = (1, 'ул. Ленина, 1', 'ул. Мира, 5', Decimal('500.00'), Decimal('350.00'),
+              Decimal('150.00'), 'rub', 'completed', datetime(2025, 1, 2, 3, 4, 5, 6))
+
+    def per_row_dicts(result):
+        orders_list = []
+        for order in result:
+            orders_list.append({
+                'id': order[0],
+                'from_address': order[1],
+                'to_address': order[2],
+                'amount': float(order[3]),
+                'final_price': float(order[4]),
+                'discount': float(order[5]),
+                'payment_method': order[6],
+                'status': order[7],
+                'created_at': order[8].isoformat() if order[8] else None
+            })
+        return json.dumps({'orders': orders_list})
+
+    print(f"кодировщик: {'orjson' if orjson is not None else 'json'}")
+    for size in (50, 500, 5000):
+        result = [sample] * size
+        runs = max(10, 20000 // size)
+        baseline = timeit.timeit(lambda: per_row_dicts(result), number=runs) / runs
+        encoded = timeit.timeit(lambda: json_response(200, {'orders': rows(columns, result)}), number=runs) / runs
+        print(f'{size:>5} строк: словари построчно {baseline * 1e3:.3f} мс, '
+              f'rows + json_response {encoded * 1e3:.3f} мс')
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import response
+
+MEMORY_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# Сколько доверенных прокси дописывают X-Forwarded-For; 0 — заголовку не верить
+TRUSTED_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXY_HOPS', '0'))
+
+
+def parse_limit(value: str) -> tuple:
+    '''"5/300" -> ёмкость 5 попыток, восполняемых за 300 секунд: (5.0, 5 / 300)'''
+    burst, period = value.split('/')
+    return float(burst), float(burst) / float(period)
+
+
+IDENTITY_LIMIT = parse_limit(os.environ.get('LOGIN_RATE_LIMIT_IDENTITY', '5/300'))
+IP_LIMIT = parse_limit(os.environ.get('LOGIN_RATE_LIMIT_IP', '30/60'))
+
+
+class MemoryStore:
+    '''Корзины токенов в памяти контейнера; самые давно не тронутые вытесняются'''
+
+    def __init__(self, max_keys: int = MEMORY_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, capacity: float, rate: float, cur=None) -> float:
+        '''0 — попытка разрешена, иначе через сколько секунд появится токен'''
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / rate
+
+
+class PostgresStore:
+    '''Общие для всех контейнеров корзины в UNLOGGED-таблице, одно обращение на проверку'''
+
+    CONSUME_SQL = """INSERT INTO rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+           VALUES (%(key)s, %(capacity)s - 1, %(now)s)
+           ON CONFLICT (bucket_key) DO UPDATE
+           SET tokens = LEAST(%(capacity)s, b.tokens + (%(now)s - b.updated_at) * %(rate)s) - 1,
+               updated_at = %(now)s
+           WHERE LEAST(%(capacity)s, b.tokens + (%(now)s - b.updated_at) * %(rate)s) >= 1
+           RETURNING tokens"""
+
+    def consume(self, key: str, capacity: float, rate: float, cur=None) -> float:
+        cur.execute(self.CONSUME_SQL, {'key': key, 'capacity': capacity, 'rate': rate, 'now': time.time()})
+        return 0.0 if cur.fetchone() else 1 / rate
+
+
+STORES = {
+    'memory': MemoryStore,
+    'postgres': PostgresStore
+}
+
+
+def client_ip(event: dict) -> str:
+    '''Адрес для лимита по IP: sourceIp шлюза, иначе адрес, дописанный доверенным прокси.
+
+    Начало X-Forwarded-For задаёт клиент, по нему лимит обходится сменой
+    заголовка. Берётся только элемент, добавленный первым из TRUSTED_PROXY_HOPS
+    доверенных прокси, считая с конца; без них все такие запросы делят ключ unknown.
+    '''
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    if TRUSTED_PROXY_HOPS > 0:
+        for name, value in (event.get('headers') or {}).items():
+            if name.lower() == 'x-forwarded-for' and value:
+                hops = [hop.strip() for hop in value.split(',')]
+                if len(hops) >= TRUSTED_PROXY_HOPS and hops[-TRUSTED_PROXY_HOPS]:
+                    return hops[-TRUSTED_PROXY_HOPS]
+    return 'unknown'
+
+
+def too_many_requests(retry_after: float) -> dict:
+    result = response.error(429, 'Слишком много попыток входа, попробуйте позже')
+    result['headers'] = {**result['headers'], 'Retry-After': str(max(1, int(retry_after + 0.999)))}
+    return result
+
+
+class LoginLimiter:
+    '''Token bucket на идентификатор (телефон, логин) и на IP для попыток входа.
+
+    Первая проверка — в памяти контейнера, до соединения с базой: всплеск
+    подбора паролей отсекается без обращения к Postgres. Если задан общий
+    бэкенд (RATE_LIMIT_BACKEND=postgres), прошедшие её попытки проверяются
+    ещё и по общим корзинам, чтобы лимит не умножался на число контейнеров.
+    '''
+
+    def __init__(self, scope: str, backend: str = None):
+        self.scope = scope
+        self.local = MemoryStore()
+        backend = backend or os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+        self.shared = None if backend == 'memory' else STORES[backend]()
+
+    def _keys(self, identity: str, ip: str) -> tuple:
+        return (
+            (f'{self.scope}:id:{identity}', IDENTITY_LIMIT),
+            (f'{self.scope}:ip:{ip}', IP_LIMIT)
+        )
+
+    def check_local(self, identity: str, ip: str):
+        '''Ответ 429 или None; к базе не обращается'''
+        for key, (capacity, rate) in self._keys(identity, ip):
+            retry_after = self.local.consume(key, capacity, rate)
+            if retry_after:
+                return too_many_requests(retry_after)
+        return None
+
+    def check_shared(self, conn, identity: str, ip: str):
+        '''Ответ 429 или None по общим корзинам; расход токенов фиксируется сразу'''
+        if self.shared is None:
+            return None
+        cur = conn.cursor()
+        retry_after = 0.0
+        for key, (capacity, rate) in self._keys(identity, ip):
+            retry_after = self.shared.consume(key, capacity, rate, cur)
+            if retry_after:
+                break
+        conn.commit()
+        cur.close()
+        return too_many_requests(retry_after) if retry_after else None
+
+
+if __name__ == '__main__':
+    import timeit
+
+    limiter = LoginLimiter('bench', backend='memory')
+    for _ in range(int(IDENTITY_LIMIT[0]) + 1):
+        limiter.check_local('+79990000000', '10.0.0.1')
+
+    runs = 200000
+    rejected = timeit.timeit(lambda: limiter.check_local('+79990000000', '10.0.0.1'), number=runs) / runs
+    assert limiter.check_local('+79990000000', '10.0.0.1')['statusCode'] == 429
+
+    phones = [f'+7999{n:07d}' for n in range(runs)]
+    iterator = iter(phones)
+    ips = [f'10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}' for n in range(runs)]
+    ip_iterator = iter(ips)
+    allowed = timeit.timeit(lambda: limiter.check_local(next(iterator), next(ip_iterator)), number=runs) / runs
+
+    print(f'отклонённая попытка: {rejected * 1e6:.2f} мкс')
+    print(f'разрешённая попытка (новые корзины): {allowed * 1e6:.2f} мкс')
@@ -0,0 +1,273 @@
+import os
+import threading
+import time
+import instrumentation
+
+# Драйвер грузится при создании пула, то есть при первом соединении: холодный
+# старт, preflight и отказы валидации обходятся без импорта psycopg2
+psycopg2 = None
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '5'))
+
+READ_DSN = os.environ.get('DATABASE_READ_URL')
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK_INTERVAL', '1'))
+REPLICA_RETRY_INTERVAL = float(os.environ.get('DB_REPLICA_RETRY_INTERVAL', '30'))
+RECENT_WRITERS_MAX_KEYS = 10000
+
+# Отставание реплики в секундах. Если всё полученное уже применено, реплика
+# догнала основную базу, даже когда там давно не было записей и время последней
+# применённой транзакции старое. Для обычного (не standby) сервера отставание 0.
+REPLICA_LAG_SQL = """SELECT CASE
+           WHEN NOT pg_is_in_recovery() THEN 0
+           WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+           ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END"""
+
+
+def load_driver():
+    global psycopg2
+    if psycopg2 is None:
+        import psycopg2.extensions
+    return psycopg2
+
+
+class PoolExhausted(Exception):
+    '''Все соединения пула заняты дольше допустимого времени ожидания'''
+
+
+class ConnectionPool:
+    '''Пул соединений с PostgreSQL, переживающий вызовы в тёплом контейнере'''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT,
+                 check_interval: float = POOL_CHECK_INTERVAL,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT):
+        load_driver()
+        self.dsn = dsn
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        '''Выдаёт живое соединение: из простаивающих или новое, если есть место'''
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    conn, released_at = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted('Нет свободных соединений с базой данных')
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, released_at):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = psycopg2.connect(self.dsn, cursor_factory=instrumentation.cursor_class())
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        instrumentation.record_acquire(time.perf_counter() - started)
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        '''Возвращает соединение в пул, откатывая незавершённую транзакцию'''
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed:
+            self._close(conn)
+        with self._cond:
+            self._in_use -= 1
+            if not discard and not conn.closed:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        fresh = []
+        for conn, released_at in self._idle:
+            if conn.closed or now - released_at > self.idle_timeout:
+                self._close(conn)
+            else:
+                fresh.append((conn, released_at))
+        self._idle = fresh
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    '''Пул создаётся при первом вызове и переиспользуется тёплым контейнером'''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ.get('DATABASE_URL'))
+    return _pool
+
+
+def acquire():
+    return get_pool().acquire()
+
+
+def release(conn, discard: bool = False):
+    get_pool().release(conn, discard)
+
+
+class ReadRouter:
+    '''Выбор базы для чтения: реплика или основная.
+
+    На основную чтение уходит, если реплика недоступна (после ошибки она не
+    используется retry_interval секунд), отстаёт больше max_lag или если
+    этот же пользователь писал в контейнере за последние max_lag секунд —
+    так он видит свои записи. Отставание проверяется не чаще раза в
+    check_interval на том соединении, которое и обслужит запрос.
+    '''
+
+    def __init__(self, primary: ConnectionPool, replica: ConnectionPool, max_lag: float = REPLICA_MAX_LAG,
+                 check_interval: float = REPLICA_LAG_CHECK_INTERVAL,
+                 retry_interval: float = REPLICA_RETRY_INTERVAL, clock=time.monotonic):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.lag = 0.0
+        self._checked_at = None
+        self._down_until = 0.0
+        self._writes = {}
+        self._lock = threading.Lock()
+
+    def note_write(self, key):
+        now = self.clock()
+        with self._lock:
+            self._writes[key] = now
+            if len(self._writes) > RECENT_WRITERS_MAX_KEYS:
+                self._writes = {k: at for k, at in self._writes.items() if now - at <= self.max_lag}
+
+    def _check_due(self, now: float) -> bool:
+        return self._checked_at is None or now - self._checked_at >= self.check_interval
+
+    def _use_replica(self, key, now: float) -> bool:
+        with self._lock:
+            if now < self._down_until:
+                return False
+            wrote_at = self._writes.get(key) if key is not None else None
+            if wrote_at is not None and now - wrote_at <= self.max_lag:
+                return False
+        # Отставшая реплика пробуется снова, когда подходит время перепроверки
+        return self.lag <= self.max_lag or self._check_due(now)
+
+    def acquire(self, key=None) -> tuple:
+        '''(соединение, пул, в который его вернуть)'''
+        now = self.clock()
+        if not self._use_replica(key, now):
+            return self.primary.acquire(), self.primary
+
+        conn = None
+        try:
+            conn = self.replica.acquire()
+            if self._check_due(now):
+                cur = conn.cursor()
+                cur.execute(REPLICA_LAG_SQL)
+                lag = float(cur.fetchone()[0])
+                cur.close()
+                conn.rollback()
+                with self._lock:
+                    self.lag, self._checked_at = lag, now
+        except PoolExhausted:
+            return self.primary.acquire(), self.primary
+        except Exception:
+            if conn is not None:
+                self.replica.release(conn, discard=True)
+            with self._lock:
+                self._down_until = now + self.retry_interval
+            return self.primary.acquire(), self.primary
+
+        if self.lag > self.max_lag:
+            self.replica.release(conn)
+            return self.primary.acquire(), self.primary
+        instrumentation.record_replica()
+        return conn, self.replica
+
+
+_read_router = None
+_read_router_lock = threading.Lock()
+
+
+def get_read_router():
+    '''Маршрутизатор чтения или None, если DATABASE_READ_URL не задан'''
+    global _read_router
+    if _read_router is None and READ_DSN:
+        with _read_router_lock:
+            if _read_router is None:
+                _read_router = ReadRouter(get_pool(), ConnectionPool(READ_DSN))
+    return _read_router
+
+
+def acquire_read(key=None) -> tuple:
+    '''Соединение для запроса только на чтение: (соединение, пул для возврата)'''
+    read_router = get_read_router()
+    if read_router is None:
+        pool = get_pool()
+        return pool.acquire(), pool
+    return read_router.acquire(key)
+
+
+def note_write(key):
+    '''Отмечает запись пользователя, чтобы его ближайшие чтения шли на основную базу'''
+    if READ_DSN and key is not None:
+        get_read_router().note_write(key)
@@ -1,188 +1,191 @@
-import json
-import os
-import psycopg2
+import idempotency
+import instrumentation
+import response
+import router
+import settings_cache
+import shifts
 
-def handler(event: dict, context) -> dict:
-    '''API для управления балансами пользователей'''
+ROUTER = router.Router(
+    'GET, POST, OPTIONS', 'Content-Type, X-User-Id, X-Auth-Token, Idempotency-Key',
+    roles=('passenger', 'driver'), action_in_body=True
+)
+
+
+def begin_idempotent(request: router.Request) -> tuple:
+    '''(ключ, ответ): ответ — сохранённый под ключом или ошибка, None — операцию выполнять'''
+    try:
+        idempotency_key = idempotency.get_key(request.event)
+    except idempotency.InvalidKey:
+        raise router.HTTPError(400, f'Idempotency-Key должен быть от 1 до {idempotency.KEY_MAX_LENGTH} символов')
     
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not idempotency_key:
+        return None, None
     
-    try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor()
+    replay = idempotency.begin(request.cur, request.user_id, idempotency_key,
+                               f'balance.{request.action}', request.body)
+    return idempotency_key, replay
+
+
+def requested_amount(request: router.Request):
+    amount = request.body.get('amount', 0)
+    if amount <= 0:
+        raise router.HTTPError(400, 'amount обязателен')
+    return amount
+
+
+@ROUTER.route('GET', read_only=True)
+def get_balance(request: router.Request) -> dict:
+    cur = request.cur
+    
+    if request.role == 'passenger':
+        cur.execute(
+            "SELECT bonus_balance, rub_balance FROM passenger_balances WHERE user_id = %s",
+            (request.user_id,)
+        )
+        balance = cur.fetchone()
         
-        if method == 'GET':
-            query_params = event.get('queryStringParameters') or {}
-            user_id = query_params.get('user_id')
-            role = query_params.get('role', 'passenger')
-            
-            if not user_id:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            if role == 'passenger':
-                cur.execute(
-                    "SELECT bonus_balance, rub_balance FROM passenger_balances WHERE user_id = %s",
-                    (user_id,)
-                )
-                balance = cur.fetchone()
-                
-                if balance:
-                    result = {
-                        'bonus': float(balance[0]),
-                        'rub': float(balance[1])
-                    }
-                else:
-                    result = {'bonus': 0.00, 'rub': 0.00}
-            else:
-                cur.execute(
-                    "SELECT balance, shift_active, shift_ends_at FROM driver_balances WHERE user_id = %s",
-                    (user_id,)
-                )
-                balance = cur.fetchone()
-                
-                if balance:
-                    result = {
-                        'balance': float(balance[0]),
-                        'shift_active': balance[1],
-                        'shift_ends_at': balance[2].isoformat() if balance[2] else None
-                    }
-                else:
-                    result = {'balance': 0.00, 'shift_active': False, 'shift_ends_at': None}
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(result),
-                'isBase64Encoded': False
+        if balance:
+            result = {
+                'bonus': float(balance[0]),
+                'rub': float(balance[1])
             }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            user_id = body.get('user_id')
-            amount = body.get('amount', 0)
-            balance_type = body.get('balance_type', 'rub')
-            
-            if not user_id or amount <= 0:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id и amount обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            if action == 'deposit':
-                cur.execute(
-                    """INSERT INTO transactions (user_id, type, amount, status) 
-                       VALUES (%s, %s, %s, %s) RETURNING id""",
-                    (user_id, f'deposit_{balance_type}', amount, 'pending')
-                )
-                transaction_id = cur.fetchone()[0]
-                
-                conn.commit()
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'message': 'Заявка на пополнение создана',
-                        'transaction_id': transaction_id
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'withdraw':
-                cur.execute(
-                    "SELECT balance FROM driver_balances WHERE user_id = %s",
-                    (user_id,)
-                )
-                balance = cur.fetchone()
-                
-                if not balance or float(balance[0]) < amount:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Недостаточно средств'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    """INSERT INTO transactions (user_id, type, amount, status) 
-                       VALUES (%s, %s, %s, %s) RETURNING id""",
-                    (user_id, 'withdrawal', amount, 'pending')
-                )
-                transaction_id = cur.fetchone()[0]
-                
-                conn.commit()
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'message': 'Заявка на вывод создана',
-                        'transaction_id': transaction_id
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неизвестное действие'}),
-                    'isBase64Encoded': False
-                }
-        
         else:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
+            result = {'bonus': 0.00, 'rub': 0.00}
+    else:
+        cur.execute(
+            f"""SELECT balance, {shifts.SHIFT_ON_SQL}, shift_ends_at
+               FROM driver_balances WHERE user_id = %s""",
+            (request.user_id,)
+        )
+        balance = cur.fetchone()
+        
+        if balance:
+            result = {
+                'balance': float(balance[0]),
+                'shift_active': balance[1],
+                'shift_ends_at': balance[2].isoformat() if balance[2] else None
             }
+        else:
+            result = {'balance': 0.00, 'shift_active': False, 'shift_ends_at': None}
+    
+    return response.json_response(200, result)
+
+
+@ROUTER.route('POST', 'buy_shift', roles=('driver',), forbidden='Доступно только водителям')
+def buy_shift(request: router.Request) -> dict:
+    user_id = request.user_id
+    idempotency_key, replay = begin_idempotent(request)
+    if replay:
+        return replay
+    
+    cur = request.cur
+    shift_cost = float(settings_cache.get_setting(cur, 'shift_cost'))
+    shift_hours = float(settings_cache.get_setting(cur, 'shift_hours'))
+    purchased = shifts.buy_shift(cur, user_id, shift_cost, shift_hours)
+    
+    if not purchased:
+        request.conn.rollback()
+        cur.execute(
+            f"SELECT {shifts.SHIFT_ON_SQL} FROM driver_balances WHERE user_id = %s",
+            (user_id,)
+        )
+        row = cur.fetchone()
+        if not row:
+            status_code, error = 400, 'Баланс не найден'
+        elif row[0]:
+            status_code, error = 409, 'Смена уже активна'
+        else:
+            status_code, error = 400, 'Недостаточно средств'
+        return response.error(status_code, error)
+    
+    result = response.json_response(200, {
+        'success': True,
+        'transaction_id': purchased[0],
+        'shift_cost': shift_cost,
+        'shift_ends_at': purchased[1].isoformat()
+    })
+    if idempotency_key:
+        idempotency.finish(cur, user_id, idempotency_key, result)
     
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
-            'isBase64Encoded': False
-        }
+    request.conn.commit()
+    
+    return result
+
+
+@ROUTER.route('POST', 'deposit')
+def deposit(request: router.Request) -> dict:
+    user_id = request.user_id
+    amount = requested_amount(request)
+    balance_type = request.body.get('balance_type', 'rub')
+    idempotency_key, replay = begin_idempotent(request)
+    if replay:
+        return replay
+    
+    cur = request.cur
+    cur.execute(
+        """INSERT INTO transactions (user_id, type, amount, status) 
+           VALUES (%s, %s, %s, %s) RETURNING id""",
+        (user_id, f'deposit_{balance_type}', amount, 'pending')
+    )
+    transaction_id = cur.fetchone()[0]
+    
+    result = response.json_response(200, {
+        'success': True,
+        'message': 'Заявка на пополнение создана',
+        'transaction_id': transaction_id
+    })
+    if idempotency_key:
+        idempotency.finish(cur, user_id, idempotency_key, result)
+    
+    request.conn.commit()
+    
+    return result
+
+
+@ROUTER.route('POST', 'withdraw')
+def withdraw(request: router.Request) -> dict:
+    user_id = request.user_id
+    amount = requested_amount(request)
+    idempotency_key, replay = begin_idempotent(request)
+    if replay:
+        return replay
+    
+    cur = request.cur
+    cur.execute(
+        "SELECT balance FROM driver_balances WHERE user_id = %s",
+        (user_id,)
+    )
+    balance = cur.fetchone()
+    
+    if not balance or float(balance[0]) < amount:
+        return response.error(400, 'Недостаточно средств')
+    
+    cur.execute(
+        """INSERT INTO transactions (user_id, type, amount, status) 
+           VALUES (%s, %s, %s, %s) RETURNING id""",
+        (user_id, 'withdrawal', amount, 'pending')
+    )
+    transaction_id = cur.fetchone()[0]
+    
+    result = response.json_response(200, {
+        'success': True,
+        'message': 'Заявка на вывод создана',
+        'transaction_id': transaction_id
+    })
+    if idempotency_key:
+        idempotency.finish(cur, user_id, idempotency_key, result)
+    
+    request.conn.commit()
+    
+    return result
+
+
+@ROUTER.route('POST')
+def unknown_action(request: router.Request) -> dict:
+    return response.error(400, 'Неизвестное действие')
+
+
+@instrumentation.instrumented('balance')
+def handler(event: dict, context) -> dict:
+    '''API для управления балансами пользователей'''
+    return ROUTER.dispatch(event)
@@ -0,0 +1,56 @@
+MISMATCH_COLUMNS = ('account_type', 'account_id', 'snapshot_balance', 'ledger_balance')
+MISMATCH_REPORT_LIMIT = 100
+
+# Проводки по типу заявки: счёт пользователя меняется со знаком sign,
+# встречный системный счёт — на ту же сумму с обратным знаком
+TRANSACTION_LEGS = """(VALUES
+               ('deposit_rub', 'passenger_rub', 1, 'external'),
+               ('deposit_bonus', 'passenger_bonus', 1, 'external'),
+               ('withdrawal', 'driver', -1, 'external'),
+               ('shift_payment', 'driver', -1, 'admin')
+           ) AS legs(type, account_type, sign, counter_account)"""
+
+
+def transaction_postings(source: str) -> str:
+    '''INSERT проводок по одобренным заявкам из source (колонки id, user_id, type, amount)'''
+    return f"""INSERT INTO ledger_entries (account_type, account_id, amount, reference_type, reference_id)
+           SELECT leg.account_type, leg.account_id, leg.amount, 'transaction', t.id
+           FROM {source} t
+           JOIN {TRANSACTION_LEGS} ON legs.type = t.type
+           CROSS JOIN LATERAL (VALUES
+               (legs.account_type, t.user_id, legs.sign * t.amount),
+               (legs.counter_account::VARCHAR(20), 0, -legs.sign * t.amount)
+           ) AS leg(account_type, account_id, amount)"""
+
+
+TRANSACTION_POSTING_SQL = transaction_postings(
+    "(SELECT %(id)s::INTEGER AS id, %(user_id)s::INTEGER AS user_id, %(type)s::VARCHAR AS type, "
+    "%(amount)s::DECIMAL AS amount)"
+)
+
+
+def reconcile(conn, full: bool = False) -> dict:
+    '''Сверка снимков балансов с журналом от последней контрольной точки.
+
+    Журнал и балансы читаются в одной транзакции REPEATABLE READ, поэтому
+    вызов должен быть первым в транзакции соединения.
+    '''
+    cur = conn.cursor()
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    cur.execute("SELECT checkpoint_id, accounts_checked, mismatches FROM reconcile_ledger(%s)", (full,))
+    checkpoint_id, accounts_checked, mismatches = cur.fetchone()
+    cur.execute(
+        """SELECT account_type, account_id, snapshot_balance, ledger_balance
+           FROM ledger_mismatches WHERE checkpoint_id = %s
+           ORDER BY account_type, account_id LIMIT %s""",
+        (checkpoint_id, MISMATCH_REPORT_LIMIT)
+    )
+    details = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return {
+        'checkpoint_id': checkpoint_id,
+        'accounts_checked': accounts_checked,
+        'mismatches': mismatches,
+        'details': [dict(zip(MISMATCH_COLUMNS, row)) for row in details]
+    }
@@ -0,0 +1,163 @@
+import json
+import db
+import response
+import security
+
+
+class HTTPError(Exception):
+    '''Ошибка клиента из обработчика или разбора запроса; Router отвечает response.error'''
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def parse_body(event: dict) -> dict:
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPError(400, 'Тело запроса должно быть JSON-объектом')
+    return body
+
+
+class Request:
+    '''Вызов функции: параметры и сессия сразу, тело и соединение с базой — по первому обращению.
+
+    Пока обработчик не тронул conn или cur, пул соединений (а с ним и драйвер
+    psycopg2) не загружается, поэтому отказы валидации обходятся без базы.
+    Запрос только на чтение получает соединение с реплики, если она задана.
+    '''
+
+    def __init__(self, event: dict, method: str, action: str, session, read_only: bool = False):
+        self.event = event
+        self.method = method
+        self.action = action
+        self.query = event.get('queryStringParameters') or {}
+        self.user_id, self.role = session or (None, None)
+        self.read_only = read_only
+        self._body = None
+        self._conn = None
+        self._pool = None
+        self._cur = None
+
+    @property
+    def session_key(self):
+        return (self.role, self.user_id) if self.user_id is not None else None
+
+    @property
+    def body(self) -> dict:
+        if self._body is None:
+            self._body = parse_body(self.event)
+        return self._body
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            if self.read_only:
+                self._conn, self._pool = db.acquire_read(self.session_key)
+            else:
+                self._pool = db.get_pool()
+                self._conn = self._pool.acquire()
+        return self._conn
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    @property
+    def cur(self):
+        if self._cur is None:
+            self._cur = self.conn.cursor()
+        return self._cur
+
+    def close(self):
+        '''Закрывает курсор и возвращает соединение в пул, откатывая незавершённое'''
+        try:
+            if self._cur is not None and not self._cur.closed:
+                self._cur.close()
+        finally:
+            if self._conn is not None:
+                self._pool.release(self._conn)
+
+
+class Router:
+    '''Таблица (метод, action) -> обработчик и общая обвязка вызова.
+
+    OPTIONS отвечает preflight до разбора запроса. Маршрут ищется по точному
+    action, затем по маршруту метода без action; нет ни того, ни другого —
+    404, а для метода без маршрутов — 405. Сессия проверяется до вызова
+    обработчика: roles — допустимые роли функции (401), roles маршрута —
+    его собственные (403). HTTPError превращается в ответ с его статусом,
+    прочие исключения — в 500; соединение, если оно бралось, возвращается в пул.
+    Маршруты read_only читают с реплики; после успешного запроса, который
+    брал соединение с основной базой, чтения того же пользователя какое-то
+    время идут туда же (db.note_write).
+    '''
+
+    def __init__(self, allow_methods: str, allow_headers: str, roles: tuple = None,
+                 unauthorized: str = 'Требуется авторизация', action_in_body: bool = False):
+        self.allow_methods = allow_methods
+        self.allow_headers = allow_headers
+        self.roles = roles
+        self.unauthorized = unauthorized
+        self.action_in_body = action_in_body
+        self.routes = {}
+        self.methods = set()
+
+    def route(self, method: str, action: str = '', roles: tuple = None,
+              forbidden: str = 'Доступ запрещён', public: bool = False, read_only: bool = False):
+        '''Регистрирует обработчик (request) -> dict; action '' — маршрут метода по умолчанию'''
+        def decorator(view):
+            self.routes[(method, action)] = (view, roles, forbidden, public, read_only)
+            self.methods.add(method)
+            return view
+        return decorator
+
+    def resolve_action(self, event: dict, method: str) -> str:
+        action = (event.get('queryStringParameters') or {}).get('action')
+        if not action and self.action_in_body and method == 'POST':
+            action = parse_body(event).get('action')
+        return action or ''
+
+    def dispatch(self, event: dict) -> dict:
+        method = event.get('httpMethod', 'GET')
+
+        if method == 'OPTIONS':
+            return response.preflight(self.allow_methods, self.allow_headers)
+
+        request = None
+        try:
+            action = self.resolve_action(event, method)
+            route = self.routes.get((method, action)) or self.routes.get((method, ''))
+            if route is None:
+                if method in self.methods:
+                    return response.error(404, 'Endpoint not found')
+                return response.error(405, 'Method not allowed')
+            view, roles, forbidden, public, read_only = route
+
+            session = None
+            if self.roles is not None and not public:
+                session = security.authenticate(event)
+                if not session or session[1] not in self.roles:
+                    return response.error(401, self.unauthorized)
+                if roles is not None and session[1] not in roles:
+                    return response.error(403, forbidden)
+
+            request = Request(event, method, action, session, read_only)
+            result = view(request)
+            if not read_only and request.connected and result.get('statusCode', 200) < 400:
+                db.note_write(request.session_key)
+            return result
+
+        except HTTPError as e:
+            return response.error(e.status_code, e.message)
+
+        except Exception as e:
+            return response.error(500, f'Ошибка сервера: {str(e)}')
+
+        finally:
+            if request is not None:
+                request.close()
@@ -0,0 +1,81 @@
+import os
+import time
+import ledger
+
+EXPIRE_BATCH_SIZE = int(os.environ.get('SHIFT_EXPIRE_BATCH_SIZE', '1000'))
+EXPIRE_INTERVAL = float(os.environ.get('SHIFT_EXPIRE_INTERVAL', '60'))
+
+# Смена действует, пока выполнено это условие; то же проверяют баланс водителя
+# и закрытие смен по сроку expire_shifts (V0022)
+SHIFT_ON_SQL = "shift_active = true AND COALESCE(shift_ends_at > CURRENT_TIMESTAMP, false)"
+
+# Покупка смены одним запросом: списание с водителя при достаточном остатке и без
+# открытой смены, заявка shift_payment сразу в статусе approved, зачисление на баланс
+# платформы и проводка. Если списания не было, остальные части ничего не пишут.
+BUY_SHIFT_SQL = f"""WITH debit AS (
+           UPDATE driver_balances
+           SET balance = balance - %(cost)s,
+               shift_active = true,
+               shift_ends_at = CURRENT_TIMESTAMP + %(hours)s * INTERVAL '1 hour',
+               updated_at = CURRENT_TIMESTAMP
+           WHERE user_id = %(driver_id)s AND balance >= %(cost)s
+             AND NOT ({SHIFT_ON_SQL})
+           RETURNING user_id, shift_ends_at
+       ),
+       payment AS (
+           INSERT INTO transactions (user_id, type, amount, status, processed_at)
+           SELECT user_id, 'shift_payment', %(cost)s, 'approved', CURRENT_TIMESTAMP
+           FROM debit
+           RETURNING id, user_id, type, amount
+       ),
+       credit AS (
+           UPDATE admin_balance
+           SET balance = balance + %(cost)s, updated_at = CURRENT_TIMESTAMP
+           WHERE EXISTS (SELECT 1 FROM debit)
+       ),
+       posted AS (
+           {ledger.transaction_postings('payment')}
+       )
+       SELECT payment.id, debit.shift_ends_at FROM debit, payment"""
+
+
+def buy_shift(cur, driver_id: int, cost: float, hours: float):
+    '''(transaction_id, shift_ends_at) или None, если смена не куплена'''
+    cur.execute(BUY_SHIFT_SQL, {'driver_id': driver_id, 'cost': cost, 'hours': hours})
+    return cur.fetchone()
+
+
+def expire_batches(conn, batch_size: int = EXPIRE_BATCH_SIZE) -> int:
+    '''Закрывает все истёкшие смены пачками по batch_size, фиксируя каждую пачку'''
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SELECT expire_shifts(%s)", (batch_size,))
+        closed = cur.fetchone()[0]
+        conn.commit()
+        total += closed
+        if closed < batch_size:
+            break
+    cur.close()
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Закрытие истёкших смен водителей')
+    parser.add_argument('--once', action='store_true', help='один проход вместо бесконечного цикла')
+    parser.add_argument('--batch-size', type=int, default=EXPIRE_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=EXPIRE_INTERVAL)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    while True:
+        started = time.monotonic()
+        closed = expire_batches(conn, args.batch_size)
+        print(f'закрыто смен: {closed} за {(time.monotonic() - started) * 1e3:.1f} мс', flush=True)
+        if args.once:
+            break
+        time.sleep(args.interval)
+    conn.close()
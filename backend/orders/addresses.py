@@ -0,0 +1,191 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+ADDRESS_CACHE_SIZE = int(os.environ.get('ADDRESS_CACHE_SIZE', '10000'))
+RECENT_CACHE_SIZE = int(os.environ.get('RECENT_ADDRESSES_CACHE_SIZE', '2000'))
+RECENT_CACHE_TTL = float(os.environ.get('RECENT_ADDRESSES_CACHE_TTL', '60'))
+RECENT_LIMIT = 5
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 20
+AUTOCOMPLETE_MIN_LENGTH = 2
+
+ADDRESS_COLUMNS = ('id', 'display', 'lat', 'lon')
+
+ABBREVIATIONS = {
+    'улица': 'ул', 'проспект': 'пр', 'пр-т': 'пр', 'переулок': 'пер', 'площадь': 'пл',
+    'шоссе': 'ш', 'бульвар': 'б-р', 'набережная': 'наб', 'микрорайон': 'мкр',
+    'дом': 'д', 'корпус': 'к', 'строение': 'стр'
+}
+
+
+class LRUCache:
+    '''Потокобезопасный LRU на OrderedDict для тёплого контейнера'''
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class NullGeocoder:
+    '''Координаты не определяются: адрес сохраняется без них'''
+    name = 'none'
+
+    def geocode(self, text: str):
+        return None
+
+
+class StubGeocoder:
+    '''Детерминированные координаты в пределах города по хешу адреса — для тестов и стендов'''
+    name = 'stub'
+    center = (55.9650, 43.0700)
+    spread = 0.05
+
+    def geocode(self, text: str):
+        digest = hashlib.sha256(text.encode()).digest()
+        dlat = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF - 0.5
+        dlon = int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF - 0.5
+        return round(self.center[0] + dlat * self.spread, 6), round(self.center[1] + dlon * self.spread, 6)
+
+
+GEOCODERS = {
+    NullGeocoder.name: NullGeocoder,
+    StubGeocoder.name: StubGeocoder
+}
+
+_geocoder = None
+_addresses = LRUCache(ADDRESS_CACHE_SIZE)
+_recent = LRUCache(RECENT_CACHE_SIZE)
+
+
+def register_geocoder(provider):
+    '''Подключает провайдера: класс с атрибутом name и методом geocode(text) -> (lat, lon) | None'''
+    GEOCODERS[provider.name] = provider
+
+
+def get_geocoder():
+    '''Провайдер выбирается переменной GEOCODER, по умолчанию адреса не геокодируются'''
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = GEOCODERS[os.environ.get('GEOCODER', NullGeocoder.name)]()
+    return _geocoder
+
+
+def normalize(text: str) -> str:
+    '''"Ул. Лёнина,  д.1" -> "ул ленина д 1": ключ справочника и строка поиска'''
+    text = text.lower().replace('ё', 'е')
+    tokens = re.sub(r'[^\w\s-]', ' ', text).split()
+    return ' '.join(ABBREVIATIONS.get(token, token) for token in tokens)
+
+
+def resolve(cur, text: str) -> dict:
+    '''Находит адрес в справочнике или заводит новый, геокодируя его один раз.
+
+    Координаты справочника общие для всех пассажиров, поэтому берутся только
+    от геокодера; точки клиента остаются в его заказе.
+    '''
+    key = normalize(text)
+    cached = _addresses.get(key)
+    if cached is not None:
+        return cached
+
+    cur.execute("SELECT id, display, lat, lon FROM addresses WHERE normalized = %s", (key,))
+    row = cur.fetchone()
+    if not row:
+        geocoder = get_geocoder()
+        point = geocoder.geocode(text) or (None, None)
+        cur.execute(
+            """INSERT INTO addresses (normalized, display, lat, lon, provider)
+               VALUES (%s, %s, %s, %s, %s)
+               ON CONFLICT (normalized) DO UPDATE SET normalized = EXCLUDED.normalized
+               RETURNING id, display, lat, lon""",
+            (key, text.strip(), point[0], point[1], geocoder.name)
+        )
+        # Новая строка ещё не зафиксирована: в кэш она попадёт при следующем чтении
+        return dict(zip(ADDRESS_COLUMNS, cur.fetchone()))
+
+    address = dict(zip(ADDRESS_COLUMNS, row))
+    _addresses.put(key, address)
+    return address
+
+
+def get_by_id(cur, address_id: int):
+    cur.execute("SELECT id, display, lat, lon FROM addresses WHERE id = %s", (address_id,))
+    row = cur.fetchone()
+    return dict(zip(ADDRESS_COLUMNS, row)) if row else None
+
+
+def autocomplete(cur, query: str, limit: int = AUTOCOMPLETE_DEFAULT_LIMIT) -> list:
+    '''Сначала совпадения по префиксу, затем похожие по триграммам'''
+    key = normalize(query)
+    if len(key) < AUTOCOMPLETE_MIN_LENGTH:
+        return []
+    prefix = key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    cur.execute(
+        """SELECT id, display, lat, lon FROM addresses
+           WHERE normalized LIKE %(prefix)s OR normalized %% %(key)s
+           ORDER BY normalized LIKE %(prefix)s DESC, similarity(normalized, %(key)s) DESC, id
+           LIMIT %(limit)s""",
+        {'prefix': prefix, 'key': key, 'limit': limit}
+    )
+    return [dict(zip(ADDRESS_COLUMNS, row)) for row in cur.fetchall()]
+
+
+def recent(cur, passenger_id: int) -> dict:
+    '''Недавние и частые адреса пассажира из LRU контейнера, не старше RECENT_CACHE_TTL'''
+    cached = _recent.get(passenger_id)
+    if cached is not None and time.monotonic() - cached[0] < RECENT_CACHE_TTL:
+        return cached[1]
+
+    cur.execute(
+        """(SELECT 'recent', a.id, a.display, a.lat, a.lon FROM passenger_addresses pa
+            JOIN addresses a ON a.id = pa.address_id
+            WHERE pa.passenger_id = %(passenger_id)s
+            ORDER BY pa.last_used_at DESC LIMIT %(limit)s)
+           UNION ALL
+           (SELECT 'frequent', a.id, a.display, a.lat, a.lon FROM passenger_addresses pa
+            JOIN addresses a ON a.id = pa.address_id
+            WHERE pa.passenger_id = %(passenger_id)s
+            ORDER BY pa.uses DESC, pa.last_used_at DESC LIMIT %(limit)s)""",
+        {'passenger_id': passenger_id, 'limit': RECENT_LIMIT}
+    )
+    lists = {'recent': [], 'frequent': []}
+    for row in cur.fetchall():
+        lists[row[0]].append(dict(zip(ADDRESS_COLUMNS, row[1:])))
+    _recent.put(passenger_id, (time.monotonic(), lists))
+    return lists
+
+
+def touch(cur, passenger_id: int, address_ids: list):
+    '''Отмечает использование адресов в заказе и сбрасывает кэш списков пассажира'''
+    values = sorted(set(address_ids))
+    cur.execute(
+        """INSERT INTO passenger_addresses (passenger_id, address_id)
+           SELECT %s, unnest(%s::INTEGER[])
+           ON CONFLICT (passenger_id, address_id)
+           DO UPDATE SET uses = passenger_addresses.uses + 1, last_used_at = CURRENT_TIMESTAMP""",
+        (passenger_id, values)
+    )
+    _recent.discard(passenger_id)
@@ -0,0 +1,303 @@
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+TARIFF_CHECK_INTERVAL = float(os.environ.get('TARIFF_CHECK_INTERVAL', '60'))
+GRID_CELL_DEGREES = 0.01
+EARTH_RADIUS_KM = 6371.0
+
+_engine = None
+_watermark = None
+_checked_at = 0.0
+
+
+def load_numpy():
+    '''numpy нужен только пакетному пересчёту, поэтому не грузится при холодном старте функции'''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def point_in_polygon(lat: float, lon: float, polygon: list) -> bool:
+    '''Трассировка луча: нечётное число пересечений рёбер — точка внутри'''
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+class Zone:
+    __slots__ = ('id', 'name', 'surcharge', 'polygon', 'bbox')
+
+    def __init__(self, zone_id: int, name: str, surcharge: float, polygon: list):
+        self.id = zone_id
+        self.name = name
+        self.surcharge = surcharge
+        self.polygon = [(float(lat), float(lon)) for lat, lon in polygon]
+        lats = [p[0] for p in self.polygon]
+        lons = [p[1] for p in self.polygon]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+
+
+class ZoneIndex:
+    '''Сетка над зонами: ячейка хранит зоны, чей прямоугольник её задевает.
+
+    Поиск — одно обращение к словарю по номеру ячейки и проверка попадания
+    в полигон только для зон-кандидатов этой ячейки.
+    '''
+
+    def __init__(self, zones: list, cell_degrees: float = GRID_CELL_DEGREES):
+        self.zones = zones
+        self.cell = cell_degrees
+        self.cells = {}
+        for zone in zones:
+            min_lat, min_lon, max_lat, max_lon = zone.bbox
+            for i in range(math.floor(min_lat / self.cell), math.floor(max_lat / self.cell) + 1):
+                for j in range(math.floor(min_lon / self.cell), math.floor(max_lon / self.cell) + 1):
+                    self.cells.setdefault((i, j), []).append(zone)
+
+    def lookup(self, lat: float, lon: float) -> list:
+        candidates = self.cells.get((math.floor(lat / self.cell), math.floor(lon / self.cell)))
+        if not candidates:
+            return []
+        return [zone for zone in candidates if point_in_polygon(lat, lon, zone.polygon)]
+
+
+class FareEngine:
+    '''Расчёт стоимости поездки по активному тарифу и тарифным зонам'''
+
+    def __init__(self, tariff: dict, zones: list):
+        self.tariff_id = tariff['id']
+        self.base_fare = float(tariff['base_fare'])
+        self.per_km = float(tariff['per_km'])
+        self.per_minute = float(tariff['per_minute'])
+        self.min_fare = float(tariff['min_fare'])
+        self.night_multiplier = float(tariff['night_multiplier'])
+        self.night_start = int(tariff['night_start_hour'])
+        self.night_end = int(tariff['night_end_hour'])
+        self.utc_offset = timedelta(minutes=int(tariff['utc_offset_minutes']))
+        self.road_factor = float(tariff['road_factor'])
+        self.avg_speed_kmh = float(tariff['avg_speed_kmh'])
+        self.zones = ZoneIndex(zones)
+
+    def is_night(self, at: datetime) -> bool:
+        '''Наивное время (created_at заказов) считается UTC'''
+        at = at.replace(tzinfo=timezone.utc) if at.tzinfo is None else at.astimezone(timezone.utc)
+        hour = (at + self.utc_offset).hour
+        if self.night_start > self.night_end:
+            return hour >= self.night_start or hour < self.night_end
+        return self.night_start <= hour < self.night_end
+
+    def quote(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float,
+              at: datetime = None, surge: dict = None) -> dict:
+        '''surge — {id зоны: коэффициент спроса}; применяется наибольший из зон точки подачи'''
+        distance_km = haversine_km(from_lat, from_lon, to_lat, to_lon) * self.road_factor
+        duration_min = distance_km / self.avg_speed_kmh * 60
+        fare = max(self.base_fare + self.per_km * distance_km + self.per_minute * duration_min, self.min_fare)
+
+        night = self.is_night(at or datetime.now(timezone.utc))
+        if night:
+            fare *= self.night_multiplier
+
+        pickup_zones = self.zones.lookup(from_lat, from_lon)
+        surge_multiplier = max((surge.get(zone.id, 1.0) for zone in pickup_zones), default=1.0) if surge else 1.0
+        fare *= surge_multiplier
+
+        zones = {zone.id: zone for zone in pickup_zones}
+        for zone in self.zones.lookup(to_lat, to_lon):
+            zones.setdefault(zone.id, zone)
+        fare += sum(zone.surcharge for zone in zones.values())
+
+        return {
+            'tariff_id': self.tariff_id,
+            'distance_km': round(distance_km, 2),
+            'duration_min': round(duration_min, 1),
+            'night': night,
+            'surge': surge_multiplier,
+            'zones': [zone.name for zone in zones.values()],
+            'amount': float(round(fare))
+        }
+
+    def quote_batch(self, from_lat, from_lon, to_lat, to_lon, created_at: list) -> list:
+        '''Пересчёт множества поездок: арифметика тарифа векторизована через numpy.
+
+        Зоны по-прежнему ищутся поточечно по сетке. Без numpy считается циклом.
+        '''
+        np = load_numpy()
+        if np is None:
+            return [
+                self.quote(a, b, c, d, at)['amount']
+                for a, b, c, d, at in zip(from_lat, from_lon, to_lat, to_lon, created_at)
+            ]
+
+        lat1, lon1 = np.radians(np.asarray(from_lat, dtype=float)), np.radians(np.asarray(from_lon, dtype=float))
+        lat2, lon2 = np.radians(np.asarray(to_lat, dtype=float)), np.radians(np.asarray(to_lon, dtype=float))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)) * self.road_factor
+        duration_min = distance_km / self.avg_speed_kmh * 60
+        fare = np.maximum(self.base_fare + self.per_km * distance_km + self.per_minute * duration_min, self.min_fare)
+
+        night = np.fromiter((self.is_night(at) for at in created_at), dtype=bool, count=len(created_at))
+        fare = np.where(night, fare * self.night_multiplier, fare)
+
+        surcharges = np.zeros(len(fare))
+        if self.zones.cells:
+            for k, points in enumerate(zip(from_lat, from_lon, to_lat, to_lon)):
+                zones = {zone.id: zone.surcharge for zone in self.zones.lookup(points[0], points[1])}
+                for zone in self.zones.lookup(points[2], points[3]):
+                    zones.setdefault(zone.id, zone.surcharge)
+                surcharges[k] = sum(zones.values())
+
+        return np.round(fare + surcharges).tolist()
+
+
+def load_engine(cur) -> FareEngine:
+    cur.execute(
+        """SELECT id, base_fare, per_km, per_minute, min_fare, night_multiplier, night_start_hour,
+           night_end_hour, utc_offset_minutes, road_factor, avg_speed_kmh
+           FROM tariffs WHERE active = true ORDER BY id DESC LIMIT 1"""
+    )
+    row = cur.fetchone()
+    if not row:
+        raise LookupError('Нет активного тарифа')
+    columns = ('id', 'base_fare', 'per_km', 'per_minute', 'min_fare', 'night_multiplier',
+               'night_start_hour', 'night_end_hour', 'utc_offset_minutes', 'road_factor', 'avg_speed_kmh')
+    tariff = dict(zip(columns, row))
+
+    cur.execute("SELECT id, name, surcharge, polygon FROM tariff_zones WHERE active = true")
+    zones = []
+    for zone_id, name, surcharge, polygon in cur.fetchall():
+        if isinstance(polygon, str):
+            polygon = json.loads(polygon)
+        zones.append(Zone(zone_id, name, float(surcharge), polygon))
+    return FareEngine(tariff, zones)
+
+
+def get_engine(cur) -> FareEngine:
+    '''Тариф и индекс зон строятся раз на тёплый контейнер.
+
+    Не чаще раза в TARIFF_CHECK_INTERVAL секунд сверяется метка изменений
+    тарифов и зон; индекс перестраивается только если она сдвинулась.
+    '''
+    global _engine, _watermark, _checked_at
+    now = time.monotonic()
+    if _engine is not None and now - _checked_at < TARIFF_CHECK_INTERVAL:
+        return _engine
+
+    cur.execute(
+        """SELECT (SELECT MAX(updated_at) FROM tariffs), (SELECT COUNT(*) FROM tariffs),
+           (SELECT MAX(updated_at) FROM tariff_zones), (SELECT COUNT(*) FROM tariff_zones)"""
+    )
+    watermark = tuple(cur.fetchone())
+    if _engine is None or watermark != _watermark:
+        _engine = load_engine(cur)
+        _watermark = watermark
+    _checked_at = now
+    return _engine
+
+
+def parse_point(source: dict, prefix: str):
+    '''Координаты из параметров вида from_lat/from_lon; None, если их нет'''
+    lat, lon = source.get(f'{prefix}_lat'), source.get(f'{prefix}_lon')
+    if lat is None or lon is None or lat == '' or lon == '':
+        return None
+    lat, lon = float(lat), float(lon)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('coordinates out of range')
+    return lat, lon
+
+
+def _reprice(args):
+    import csv
+    import sys
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    engine = load_engine(conn.cursor())
+    cur = conn.cursor(name='reprice_orders')
+    cur.itersize = args.chunk
+    cur.execute(
+        """SELECT id, amount, from_lat, from_lon, to_lat, to_lon, created_at FROM orders
+           WHERE from_lat IS NOT NULL AND to_lat IS NOT NULL AND created_at >= %s
+           ORDER BY id""",
+        (args.since,)
+    )
+    writer = csv.writer(sys.stdout)
+    writer.writerow(('order_id', 'amount', 'new_amount'))
+    while True:
+        rows = cur.fetchmany(args.chunk)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        new_amounts = engine.quote_batch(columns[2], columns[3], columns[4], columns[5], columns[6])
+        for row, new_amount in zip(rows, new_amounts):
+            writer.writerow((row[0], row[1], new_amount))
+    conn.close()
+
+
+def _bench(args):
+    import random
+    import timeit
+
+    tariff = {
+        'id': 1, 'base_fare': 80, 'per_km': 18, 'per_minute': 4, 'min_fare': 150,
+        'night_multiplier': 1.2, 'night_start_hour': 22, 'night_end_hour': 6,
+        'utc_offset_minutes': 180, 'road_factor': 1.3, 'avg_speed_kmh': 30
+    }
+    rng = random.Random(1)
+    zones = []
+    for k in range(args.zones):
+        lat, lon = 55.90 + rng.random() * 0.2, 43.00 + rng.random() * 0.2
+        size = 0.005 + rng.random() * 0.02
+        polygon = [(lat + size * math.cos(t / 6 * math.pi), lon + size * math.sin(t / 6 * math.pi)) for t in range(12)]
+        zones.append(Zone(k, f'зона {k}', 50, polygon))
+    engine = FareEngine(tariff, zones)
+
+    points = [(55.9 + rng.random() * 0.2, 43.0 + rng.random() * 0.2,
+               55.9 + rng.random() * 0.2, 43.0 + rng.random() * 0.2) for _ in range(1000)]
+    at = datetime.now(timezone.utc)
+    runs = 20
+    seconds = timeit.timeit(lambda: [engine.quote(*p, at) for p in points], number=runs)
+    print(f'quote: {seconds / runs / len(points) * 1e6:.1f} мкс на расчёт ({args.zones} зон)')
+
+    size = args.batch
+    batch = [points[k % len(points)] for k in range(size)]
+    columns = list(zip(*batch))
+    started = time.perf_counter()
+    engine.quote_batch(columns[0], columns[1], columns[2], columns[3], [at] * size)
+    elapsed = time.perf_counter() - started
+    print(f"quote_batch ({'numpy' if load_numpy() is not None else 'цикл'}): {size} поездок за {elapsed * 1e3:.1f} мс")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Тарифный движок: замер скорости и пересчёт истории')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench')
+    bench_parser.add_argument('--zones', type=int, default=200)
+    bench_parser.add_argument('--batch', type=int, default=100000)
+    reprice_parser = commands.add_parser('reprice', help='CSV новых цен заказов по активному тарифу')
+    reprice_parser.add_argument('--since', default='1970-01-01')
+    reprice_parser.add_argument('--chunk', type=int, default=50000)
+    args = parser.parse_args()
+    _bench(args) if args.command == 'bench' else _reprice(args)
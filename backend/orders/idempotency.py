@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import response
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+KEY_HEADER = 'idempotency-key'
+KEY_MAX_LENGTH = 64
+PURGE_BATCH_SIZE = 5000
+
+# Ключ занимается вставкой в той же транзакции, что и сама операция: повтор,
+# пришедший параллельно, ждёт на уникальном индексе до её фиксации, а при откате
+# ключ освобождается. Просроченная запись, ещё не удалённая очисткой, занимается заново.
+CLAIM_SQL = """WITH claimed AS (
+           INSERT INTO idempotency_keys (user_id, idempotency_key, scope, request_hash, expires_at)
+           VALUES (%(user_id)s, %(key)s, %(scope)s, %(request_hash)s,
+                   CURRENT_TIMESTAMP + %(ttl)s * INTERVAL '1 hour')
+           ON CONFLICT (user_id, idempotency_key) DO UPDATE
+           SET scope = EXCLUDED.scope, request_hash = EXCLUDED.request_hash,
+               status_code = NULL, response_body = NULL, expires_at = EXCLUDED.expires_at
+           WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+           RETURNING 1
+       )
+       SELECT true, NULL, NULL, NULL, NULL FROM claimed
+       UNION ALL
+       SELECT false, scope, request_hash, status_code, response_body FROM idempotency_keys
+       WHERE user_id = %(user_id)s AND idempotency_key = %(key)s AND NOT EXISTS (SELECT 1 FROM claimed)"""
+
+STORED_SQL = """SELECT false, scope, request_hash, status_code, response_body FROM idempotency_keys
+       WHERE user_id = %(user_id)s AND idempotency_key = %(key)s"""
+
+
+class InvalidKey(ValueError):
+    '''Заголовок Idempotency-Key пустой или длиннее KEY_MAX_LENGTH'''
+
+
+def get_key(event: dict):
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == KEY_HEADER:
+            value = (value or '').strip()
+            if not value or len(value) > KEY_MAX_LENGTH:
+                raise InvalidKey('invalid idempotency key')
+            return value
+    return None
+
+
+def fingerprint(body) -> bytes:
+    return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode()).digest()
+
+
+def begin(cur, user_id: int, key: str, scope: str, body):
+    '''None — ключ занят этим вызовом, иначе готовый ответ: сохранённый или ошибка.
+
+    Обычно это один запрос по первичному ключу; второй нужен, только если
+    вызов ждал параллельный запрос с тем же ключом.
+    '''
+    params = {'user_id': user_id, 'key': key, 'scope': scope,
+              'request_hash': fingerprint(body), 'ttl': IDEMPOTENCY_TTL_HOURS}
+    cur.execute(CLAIM_SQL, params)
+    row = cur.fetchone()
+    if row is None:
+        cur.execute(STORED_SQL, params)
+        row = cur.fetchone()
+    if row is None or row[0]:
+        return None
+
+    _, stored_scope, request_hash, status_code, body_text = row
+    if stored_scope != scope or bytes(request_hash) != params['request_hash']:
+        return response.error(422, 'Idempotency-Key уже использован для другого запроса')
+    if status_code is None:
+        return response.error(409, 'Запрос с этим Idempotency-Key ещё выполняется')
+    return {
+        'statusCode': status_code,
+        'headers': {**response.JSON_HEADERS, 'Idempotent-Replayed': 'true'},
+        'body': body_text,
+        'isBase64Encoded': False
+    }
+
+
+def finish(cur, user_id: int, key: str, result: dict):
+    '''Сохраняет ответ под ключом; фиксируется вместе с операцией'''
+    cur.execute(
+        """UPDATE idempotency_keys SET status_code = %s, response_body = %s
+           WHERE user_id = %s AND idempotency_key = %s""",
+        (result['statusCode'], result['body'], user_id, key)
+    )
+
+
+if __name__ == '__main__':
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SELECT purge_idempotency_keys(%s)", (PURGE_BATCH_SIZE,))
+        deleted = cur.fetchone()[0]
+        conn.commit()
+        total += deleted
+        if deleted < PURGE_BATCH_SIZE:
+            break
+    conn.close()
+    print(f'удалено просроченных ключей: {total}')
@@ -1,201 +1,517 @@
-import json
-import os
-import psycopg2
+import base64
+import math
 from datetime import datetime
+import addresses
+import fare
+import idempotency
+import instrumentation
+import lifecycle
+import matching
+import order_events
+import response
+import router
+import settings_cache
+import surge
 
-def handler(event: dict, context) -> dict:
-    '''API для создания и управления заказами такси'''
+# Проверка баланса, списание и создание заказа одним запросом: UPDATE с условием
+# на остаток блокирует строку баланса, поэтому параллельные заказы одного пассажира
+# не уводят баланс в минус, а при нехватке средств заказ не вставляется.
+# В том же запросе пишется проводка: со счёта пассажира на счёт поездок.
+PAID_ORDER_SQL = {
+    balance_type: f"""WITH debit AS (
+               UPDATE passenger_balances
+               SET {column} = {column} - %(final_price)s, updated_at = CURRENT_TIMESTAMP
+               WHERE user_id = %(passenger_id)s AND {column} >= %(final_price)s
+               RETURNING user_id
+           ),
+           created AS (
+               INSERT INTO orders (passenger_id, from_address, to_address, amount, payment_method,
+                   final_price, discount, comment, from_lat, from_lon, to_lat, to_lon, from_address_id, to_address_id,
+                   surge_multiplier)
+               SELECT user_id, %(from_address)s, %(to_address)s, %(amount)s, %(payment_method)s,
+                   %(final_price)s, %(discount)s, %(comment)s, %(from_lat)s, %(from_lon)s, %(to_lat)s, %(to_lon)s,
+                   %(from_address_id)s, %(to_address_id)s, %(surge_multiplier)s
+               FROM debit
+               RETURNING id, passenger_id
+           ),
+           posted AS (
+               INSERT INTO ledger_entries (account_type, account_id, amount, reference_type, reference_id)
+               SELECT leg.account_type, leg.account_id, leg.amount, 'order', created.id
+               FROM created
+               CROSS JOIN LATERAL (VALUES
+                   ('{account}', created.passenger_id, -%(final_price)s::DECIMAL),
+                   ('trips', 0, %(final_price)s::DECIMAL)
+               ) AS leg(account_type, account_id, amount)
+           )
+           SELECT id FROM created"""
+    for balance_type, column, account in (('bonus', 'bonus_balance', 'passenger_bonus'),
+                                          ('rub', 'rub_balance', 'passenger_rub'))
+}
+
+HISTORY_COLUMNS = ('id', 'from_address', 'to_address', 'amount', 'final_price', 'discount',
+                   'payment_method', 'status', 'created_at')
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 100
+
+PENDING_COLUMNS = ('id', 'from_address', 'to_address', 'final_price', 'payment_method', 'comment', 'created_at')
+DISPATCH_DEFAULT_LIMIT = 20
+DISPATCH_MAX_LIMIT = 100
+
+DRIVERS = ('driver',)
+DRIVERS_ONLY = 'Доступно только водителям'
+
+# Водитель на смене забирает самый старый (или указанный) ожидающий заказ.
+# SKIP LOCKED пропускает строки, которые прямо сейчас забирают другие водители,
+# поэтому параллельные запросы не ждут друг друга и не принимают один заказ дважды.
+# Заказы старше lifecycle.ACTIVE_ORDER_DAYS не раздаются, и секции с ними не читаются.
+# Смена проверяется по matching.SHIFT_ON_SQL, то есть и по сроку окончания.
+CLAIM_ORDER_SQL = f"""WITH candidate AS (
+           SELECT id, created_at FROM orders
+           WHERE status = 'pending' AND created_at >= {lifecycle.ACTIVE_SINCE_SQL}
+             AND (%(order_id)s::INTEGER IS NULL OR id = %(order_id)s::INTEGER)
+             AND EXISTS (
+                 SELECT 1 FROM driver_balances
+                 WHERE user_id = %(driver_id)s AND {matching.SHIFT_ON_SQL}
+             )
+           ORDER BY created_at, id
+           LIMIT 1
+           FOR UPDATE SKIP LOCKED
+       )
+       UPDATE orders o SET status = 'accepted', driver_id = %(driver_id)s
+       FROM candidate
+       WHERE o.id = candidate.id AND o.created_at = candidate.created_at
+         AND o.created_at >= {lifecycle.ACTIVE_SINCE_SQL}
+       RETURNING o.id, o.from_address, o.to_address, o.final_price, o.payment_method, o.comment, o.status"""
+
+
+def encode_cursor(created_at: datetime, order_id: int) -> str:
+    '''Курсор страницы истории: ключ (created_at, id) последнего заказа'''
+    raw = f'{created_at.isoformat()}|{order_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError('invalid cursor') from e
+
+
+ROUTER = router.Router(
+    'GET, POST, PUT, OPTIONS', 'Content-Type, X-User-Id, X-Auth-Token, Idempotency-Key',
+    roles=('passenger', 'driver')
+)
+
+
+@ROUTER.route('GET', 'pending', roles=DRIVERS, forbidden=DRIVERS_ONLY, read_only=True)
+def pending_orders(request: router.Request) -> dict:
+    try:
+        limit = min(max(int(request.query.get('limit', DISPATCH_DEFAULT_LIMIT)), 1), DISPATCH_MAX_LIMIT)
+    except ValueError:
+        limit = DISPATCH_DEFAULT_LIMIT
+    
+    cur = request.cur
+    cur.execute(
+        f"""SELECT id, from_address, to_address, final_price, payment_method, comment, created_at
+           FROM orders WHERE status = 'pending' AND created_at >= {lifecycle.ACTIVE_SINCE_SQL}
+           ORDER BY created_at, id LIMIT %s""",
+        (limit,)
+    )
+    pending = cur.fetchall()
+    
+    return response.json_response(200, {'orders': response.rows(PENDING_COLUMNS, pending)})
+
+
+# Только основная база: уведомления NOTIFY на реплику не доходят
+@ROUTER.route('GET', 'events')
+def order_updates(request: router.Request) -> dict:
+    try:
+        since = order_events.parse_version(request.query.get('since', ''))
+        timeout = float(request.query.get('timeout', order_events.MAX_WAIT_SECONDS))
+    except ValueError:
+        since = None
     
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+    if since is None or not math.isfinite(timeout) or request.role not in order_events.OWNER_COLUMNS:
+        return response.error(400, 'Некорректные параметры since или timeout')
+    
+    events = order_events.wait_for_events(request.conn, request.role, request.user_id, since, timeout)
+    version = events[-1]['version'] if events else order_events.format_version(*since)
+    
+    return response.json_response(200, {'events': events, 'version': version})
+
+
+@ROUTER.route('GET', 'addresses', read_only=True)
+def address_suggestions(request: router.Request) -> dict:
+    search = request.query.get('q', '').strip()
+    
+    if search:
+        try:
+            limit = min(max(int(request.query.get('limit', addresses.AUTOCOMPLETE_DEFAULT_LIMIT)), 1),
+                        addresses.AUTOCOMPLETE_MAX_LIMIT)
+        except ValueError:
+            limit = addresses.AUTOCOMPLETE_DEFAULT_LIMIT
+        result = {'addresses': addresses.autocomplete(request.cur, search, limit)}
+    elif request.role == 'passenger':
+        result = addresses.recent(request.cur, request.user_id)
+    else:
+        return response.error(400, 'Укажите строку поиска q')
+    
+    return response.json_response(200, result)
+
+
+@ROUTER.route('GET', 'quote', read_only=True)
+def fare_quote(request: router.Request) -> dict:
+    try:
+        origin = fare.parse_point(request.query, 'from')
+        destination = fare.parse_point(request.query, 'to')
+    except ValueError:
+        origin = destination = None
+    
+    if not origin or not destination:
+        return response.error(400, 'Укажите координаты from_lat, from_lon, to_lat, to_lon')
+    
+    cur = request.cur
+    engine = fare.get_engine(cur)
+    quote = engine.quote(*origin, *destination, surge=surge.get_multipliers(cur))
+    discount_percent = float(settings_cache.get_setting(cur, 'discount_percent'))
+    quote['discount_percent'] = discount_percent
+    quote['balance_price'] = quote['amount'] - round(quote['amount'] * discount_percent / 100, 2)
+    
+    return response.json_response(200, quote)
+
+
+@ROUTER.route('POST', 'location', roles=DRIVERS, forbidden=DRIVERS_ONLY)
+def driver_location(request: router.Request) -> dict:
+    try:
+        pings = matching.parse_pings(request.body)
+    except (KeyError, TypeError, ValueError):
+        return response.error(400, 'Некорректные координаты')
+    
+    matching.record_pings(request.cur, request.user_id, pings)
+    request.conn.commit()
+    
+    return response.json_response(200, {'success': True, 'recorded': len(pings)})
+
+
+# Только основная база: driver_locations — UNLOGGED-таблица, на реплике её нет
+@ROUTER.route('GET', 'nearby')
+def nearby_drivers(request: router.Request) -> dict:
+    query_params = request.query
+    try:
+        k = min(max(int(query_params.get('k', matching.MATCH_DEFAULT_K)), 1), matching.MATCH_MAX_K)
+        pickup = fare.parse_point(query_params, 'from')
+        order_id = int(query_params['order_id']) if query_params.get('order_id') else None
+    except ValueError:
+        return response.error(400, 'Некорректные параметры')
+    
+    if not order_id and not pickup:
+        return response.error(400, 'Укажите from_lat и from_lon или заказ с координатами')
+    
+    cur = request.cur
+    if order_id:
+        cur.execute(
+            f"""SELECT from_lat, from_lon FROM orders
+               WHERE id = %s AND passenger_id = %s AND created_at >= {lifecycle.ACTIVE_SINCE_SQL}""",
+            (order_id, request.user_id)
+        )
+        row = cur.fetchone()
+        pickup = tuple(row) if row and row[0] is not None else None
+    
+    if not pickup:
+        return response.error(400, 'Укажите from_lat и from_lon или заказ с координатами')
+    
+    drivers = matching.nearest_drivers(cur, pickup[0], pickup[1], k)
+    if request.role == 'passenger':
+        for driver in drivers:
+            del driver['driver_id']
+    
+    return response.json_response(200, {'drivers': drivers})
+
+
+@ROUTER.route('POST', 'claim', roles=DRIVERS, forbidden=DRIVERS_ONLY)
+@ROUTER.route('POST', 'accept', roles=DRIVERS, forbidden=DRIVERS_ONLY)
+def claim_order(request: router.Request) -> dict:
+    driver_id = request.user_id
+    order_id = request.body.get('order_id')
+    if order_id is not None and (not isinstance(order_id, int) or isinstance(order_id, bool) or order_id <= 0):
+        return response.error(400, 'Некорректный order_id')
+    
+    cur = request.cur
+    cur.execute(CLAIM_ORDER_SQL, {'driver_id': driver_id, 'order_id': order_id})
+    claimed = cur.fetchone()
+    
+    if not claimed:
+        request.conn.rollback()
+        cur.execute(
+            f"SELECT 1 FROM driver_balances WHERE user_id = %s AND {matching.SHIFT_ON_SQL}",
+            (driver_id,)
+        )
+        if not cur.fetchone():
+            status_code, error = 403, 'Смена не активна'
+        elif order_id:
+            status_code, error = 409, 'Заказ уже принят другим водителем'
+        else:
+            status_code, error = 404, 'Нет свободных заказов'
+        return response.error(status_code, error)
+    
+    request.conn.commit()
+    
+    return response.json_response(200, {
+        'success': True,
+        'order': {
+            'id': claimed[0],
+            'from_address': claimed[1],
+            'to_address': claimed[2],
+            'final_price': float(claimed[3]),
+            'payment_method': claimed[4],
+            'comment': claimed[5],
+            'status': claimed[6]
         }
+    })
+
+
+def requested_order_id(request: router.Request) -> int:
+    order_id = request.body.get('order_id')
+    if not isinstance(order_id, int) or isinstance(order_id, bool) or order_id <= 0:
+        raise router.HTTPError(400, 'order_id обязателен')
+    return order_id
+
+
+def apply_transition(request: router.Request, action: str, order_id: int, **params) -> tuple:
+    '''Переход заказа одним условным UPDATE; если он не состоялся — 404 или 409 по текущему состоянию'''
+    row = lifecycle.transition(request.cur, action, order_id, request.user_id, **params)
+    
+    if not row:
+        request.conn.rollback()
+        status_code, error = lifecycle.rejection(request.cur, action, order_id, request.user_id)
+        raise router.HTTPError(status_code, error)
+    
+    request.conn.commit()
+    return row
+
+
+@ROUTER.route('POST', 'start', roles=DRIVERS, forbidden=DRIVERS_ONLY)
+def start_trip(request: router.Request) -> dict:
+    order_id, status, started_at = apply_transition(request, 'start', requested_order_id(request))
+    
+    return response.json_response(200, {
+        'success': True,
+        'order': {'id': order_id, 'status': status, 'started_at': started_at}
+    })
+
+
+@ROUTER.route('POST', 'complete', roles=DRIVERS, forbidden=DRIVERS_ONLY)
+def complete_trip(request: router.Request) -> dict:
+    order_id, status, completed_at, total_trips = apply_transition(request, 'complete', requested_order_id(request))
     
+    return response.json_response(200, {
+        'success': True,
+        'order': {'id': order_id, 'status': status, 'completed_at': completed_at},
+        'total_trips': total_trips
+    })
+
+
+@ROUTER.route('POST', 'cancel', roles=('passenger',), forbidden='Отменить заказ может только пассажир')
+def cancel_order(request: router.Request) -> dict:
+    order_id, status, refunded = apply_transition(request, 'cancel', requested_order_id(request))
+    
+    return response.json_response(200, {
+        'success': True,
+        'order': {'id': order_id, 'status': status},
+        'refunded': refunded
+    })
+
+
+@ROUTER.route('POST', 'rate', roles=('passenger',), forbidden='Оценить поездку может только пассажир')
+def rate_trip(request: router.Request) -> dict:
+    order_id = requested_order_id(request)
     try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor()
+        rating, comment = lifecycle.parse_rating(request.body)
+    except ValueError:
+        return response.error(400, f'Оценка — целое от 1 до 5, комментарий до {lifecycle.RATING_COMMENT_MAX_LENGTH} символов')
+    
+    driver_rating, ratings_count = apply_transition(request, 'rate', order_id, rating=rating, comment=comment)
+    
+    return response.json_response(200, {
+        'success': True,
+        'order': {'id': order_id, 'rating': rating},
+        'driver_rating': driver_rating,
+        'driver_ratings_count': ratings_count
+    })
+
+
+@ROUTER.route('POST', roles=('passenger',), forbidden='Заказ может создать только пассажир')
+def create_order(request: router.Request) -> dict:
+    body = request.body
+    passenger_id = request.user_id
+    from_address = body.get('from_address', '').strip()
+    to_address = body.get('to_address', '').strip()
+    payment_method = body.get('payment_method', 'cash')
+    comment = body.get('comment', '')
+    
+    try:
+        idempotency_key = idempotency.get_key(request.event)
+    except idempotency.InvalidKey:
+        return response.error(400, f'Idempotency-Key должен быть от 1 до {idempotency.KEY_MAX_LENGTH} символов')
+    
+    try:
+        origin = fare.parse_point(body, 'from')
+        destination = fare.parse_point(body, 'to')
+        from_address_id = int(body['from_address_id']) if body.get('from_address_id') else None
+        to_address_id = int(body['to_address_id']) if body.get('to_address_id') else None
+    except (TypeError, ValueError):
+        return response.error(400, 'Некорректные координаты или адрес')
+    
+    cur = request.cur
+    conn = request.conn
+    
+    if idempotency_key:
+        replay = idempotency.begin(cur, passenger_id, idempotency_key, 'orders.create', body)
+        if replay:
+            return replay
+    
+    # Адрес из автодополнения берётся из справочника, введённый текстом — заводится в нём.
+    # Точки клиента в справочник не попадают: ими считается цена только этого заказа
+    resolved = []
+    for address_id, text in ((from_address_id, from_address), (to_address_id, to_address)):
+        if address_id:
+            address = addresses.get_by_id(cur, address_id)
+        elif text:
+            address = addresses.resolve(cur, text)
+        else:
+            address = None
+        resolved.append(address)
+    
+    if not resolved[0] or not resolved[1]:
+        return response.error(400, 'Укажите адреса подачи и назначения')
+    
+    from_address, to_address = resolved[0]['display'], resolved[1]['display']
+    origin = origin or (resolved[0]['lat'], resolved[0]['lon'])
+    destination = destination or (resolved[1]['lat'], resolved[1]['lon'])
+    
+    # Цену считает только сервер — по тарифу и спросу в зоне подачи; сумма клиента не принимается
+    if None in origin or None in destination:
+        return response.error(400, 'Не удалось определить координаты адресов, укажите точки на карте')
+    
+    engine = fare.get_engine(cur)
+    quote = engine.quote(*origin, *destination, surge=surge.get_multipliers(cur))
+    amount, surge_multiplier = quote['amount'], quote['surge']
+    
+    discount = 0
+    final_price = amount
+    
+    if payment_method in ['bonus', 'rub']:
+        discount_percent = float(settings_cache.get_setting(cur, 'discount_percent'))
+        discount = round(amount * discount_percent / 100, 2)
+        final_price = amount - discount
         
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            passenger_id = body.get('passenger_id')
-            from_address = body.get('from_address', '').strip()
-            to_address = body.get('to_address', '').strip()
-            amount = body.get('amount', 0)
-            payment_method = body.get('payment_method', 'cash')
-            comment = body.get('comment', '')
-            
-            if not from_address or not to_address or amount <= 0:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Укажите адреса и стоимость'}),
-                    'isBase64Encoded': False
-                }
-            
-            discount = 0
-            final_price = amount
-            
-            if payment_method in ['bonus', 'rub']:
-                discount = round(amount * 0.3, 2)
-                final_price = amount - discount
-                
-                cur.execute(
-                    "SELECT bonus_balance, rub_balance FROM passenger_balances WHERE user_id = %s",
-                    (passenger_id,)
-                )
-                balance = cur.fetchone()
-                
-                if not balance:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Баланс не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                bonus_balance, rub_balance = float(balance[0]), float(balance[1])
-                
-                if payment_method == 'bonus' and bonus_balance < final_price:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Недостаточно бонусов'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if payment_method == 'rub' and rub_balance < final_price:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Недостаточно рублей'}),
-                        'isBase64Encoded': False
-                    }
-            
-            cur.execute(
-                """INSERT INTO orders (passenger_id, from_address, to_address, amount, payment_method, 
-                   final_price, discount, comment) 
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
-                (passenger_id, from_address, to_address, amount, payment_method, final_price, discount, comment)
-            )
-            order_id = cur.fetchone()[0]
-            
-            if payment_method in ['bonus', 'rub']:
-                if payment_method == 'bonus':
-                    cur.execute(
-                        "UPDATE passenger_balances SET bonus_balance = bonus_balance - %s WHERE user_id = %s",
-                        (final_price, passenger_id)
-                    )
-                else:
-                    cur.execute(
-                        "UPDATE passenger_balances SET rub_balance = rub_balance - %s WHERE user_id = %s",
-                        (final_price, passenger_id)
-                    )
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'order_id': order_id,
-                    'final_price': final_price,
-                    'discount': discount
-                }),
-                'isBase64Encoded': False
+        cur.execute(
+            PAID_ORDER_SQL[payment_method],
+            {
+                'passenger_id': passenger_id,
+                'from_address': from_address,
+                'to_address': to_address,
+                'amount': amount,
+                'payment_method': payment_method,
+                'final_price': final_price,
+                'discount': discount,
+                'comment': comment,
+                'from_lat': origin[0],
+                'from_lon': origin[1],
+                'to_lat': destination[0],
+                'to_lon': destination[1],
+                'from_address_id': resolved[0]['id'],
+                'to_address_id': resolved[1]['id'],
+                'surge_multiplier': surge_multiplier
             }
+        )
+        row = cur.fetchone()
         
-        elif method == 'GET':
-            query_params = event.get('queryStringParameters') or {}
-            user_id = query_params.get('user_id')
-            role = query_params.get('role', 'passenger')
-            
-            if not user_id:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            if role == 'passenger':
-                cur.execute(
-                    """SELECT id, from_address, to_address, amount, final_price, discount, 
-                       payment_method, status, created_at 
-                       FROM orders WHERE passenger_id = %s ORDER BY created_at DESC LIMIT 50""",
-                    (user_id,)
-                )
+        if not row:
+            conn.rollback()
+            cur.execute(
+                "SELECT 1 FROM passenger_balances WHERE user_id = %s",
+                (passenger_id,)
+            )
+            if not cur.fetchone():
+                error = 'Баланс не найден'
+            elif payment_method == 'bonus':
+                error = 'Недостаточно бонусов'
             else:
-                cur.execute(
-                    """SELECT id, from_address, to_address, amount, final_price, discount, 
-                       payment_method, status, created_at 
-                       FROM orders WHERE driver_id = %s ORDER BY created_at DESC LIMIT 50""",
-                    (user_id,)
-                )
-            
-            orders = cur.fetchall()
-            orders_list = []
-            
-            for order in orders:
-                orders_list.append({
-                    'id': order[0],
-                    'from_address': order[1],
-                    'to_address': order[2],
-                    'amount': float(order[3]),
-                    'final_price': float(order[4]),
-                    'discount': float(order[5]),
-                    'payment_method': order[6],
-                    'status': order[7],
-                    'created_at': order[8].isoformat() if order[8] else None
-                })
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'orders': orders_list}),
-                'isBase64Encoded': False
-            }
+                error = 'Недостаточно рублей'
+            return response.error(400, error)
         
-        else:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+        order_id = row[0]
+    else:
+        cur.execute(
+            """INSERT INTO orders (passenger_id, from_address, to_address, amount, payment_method, 
+               final_price, discount, comment, from_lat, from_lon, to_lat, to_lon, from_address_id, to_address_id,
+               surge_multiplier) 
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+            (passenger_id, from_address, to_address, amount, payment_method, final_price, discount, comment,
+             origin[0], origin[1], destination[0], destination[1], resolved[0]['id'], resolved[1]['id'],
+             surge_multiplier)
+        )
+        order_id = cur.fetchone()[0]
     
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
-            'isBase64Encoded': False
-        }
+    addresses.touch(cur, passenger_id, [resolved[0]['id'], resolved[1]['id']])
+    
+    result = response.json_response(200, {
+        'success': True,
+        'order_id': order_id,
+        'amount': amount,
+        'final_price': final_price,
+        'discount': discount,
+        'surge': surge_multiplier
+    })
+    if idempotency_key:
+        idempotency.finish(cur, passenger_id, idempotency_key, result)
+    
+    conn.commit()
+    
+    return result
+
+
+@ROUTER.route('GET', read_only=True)
+def order_history(request: router.Request) -> dict:
+    try:
+        limit = min(max(int(request.query.get('limit', HISTORY_DEFAULT_LIMIT)), 1), HISTORY_MAX_LIMIT)
+        cursor = decode_cursor(request.query['cursor']) if request.query.get('cursor') else None
+    except ValueError:
+        return response.error(400, 'Некорректные параметры cursor или limit')
+    
+    owner_column = 'passenger_id' if request.role == 'passenger' else 'driver_id'
+    
+    cur = request.cur
+    if cursor:
+        # Сравнение строк секции не отсекает, отдельное условие на created_at — отсекает
+        cur.execute(
+            f"""SELECT id, from_address, to_address, amount, final_price, discount, 
+               payment_method, status, created_at 
+               FROM orders WHERE {owner_column} = %s AND created_at <= %s AND (created_at, id) < (%s, %s)
+               ORDER BY created_at DESC, id DESC LIMIT %s""",
+            (request.user_id, cursor[0], cursor[0], cursor[1], limit + 1)
+        )
+    else:
+        cur.execute(
+            f"""SELECT id, from_address, to_address, amount, final_price, discount, 
+               payment_method, status, created_at 
+               FROM orders WHERE {owner_column} = %s
+               ORDER BY created_at DESC, id DESC LIMIT %s""",
+            (request.user_id, limit + 1)
+        )
+    
+    orders = cur.fetchall()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1][8], orders[-1][0])
+    
+    return response.json_response(200, {'orders': response.rows(HISTORY_COLUMNS, orders), 'next_cursor': next_cursor})
+
+
+@instrumentation.instrumented('orders')
+def handler(event: dict, context) -> dict:
+    '''API для создания и управления заказами такси'''
+    return ROUTER.dispatch(event)
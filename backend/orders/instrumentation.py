@@ -0,0 +1,188 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+import response
+
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+STATEMENT_LOG_LIMIT = 500
+REQUEST_LOG_ENABLED = os.environ.get('REQUEST_LOG', '1') != '0'
+
+_local = threading.local()
+_counters = {}
+_failures = {}
+_counters_lock = threading.Lock()
+_cursor_class = None
+
+
+def cursor_class():
+    '''Курсор, замеряющий время и число строк каждого запроса текущего вызова.
+
+    Класс строится при первом соединении, а не при импорте модуля, чтобы
+    psycopg2 не грузился в вызовах, которым база не понадобилась.
+    '''
+    global _cursor_class
+    if _cursor_class is None:
+        import psycopg2.extensions
+
+        class InstrumentedCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_statement(query, time.perf_counter() - started, self.rowcount)
+
+        _cursor_class = InstrumentedCursor
+    return _cursor_class
+
+
+def record_statement(query, elapsed: float, rows: int):
+    request = getattr(_local, 'request', None)
+    if request is None:
+        return
+    elapsed_ms = elapsed * 1e3
+    request['queries'] += 1
+    request['db_ms'] += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        request['slow'].append({
+            'statement': ' '.join(text.split())[:STATEMENT_LOG_LIMIT],
+            'ms': round(elapsed_ms, 2),
+            'rows': rows
+        })
+
+
+def record_acquire(elapsed: float):
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        request['acquire_ms'] += elapsed * 1e3
+
+
+def record_replica():
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        request['replica'] = True
+
+
+def record_failure(component: str, error: Exception):
+    '''Сбой фоновой части вызова, который не должен ронять ответ: JSON-лог и счётчик по компоненту'''
+    request = getattr(_local, 'request', None)
+    _log({
+        'level': 'error',
+        'component': component,
+        'request_id': request['request_id'] if request else None,
+        'error': f'{type(error).__name__}: {error}'
+    })
+    with _counters_lock:
+        _failures[component] = _failures.get(component, 0) + 1
+
+
+def last_request() -> dict:
+    '''Сводка последнего завершённого вызова в этом потоке (для нагрузочного стенда)'''
+    return getattr(_local, 'last', None)
+
+
+def snapshot() -> dict:
+    with _counters_lock:
+        return {action: dict(values) for action, values in _counters.items()}
+
+
+def failures() -> dict:
+    with _counters_lock:
+        return dict(_failures)
+
+
+def _action_name(event: dict) -> str:
+    method = event.get('httpMethod', 'GET')
+    action = (event.get('queryStringParameters') or {}).get('action')
+    if not action and method == 'POST':
+        try:
+            action = (json.loads(event.get('body') or '{}') or {}).get('action')
+        except (ValueError, AttributeError):
+            action = None
+    return f'{method} {action}' if action else method
+
+
+def _log(record: dict):
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def _finish(function_name: str, request: dict, status_code: int):
+    duration_ms = (time.perf_counter() - request.pop('started')) * 1e3
+    summary = {
+        'level': 'warning' if request['slow'] or status_code >= 500 else 'info',
+        'function': function_name,
+        'request_id': request['request_id'],
+        'action': request['action'],
+        'status': status_code,
+        'duration_ms': round(duration_ms, 2),
+        'acquire_ms': round(request['acquire_ms'], 2),
+        'db_ms': round(request['db_ms'], 2),
+        'queries': request['queries'],
+        'replica': request['replica']
+    }
+    if request['slow']:
+        summary['slow_statements'] = request['slow']
+    if REQUEST_LOG_ENABLED or summary['level'] != 'info':
+        _log(summary)
+    _local.last = summary
+
+    with _counters_lock:
+        counters = _counters.setdefault(request['action'], {
+            'requests': 0, 'errors': 0, 'queries': 0, 'slow_queries': 0, 'replica_reads': 0,
+            'duration_ms': 0.0, 'db_ms': 0.0, 'acquire_ms': 0.0
+        })
+        counters['requests'] += 1
+        counters['errors'] += 1 if status_code >= 500 else 0
+        counters['queries'] += request['queries']
+        counters['slow_queries'] += len(request['slow'])
+        counters['replica_reads'] += 1 if request['replica'] else 0
+        counters['duration_ms'] += duration_ms
+        counters['db_ms'] += request['db_ms']
+        counters['acquire_ms'] += request['acquire_ms']
+
+
+def instrumented(function_name: str):
+    '''Оборачивает handler: id запроса, замеры БД, JSON-лог и счётчики по действиям.
+
+    GET ?action=metrics с заголовком X-Metrics-Token, равным METRICS_TOKEN,
+    отдаёт накопленные контейнером счётчики без вызова самого handler.
+    '''
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            query_params = event.get('queryStringParameters') or {}
+            if query_params.get('action') == 'metrics' and event.get('httpMethod') == 'GET':
+                headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+                if not METRICS_TOKEN or headers.get('x-metrics-token') != METRICS_TOKEN:
+                    return response.error(404, 'Endpoint not found')
+                return response.json_response(200, {
+                    'function': function_name, 'actions': snapshot(), 'failures': failures()
+                })
+
+            request_context = event.get('requestContext') or {}
+            _local.request = {
+                'request_id': request_context.get('requestId') or uuid.uuid4().hex,
+                'action': _action_name(event),
+                'started': time.perf_counter(),
+                'acquire_ms': 0.0,
+                'db_ms': 0.0,
+                'queries': 0,
+                'replica': False,
+                'slow': []
+            }
+            status_code = 500
+            try:
+                result = handler(event, context)
+                status_code = result.get('statusCode', 200)
+                return result
+            finally:
+                request, _local.request = _local.request, None
+                _finish(function_name, request, status_code)
+        return wrapper
+    return decorator
@@ -0,0 +1,254 @@
+import os
+import time
+
+RATING_COMMENT_MAX_LENGTH = 1000
+ACTIVE_ORDER_DAYS = int(os.environ.get('ACTIVE_ORDER_DAYS', '30'))
+PENDING_ORDER_TTL_HOURS = int(os.environ.get('PENDING_ORDER_TTL_HOURS', '24'))
+EXPIRE_BATCH_SIZE = int(os.environ.get('ORDER_EXPIRE_BATCH_SIZE', '500'))
+EXPIRE_INTERVAL = float(os.environ.get('ORDER_EXPIRE_INTERVAL', '300'))
+
+# Нижняя граница created_at заказов, с которыми ещё можно что-то делать. Считается
+# в базе: created_at — TIMESTAMP в часовом поясе сессии, как и LOCALTIMESTAMP, поэтому
+# часы и пояс контейнера окно не сдвигают. Выражение стабильно в пределах запроса,
+# и лишние секции orders отсекаются при его запуске.
+ACTIVE_SINCE_SQL = f"LOCALTIMESTAMP - {ACTIVE_ORDER_DAYS} * INTERVAL '1 day'"
+
+# Действие над заказом -> (кто его выполняет, допустимые исходные статусы, новый статус).
+# accept выполняется запросом CLAIM_ORDER_SQL из index.py; rate статус не меняет.
+TRANSITIONS = {
+    'accept': ('driver', ('pending',), 'accepted'),
+    'start': ('driver', ('accepted',), 'in_progress'),
+    'complete': ('driver', ('in_progress',), 'completed'),
+    'cancel': ('passenger', ('pending', 'accepted'), 'cancelled'),
+    'rate': ('passenger', ('completed',), 'completed')
+}
+
+# Каждый переход — один условный UPDATE: статус проверяется в WHERE, поэтому
+# параллельные запросы к одному заказу не проведут его дважды, а после
+# ожидания блокировки строки условие перепроверяется по её новой версии.
+# Граница created_at оставляет только последние помесячные секции orders.
+START_SQL = f"""UPDATE orders SET status = 'in_progress', started_at = CURRENT_TIMESTAMP
+       WHERE id = %(order_id)s AND driver_id = %(user_id)s AND status = ANY(%(from_statuses)s)
+         AND created_at >= {ACTIVE_SINCE_SQL}
+       RETURNING id, status, started_at"""
+
+# Завершение поездки и счётчик поездок водителя в одном запросе
+COMPLETE_SQL = f"""WITH completed AS (
+           UPDATE orders SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+           WHERE id = %(order_id)s AND driver_id = %(user_id)s AND status = ANY(%(from_statuses)s)
+             AND created_at >= {ACTIVE_SINCE_SQL}
+           RETURNING id, driver_id, status, completed_at
+       ),
+       counted AS (
+           INSERT INTO driver_profiles AS dp (user_id, total_trips)
+           SELECT driver_id, 1 FROM completed
+           ON CONFLICT (user_id) DO UPDATE SET total_trips = dp.total_trips + 1
+           RETURNING total_trips
+       )
+       SELECT completed.id, completed.status, completed.completed_at, counted.total_trips
+       FROM completed, counted"""
+
+# Отмена пассажиром до начала поездки: оплаченный с баланса заказ возвращается
+# на тот же счёт, проводка обратна проводке оплаты (со счёта поездок пассажиру)
+CANCEL_SQL = f"""WITH cancelled AS (
+           UPDATE orders SET status = 'cancelled', cancelled_at = CURRENT_TIMESTAMP
+           WHERE id = %(order_id)s AND passenger_id = %(user_id)s AND status = ANY(%(from_statuses)s)
+             AND created_at >= {ACTIVE_SINCE_SQL}
+           RETURNING id, passenger_id, status, payment_method, final_price
+       ),
+       refund AS (
+           UPDATE passenger_balances pb
+           SET bonus_balance = pb.bonus_balance + CASE WHEN c.payment_method = 'bonus' THEN c.final_price ELSE 0 END,
+               rub_balance = pb.rub_balance + CASE WHEN c.payment_method = 'rub' THEN c.final_price ELSE 0 END,
+               updated_at = CURRENT_TIMESTAMP
+           FROM cancelled c
+           WHERE pb.user_id = c.passenger_id AND c.payment_method IN ('bonus', 'rub')
+           RETURNING pb.user_id
+       ),
+       posted AS (
+           INSERT INTO ledger_entries (account_type, account_id, amount, reference_type, reference_id)
+           SELECT leg.account_type, leg.account_id, leg.amount, 'order_refund', c.id
+           FROM cancelled c
+           JOIN refund ON refund.user_id = c.passenger_id
+           CROSS JOIN LATERAL (VALUES
+               ('passenger_' || c.payment_method, c.passenger_id, c.final_price),
+               ('trips', 0, -c.final_price)
+           ) AS leg(account_type, account_id, amount)
+       )
+       SELECT c.id, c.status, CASE WHEN EXISTS (SELECT 1 FROM refund) THEN c.final_price ELSE 0 END
+       FROM cancelled c"""
+
+# Оценка завершённой поездки: сумма и число оценок водителя растут на одну,
+# рейтинг считается из них же, без AVG по всем его заказам
+RATE_SQL = f"""WITH rated AS (
+           UPDATE orders SET passenger_rating = %(rating)s, passenger_comment = %(comment)s
+           WHERE id = %(order_id)s AND passenger_id = %(user_id)s AND status = ANY(%(from_statuses)s)
+             AND created_at >= {ACTIVE_SINCE_SQL}
+             AND passenger_rating IS NULL AND driver_id IS NOT NULL
+           RETURNING driver_id, passenger_rating
+       ),
+       profile AS (
+           INSERT INTO driver_profiles AS dp (user_id, rating_sum, rating_count, rating)
+           SELECT driver_id, passenger_rating, 1, passenger_rating FROM rated
+           ON CONFLICT (user_id) DO UPDATE
+           SET rating_sum = dp.rating_sum + EXCLUDED.rating_sum,
+               rating_count = dp.rating_count + 1,
+               rating = ROUND((dp.rating_sum + EXCLUDED.rating_sum)::DECIMAL / (dp.rating_count + 1), 2)
+           RETURNING rating, rating_count
+       )
+       SELECT rating, rating_count FROM profile"""
+
+# Истечение брошенных заказов до того, как они выйдут из окна ACTIVE_ORDER_DAYS:
+# после этого ни водитель, ни пассажир их уже не тронут, оплата с баланса не вернётся,
+# а секция с ними не уйдёт в архив. Ожидающий заказ истекает через
+# PENDING_ORDER_TTL_HOURS, принятый, но так и не начатый — у границы окна.
+# Возврат и проводки — как при отмене пассажиром, суммы сложены по пассажиру.
+# Начатая, но не завершённая водителем поездка у границы окна закрывается как
+# завершённая: пассажир уже в машине, оплата остаётся на счёте поездок, как при
+# обычном завершении, и засчитывается водителю.
+EXPIRE_SQL = f"""WITH stale AS (
+           SELECT id, created_at, status FROM orders
+           WHERE (status = 'pending' AND created_at < LOCALTIMESTAMP - %(pending_hours)s * INTERVAL '1 hour')
+              OR (status IN ('accepted', 'in_progress') AND created_at < {ACTIVE_SINCE_SQL} + INTERVAL '1 day')
+           ORDER BY created_at
+           LIMIT %(batch_size)s
+           FOR UPDATE SKIP LOCKED
+       ),
+       cancelled AS (
+           UPDATE orders o SET status = 'cancelled', cancelled_at = CURRENT_TIMESTAMP
+           FROM stale
+           WHERE o.id = stale.id AND o.created_at = stale.created_at AND stale.status <> 'in_progress'
+           RETURNING o.id, o.passenger_id, o.payment_method, o.final_price
+       ),
+       completed AS (
+           UPDATE orders o SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+           FROM stale
+           WHERE o.id = stale.id AND o.created_at = stale.created_at AND stale.status = 'in_progress'
+           RETURNING o.driver_id
+       ),
+       counted AS (
+           INSERT INTO driver_profiles AS dp (user_id, total_trips)
+           SELECT driver_id, COUNT(*) FROM completed
+           WHERE driver_id IS NOT NULL
+           GROUP BY driver_id
+           ON CONFLICT (user_id) DO UPDATE SET total_trips = dp.total_trips + EXCLUDED.total_trips
+       ),
+       refunds AS (
+           SELECT passenger_id,
+                  COALESCE(SUM(final_price) FILTER (WHERE payment_method = 'bonus'), 0) AS bonus,
+                  COALESCE(SUM(final_price) FILTER (WHERE payment_method = 'rub'), 0) AS rub
+           FROM cancelled
+           WHERE payment_method IN ('bonus', 'rub')
+           GROUP BY passenger_id
+       ),
+       refund AS (
+           UPDATE passenger_balances pb
+           SET bonus_balance = pb.bonus_balance + r.bonus,
+               rub_balance = pb.rub_balance + r.rub,
+               updated_at = CURRENT_TIMESTAMP
+           FROM refunds r
+           WHERE pb.user_id = r.passenger_id
+           RETURNING pb.user_id
+       ),
+       posted AS (
+           INSERT INTO ledger_entries (account_type, account_id, amount, reference_type, reference_id)
+           SELECT leg.account_type, leg.account_id, leg.amount, 'order_refund', c.id
+           FROM cancelled c
+           JOIN refund ON refund.user_id = c.passenger_id
+           CROSS JOIN LATERAL (VALUES
+               ('passenger_' || c.payment_method, c.passenger_id, c.final_price),
+               ('trips', 0, -c.final_price)
+           ) AS leg(account_type, account_id, amount)
+           WHERE c.payment_method IN ('bonus', 'rub')
+       )
+       SELECT (SELECT COUNT(*) FROM cancelled), (SELECT COUNT(*) FROM completed)"""
+
+TRANSITION_SQL = {
+    'start': START_SQL,
+    'complete': COMPLETE_SQL,
+    'cancel': CANCEL_SQL,
+    'rate': RATE_SQL
+}
+
+
+def parse_rating(body: dict) -> tuple:
+    '''(оценка 1-5, комментарий или None); ValueError при некорректных значениях'''
+    rating = body.get('rating')
+    if not isinstance(rating, int) or isinstance(rating, bool) or not 1 <= rating <= 5:
+        raise ValueError('invalid rating')
+    comment = (body.get('comment') or '').strip() or None
+    if comment and len(comment) > RATING_COMMENT_MAX_LENGTH:
+        raise ValueError('comment too long')
+    return rating, comment
+
+
+def transition(cur, action: str, order_id: int, user_id: int, **params):
+    '''Строка RETURNING перехода или None, если заказ не найден или статус не подходит'''
+    _, from_statuses, _ = TRANSITIONS[action]
+    cur.execute(TRANSITION_SQL[action], {
+        'order_id': order_id, 'user_id': user_id, 'from_statuses': list(from_statuses), **params
+    })
+    return cur.fetchone()
+
+
+def rejection(cur, action: str, order_id: int, user_id: int) -> tuple:
+    '''(статус, сообщение) для несостоявшегося перехода; вызывается после отката.
+
+    Заказ ищется во всех секциях: так старый заказ отличается от несуществующего.
+    '''
+    role, _, _ = TRANSITIONS[action]
+    cur.execute(
+        f"""SELECT status, passenger_id, driver_id, passenger_rating, created_at < {ACTIVE_SINCE_SQL}
+           FROM orders WHERE id = %s""",
+        (order_id,)
+    )
+    row = cur.fetchone()
+    owner_id = (row[1] if role == 'passenger' else row[2]) if row else None
+    if owner_id != user_id:
+        return 404, 'Заказ не найден'
+    if row[4]:
+        return 409, f'Заказ старше {ACTIVE_ORDER_DAYS} дней, действие недоступно'
+    if action == 'rate' and row[3] is not None:
+        return 409, 'Поездка уже оценена'
+    return 409, f'Действие недоступно для заказа в статусе {row[0]}'
+
+
+def expire_batches(conn, batch_size: int = EXPIRE_BATCH_SIZE, pending_hours: int = PENDING_ORDER_TTL_HOURS) -> tuple:
+    '''Закрывает брошенные заказы пачками по batch_size, фиксируя каждую пачку: (отменено, завершено)'''
+    if pending_hours >= ACTIVE_ORDER_DAYS * 24:
+        raise ValueError('PENDING_ORDER_TTL_HOURS должен быть меньше окна ACTIVE_ORDER_DAYS')
+    cur = conn.cursor()
+    cancelled_total = completed_total = 0
+    while True:
+        cur.execute(EXPIRE_SQL, {'pending_hours': pending_hours, 'batch_size': batch_size})
+        cancelled, completed = cur.fetchone()
+        conn.commit()
+        cancelled_total += cancelled
+        completed_total += completed
+        if cancelled + completed < batch_size:
+            break
+    cur.close()
+    return cancelled_total, completed_total
+
+
+if __name__ == '__main__':
+    import argparse
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Отмена брошенных заказов с возвратом оплаты и закрытие зависших поездок')
+    parser.add_argument('--once', action='store_true', help='один проход вместо бесконечного цикла')
+    parser.add_argument('--batch-size', type=int, default=EXPIRE_BATCH_SIZE)
+    parser.add_argument('--pending-hours', type=int, default=PENDING_ORDER_TTL_HOURS)
+    parser.add_argument('--interval', type=float, default=EXPIRE_INTERVAL)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    while True:
+        started = time.monotonic()
+        cancelled, completed = expire_batches(conn, args.batch_size, args.pending_hours)
+        print(f'отменено заказов: {cancelled}, закрыто поездок: {completed} '
+              f'за {(time.monotonic() - started) * 1e3:.1f} мс', flush=True)
+        if args.once:
+            break
+        time.sleep(args.interval)
+    conn.close()
@@ -0,0 +1,220 @@
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from fare import haversine_km
+
+CELL_DEGREES = 0.01
+CELL_KM = 111.2 * CELL_DEGREES
+LOCATION_TTL_SECONDS = int(os.environ.get('DRIVER_LOCATION_TTL', '120'))
+MATCH_DEFAULT_K = 5
+MATCH_MAX_K = 20
+MATCH_MAX_RINGS = 32
+PING_MAX_POINTS = 100
+PICKUP_SPEED_KMH = 25.0
+HISTORY_RETENTION_DAYS = int(os.environ.get('DRIVER_LOCATION_HISTORY_DAYS', '14'))
+HISTORY_PURGE_BATCH_SIZE = 50000
+
+# Смена действует, пока выполнено это условие: флаг shift_active снимает expire_shifts
+# с опозданием, поэтому срок проверяется здесь же. Копия balance/shifts.py
+SHIFT_ON_SQL = "shift_active = true AND COALESCE(shift_ends_at > CURRENT_TIMESTAMP, false)"
+
+
+def cell_of(lat: float, lon: float) -> tuple:
+    return math.floor((lat + 90) / CELL_DEGREES), math.floor((lon + 180) / CELL_DEGREES)
+
+
+def cell_key(i: int, j: int) -> int:
+    return i * 65536 + j
+
+
+def annulus(i: int, j: int, inner: int, outer: int) -> list:
+    '''Ключи ячеек на чебышёвском расстоянии от inner до outer включительно'''
+    keys = []
+    for di in range(-outer, outer + 1):
+        for dj in range(-outer, outer + 1):
+            if max(abs(di), abs(dj)) >= inner:
+                keys.append(cell_key(i + di, j + dj))
+    return keys
+
+
+def k_nearest(fetch, lat: float, lon: float, k: int) -> list:
+    '''k ближайших точек: кольца сетки расширяются вдвое, пока ответ не станет точным.
+
+    fetch(keys) возвращает [(id, lat, lon), ...] из указанных ячеек. Всё, что
+    ближе rings ячеек к точке, гарантированно лежит в просмотренных кольцах,
+    поэтому k-й кандидат внутри этого радиуса — окончательный.
+    '''
+    i, j = cell_of(lat, lon)
+    found = []
+    scanned, rings = -1, 1
+    while True:
+        for item_id, item_lat, item_lon in fetch(annulus(i, j, scanned + 1, rings)):
+            found.append((haversine_km(lat, lon, item_lat, item_lon), item_id))
+        found.sort()
+        # Ширина ячейки по долготе — у дальнего от экватора края просмотренного квадрата
+        edge_lat = min(abs(lat) + (rings + 1) * CELL_DEGREES, 89.0)
+        covered_km = rings * CELL_KM * math.cos(math.radians(edge_lat))
+        if len(found) >= k and found[k - 1][0] <= covered_km:
+            return found[:k]
+        if rings >= MATCH_MAX_RINGS:
+            return found[:k]
+        scanned, rings = rings, rings * 2
+
+
+def nearest_drivers(cur, lat: float, lon: float, k: int = MATCH_DEFAULT_K) -> list:
+    '''Ближайшие водители на смене со свежей позицией'''
+    def fetch(keys):
+        cur.execute(
+            f"""SELECT dl.driver_id, dl.lat, dl.lon FROM driver_locations dl
+               JOIN driver_balances b ON b.user_id = dl.driver_id AND {SHIFT_ON_SQL}
+               WHERE dl.cell = ANY(%s) AND dl.updated_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'""",
+            (keys, LOCATION_TTL_SECONDS)
+        )
+        return cur.fetchall()
+
+    return [
+        {'driver_id': driver_id, 'distance_km': round(distance, 2),
+         'eta_min': round(distance / PICKUP_SPEED_KMH * 60, 1)}
+        for distance, driver_id in k_nearest(fetch, lat, lon, k)
+    ]
+
+
+def parse_pings(body: dict) -> list:
+    '''Одна точка {lat, lon} или пачка {"points": [{lat, lon, at}, ...]} в порядке записи.
+
+    Время — с поясом UTC: колонки TIMESTAMPTZ, и сравнение с CURRENT_TIMESTAMP
+    не зависит от пояса сессии. at без пояса считается UTC.
+    '''
+    raw = body.get('points') or [body]
+    if len(raw) > PING_MAX_POINTS:
+        raise ValueError('too many points')
+    now = datetime.now(timezone.utc)
+    pings = []
+    for point in raw:
+        lat, lon = float(point['lat']), float(point['lon'])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError('coordinates out of range')
+        at = datetime.fromisoformat(point['at']) if point.get('at') else now
+        at = at.replace(tzinfo=timezone.utc) if at.tzinfo is None else at.astimezone(timezone.utc)
+        if at > now + timedelta(minutes=1):
+            raise ValueError('point from the future')
+        pings.append((lat, lon, at))
+    pings.sort(key=lambda ping: ping[2])
+    return pings
+
+
+def record_pings(cur, driver_id: int, pings: list):
+    '''Пачка точек — одной вставкой в историю, последняя — в driver_locations'''
+    lats, lons, times = (list(column) for column in zip(*pings))
+    cur.execute(
+        """INSERT INTO driver_location_history (driver_id, lat, lon, recorded_at)
+           SELECT %s, * FROM unnest(%s::DOUBLE PRECISION[], %s::DOUBLE PRECISION[], %s::TIMESTAMPTZ[])""",
+        (driver_id, lats, lons, times)
+    )
+    lat, lon, at = pings[-1]
+    cur.execute(
+        """INSERT INTO driver_locations (driver_id, lat, lon, cell, updated_at)
+           VALUES (%s, %s, %s, %s, %s)
+           ON CONFLICT (driver_id) DO UPDATE
+           SET lat = EXCLUDED.lat, lon = EXCLUDED.lon, cell = EXCLUDED.cell, updated_at = EXCLUDED.updated_at
+           WHERE driver_locations.updated_at <= EXCLUDED.updated_at""",
+        (driver_id, lat, lon, cell_key(*cell_of(lat, lon)), at)
+    )
+
+
+class GridIndex:
+    '''Та же сетка в памяти: для замера алгоритма без базы'''
+
+    def __init__(self):
+        self.cells = {}
+        self.positions = {}
+
+    def update(self, item_id, lat: float, lon: float):
+        key = cell_key(*cell_of(lat, lon))
+        previous = self.positions.get(item_id)
+        if previous is not None and previous[2] != key:
+            del self.cells[previous[2]][item_id]
+        self.cells.setdefault(key, {})[item_id] = (lat, lon)
+        self.positions[item_id] = (lat, lon, key)
+
+    def fetch(self, keys: list) -> list:
+        items = []
+        for key in keys:
+            for item_id, (lat, lon) in self.cells.get(key, {}).items():
+                items.append((item_id, lat, lon))
+        return items
+
+
+def _bench(args):
+    import random
+    import time
+
+    rng = random.Random(1)
+    center_lat, center_lon, spread = 56.3, 44.0, 0.25
+    index = GridIndex()
+    drivers = {d: (center_lat + rng.gauss(0, spread / 3), center_lon + rng.gauss(0, spread / 3))
+               for d in range(args.drivers)}
+    for d, (lat, lon) in drivers.items():
+        index.update(d, lat, lon)
+
+    pings_per_second = int(args.drivers / args.ping_interval)
+    ping_times, match_times = [], []
+    for _ in range(args.seconds):
+        for _ in range(pings_per_second):
+            d = rng.randrange(args.drivers)
+            lat, lon = drivers[d]
+            drivers[d] = lat + rng.gauss(0, 0.0005), lon + rng.gauss(0, 0.0005)
+            started = time.perf_counter()
+            index.update(d, *drivers[d])
+            ping_times.append(time.perf_counter() - started)
+        for _ in range(args.matches_per_second):
+            lat = center_lat + rng.uniform(-spread, spread)
+            lon = center_lon + rng.uniform(-spread, spread)
+            started = time.perf_counter()
+            k_nearest(index.fetch, lat, lon, args.k)
+            match_times.append(time.perf_counter() - started)
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(int(len(values) * p), len(values) - 1)] * 1e3
+
+    print(f'водителей: {args.drivers}, пингов: {pings_per_second}/с, поисков: {len(match_times)}')
+    print(f'пинг: p50 {percentile(ping_times, 0.5) * 1e3:.1f} мкс')
+    print(f'k={args.k} ближайших: p50 {percentile(match_times, 0.5):.3f} мс, '
+          f'p99 {percentile(match_times, 0.99):.3f} мс, max {max(match_times) * 1e3:.3f} мс')
+
+
+def _purge_history(args):
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SELECT purge_driver_location_history(%s, %s)", (args.days, args.batch_size))
+        deleted = cur.fetchone()[0]
+        conn.commit()
+        total += deleted
+        if deleted < args.batch_size:
+            break
+    conn.close()
+    print(f'удалено точек треков старше {args.days} дн.: {total}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Поиск ближайших водителей: замер скорости и чистка истории треков')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help='замер поиска ближайших водителей при потоке пингов')
+    bench_parser.add_argument('--drivers', type=int, default=5000)
+    bench_parser.add_argument('--ping-interval', type=float, default=5.0, help='секунд между пингами одного водителя')
+    bench_parser.add_argument('--seconds', type=int, default=10, help='моделируемое время')
+    bench_parser.add_argument('--matches-per-second', type=int, default=50)
+    bench_parser.add_argument('--k', type=int, default=MATCH_DEFAULT_K)
+    purge_parser = commands.add_parser('purge-history', help='удалить точки треков старше срока хранения (ежедневно)')
+    purge_parser.add_argument('--days', type=int, default=HISTORY_RETENTION_DAYS)
+    purge_parser.add_argument('--batch-size', type=int, default=HISTORY_PURGE_BATCH_SIZE)
+    args = parser.parse_args()
+    _bench(args) if args.command == 'bench' else _purge_history(args)
@@ -0,0 +1,122 @@
+import json
+import os
+import select
+import time
+import response
+
+CHANNEL = 'order_events'
+MAX_WAIT_SECONDS = 25
+EVENTS_BATCH_LIMIT = 100
+RETENTION_DAYS = int(os.environ.get('ORDER_EVENTS_RETENTION_DAYS', '7'))
+PURGE_BATCH_SIZE = 5000
+# Событие, о котором пришло уведомление, может ждать фиксации более старых транзакций:
+# лента перечитывается с паузой от HELD_BACK_RETRY_SECONDS, удваивая её до
+# HELD_BACK_RETRY_MAX_SECONDS. Дольше HELD_BACK_MAX_SECONDS событие не придерживается:
+# долгая транзакция где угодно в базе (отчёт, сессия idle in transaction) иначе
+# останавливала бы ленту всем. Граница должна быть больше самой долгой транзакции
+# обработчика, меняющей заказы, иначе её событие может оказаться ниже версии клиента.
+HELD_BACK_RETRY_SECONDS = 0.05
+HELD_BACK_RETRY_MAX_SECONDS = 1.0
+HELD_BACK_MAX_SECONDS = float(os.environ.get('ORDER_EVENTS_HOLD_BACK_SECONDS', '5'))
+
+EVENT_COLUMNS = ('version', 'order_id', 'status', 'created_at')
+OWNER_COLUMNS = {'passenger': 'passenger_id', 'driver': 'driver_id'}
+
+
+def parse_version(value: str) -> tuple:
+    '''"<txid>.<id>" -> (txid, id); пустая строка или "0" — с начала ленты'''
+    if not value or value == '0':
+        return 0, 0
+    txid, event_id = value.split('.')
+    return int(txid), int(event_id)
+
+
+def format_version(txid: int, event_id: int) -> str:
+    return f'{txid}.{event_id}'
+
+
+def fetch_events(cur, role: str, user_id: int, since: tuple) -> list:
+    '''События после версии since в порядке (txid, id), только завершённых транзакций.
+
+    id выдаётся до фиксации, поэтому сам по себе версией служить не может:
+    событие с меньшим id, зафиксированное позже, клиент бы пропустил.
+    Ниже txid_snapshot_xmin незавершённых транзакций нет, и набор событий
+    там уже не меняется. События старше HELD_BACK_MAX_SECONDS отдаются и выше
+    этой границы.
+    '''
+    column = OWNER_COLUMNS[role]
+    cur.execute(
+        f"""SELECT txid, id, order_id, status, created_at FROM order_events
+           WHERE {column} = %s AND (txid, id) > (%s, %s)
+             AND (txid < txid_snapshot_xmin(txid_current_snapshot())
+                  OR created_at < LOCALTIMESTAMP - %s * INTERVAL '1 second')
+           ORDER BY txid, id LIMIT %s""",
+        (user_id, since[0], since[1], HELD_BACK_MAX_SECONDS, EVENTS_BATCH_LIMIT)
+    )
+    return [
+        dict(zip(EVENT_COLUMNS, (format_version(txid, event_id), *rest)))
+        for txid, event_id, *rest in cur.fetchall()
+    ]
+
+
+def wait_for_events(conn, role: str, user_id: int, since: tuple, timeout: float) -> list:
+    '''Ждёт изменений заказов пользователя после версии since, но не дольше timeout.
+
+    Сначала подписывается на канал, затем читает ленту, поэтому событие,
+    записанное между чтением и ожиданием, не теряется. Пока событий нет,
+    соединение спит в select() и не выполняет запросов. Если уведомление
+    пришло, а событие ещё придержано незавершённой транзакцией, лента
+    перечитывается с нарастающей паузой.
+    '''
+    column = OWNER_COLUMNS[role]
+    deadline = time.monotonic() + min(timeout, MAX_WAIT_SECONDS)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(f'LISTEN {CHANNEL}')
+        events = fetch_events(cur, role, user_id, since)
+        held_back = False
+        retry = HELD_BACK_RETRY_SECONDS
+
+        while not events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait = min(remaining, retry) if held_back else remaining
+            if select.select([conn], [], [], wait) == ([], [], []):
+                if held_back:
+                    events = fetch_events(cur, role, user_id, since)
+                    retry = min(retry * 2, HELD_BACK_RETRY_MAX_SECONDS)
+                    continue
+                break
+            conn.poll()
+            for notify in conn.notifies:
+                if json.loads(notify.payload).get(column) == user_id:
+                    held_back = True
+            conn.notifies.clear()
+            if held_back:
+                events = fetch_events(cur, role, user_id, since)
+
+        return events
+    finally:
+        cur.execute(f'UNLISTEN {CHANNEL}')
+        cur.close()
+        conn.notifies.clear()
+        conn.autocommit = False
+
+
+if __name__ == '__main__':
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SELECT purge_order_events(%s, %s)", (RETENTION_DAYS, PURGE_BATCH_SIZE))
+        deleted = cur.fetchone()[0]
+        conn.commit()
+        total += deleted
+        if deleted < PURGE_BATCH_SIZE:
+            break
+    conn.close()
+    print(f'удалено событий старше {RETENTION_DAYS} дн.: {total}')
@@ -0,0 +1,116 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+PASSWORD_ALGORITHM = 'pbkdf2_sha256'
+PASSWORD_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '200000'))
+TOKEN_TTL_SECONDS = int(os.environ.get('AUTH_TOKEN_TTL', str(7 * 24 * 3600)))
+TOKEN_HEADERS = ('x-auth-token', 'x-admin-token')
+
+_secret = None
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _token_secret() -> bytes:
+    global _secret
+    if _secret is None:
+        secret = os.environ.get('AUTH_TOKEN_SECRET')
+        if not secret:
+            raise RuntimeError('AUTH_TOKEN_SECRET не задан')
+        _secret = secret.encode()
+    return _secret
+
+
+def hash_password(password: str) -> str:
+    '''Солёный PBKDF2-хеш в формате алгоритм$итерации$соль$хеш'''
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PASSWORD_ITERATIONS)
+    return f'{PASSWORD_ALGORITHM}${PASSWORD_ITERATIONS}${_b64encode(salt)}${_b64encode(digest)}'
+
+
+def verify_password(password: str, stored_hash: str) -> tuple:
+    '''Проверяет пароль и сообщает, нужно ли пересчитать хеш.
+
+    Возвращает (верен ли пароль, нужен ли rehash). Старые несолёные SHA-256
+    хеши принимаются и всегда требуют пересчёта.
+    '''
+    if '$' not in stored_hash:
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored_hash), True
+
+    try:
+        algorithm, iterations, salt, digest = stored_hash.split('$')
+        iterations = int(iterations)
+        salt, digest = _b64decode(salt), _b64decode(digest)
+    except ValueError:
+        return False, False
+    if algorithm != PASSWORD_ALGORITHM:
+        return False, False
+
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return hmac.compare_digest(candidate, digest), iterations != PASSWORD_ITERATIONS
+
+
+def issue_token(user_id: int, role: str, ttl: int = TOKEN_TTL_SECONDS) -> str:
+    '''Подписанный HMAC токен сессии: данные.подпись, данные = id:роль:истекает'''
+    payload = f'{user_id}:{role}:{int(time.time()) + ttl}'.encode()
+    signature = hmac.new(_token_secret(), payload, hashlib.sha256).digest()
+    return f'{_b64encode(payload)}.{_b64encode(signature)}'
+
+
+def verify_token(token: str):
+    '''Проверяет подпись и срок токена без обращения к базе.
+
+    Возвращает (user_id, role) или None, если токен подделан, испорчен или истёк.
+    '''
+    try:
+        payload_part, signature_part = token.split('.')
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, AttributeError):
+        return None
+
+    expected = hmac.new(_token_secret(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        return None
+
+    try:
+        user_id, role, expires_at = payload.decode().split(':')
+        if int(expires_at) < time.time():
+            return None
+        return int(user_id), role
+    except ValueError:
+        return None
+
+
+def authenticate(event: dict):
+    '''Достаёт токен из заголовков запроса и возвращает (user_id, role) или None'''
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() in TOKEN_HEADERS and value:
+            return verify_token(value)
+        if key.lower() == 'authorization' and value.startswith('Bearer '):
+            return verify_token(value[7:])
+    return None
+
+
+if __name__ == '__main__':
+    import timeit
+
+    os.environ.setdefault('AUTH_TOKEN_SECRET', 'benchmark-secret')
+    sample = issue_token(12345, 'passenger')
+    runs = 100000
+    seconds = timeit.timeit(lambda: verify_token(sample), number=runs)
+    print(f'verify_token: {seconds / runs * 1e6:.2f} мкс на проверку ({runs} проверок)')
+    seconds = timeit.timeit(lambda: authenticate({'headers': {'X-Auth-Token': sample}}), number=runs)
+    print(f'authenticate: {seconds / runs * 1e6:.2f} мкс на запрос ({runs} запросов)')
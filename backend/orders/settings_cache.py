@@ -0,0 +1,52 @@
+import os
+import time
+
+SETTINGS_CHECK_INTERVAL = float(os.environ.get('SETTINGS_CHECK_INTERVAL', '30'))
+
+DEFAULT_SETTINGS = {
+    'city_name': 'Павлово',
+    'shift_cost': '350',
+    'shift_hours': '12',
+    'discount_percent': '30',
+    'site_maintenance': 'false'
+}
+
+_settings = None
+_watermark = None
+_checked_at = 0.0
+
+
+def get_settings(cur) -> dict:
+    '''Снимок system_settings из памяти контейнера.
+
+    Не чаще раза в SETTINGS_CHECK_INTERVAL секунд сверяет метку MAX(updated_at)
+    и перечитывает таблицу целиком, только если метка изменилась.
+    '''
+    global _settings, _watermark, _checked_at
+    now = time.monotonic()
+    if _settings is not None and now - _checked_at < SETTINGS_CHECK_INTERVAL:
+        return _settings
+
+    cur.execute("SELECT MAX(updated_at), COUNT(*) FROM system_settings")
+    watermark = tuple(cur.fetchone())
+
+    if _settings is None or watermark != _watermark:
+        cur.execute("SELECT setting_key, setting_value FROM system_settings")
+        _settings = {row[0]: row[1] for row in cur.fetchall()}
+        _watermark = watermark
+
+    _checked_at = now
+    return _settings
+
+
+def invalidate():
+    '''Сбрасывает снимок после изменения настроек в этом контейнере'''
+    global _settings, _watermark, _checked_at
+    _settings = None
+    _watermark = None
+    _checked_at = 0.0
+
+
+def get_setting(cur, key: str) -> str:
+    return get_settings(cur).get(key, DEFAULT_SETTINGS.get(key))
+
@@ -0,0 +1,283 @@
+import os
+import threading
+import time
+import instrumentation
+import matching
+
+SURGE_WINDOW_SECONDS = int(os.environ.get('SURGE_WINDOW_SECONDS', '600'))
+SURGE_BUCKET_SECONDS = int(os.environ.get('SURGE_BUCKET_SECONDS', '30'))
+SURGE_REFRESH_INTERVAL = float(os.environ.get('SURGE_REFRESH_INTERVAL', '15'))
+SURGE_SNAPSHOT_INTERVAL = float(os.environ.get('SURGE_SNAPSHOT_INTERVAL', '300'))
+SURGE_MAX_AGE = int(os.environ.get('SURGE_MAX_AGE', '120'))
+SURGE_SMOOTHING = float(os.environ.get('SURGE_SMOOTHING', '0.3'))
+SURGE_THRESHOLD = float(os.environ.get('SURGE_THRESHOLD', '1.0'))
+SURGE_SENSITIVITY = float(os.environ.get('SURGE_SENSITIVITY', '0.5'))
+SURGE_MAX_MULTIPLIER = float(os.environ.get('SURGE_MAX_MULTIPLIER', '2.5'))
+SURGE_MIN_ORDERS = int(os.environ.get('SURGE_MIN_ORDERS', '3'))
+SURGE_STEP = 0.1
+DRIVER_LOCATION_TTL = int(os.environ.get('DRIVER_LOCATION_TTL', '120'))
+
+# Все заказы окна, заново на каждом обновлении. Курсор по id пропускал бы заказ
+# с меньшим id, зафиксированный позже большего; граница created_at считается
+# в базе и оставляет только последнюю секцию orders
+WINDOW_ORDERS_SQL = """SELECT from_lat, from_lon FROM orders
+       WHERE created_at >= LOCALTIMESTAMP - %s * INTERVAL '1 second' AND from_lat IS NOT NULL"""
+
+ON_SHIFT_DRIVERS_SQL = f"""SELECT dl.lat, dl.lon FROM driver_locations dl
+       JOIN driver_balances b ON b.user_id = dl.driver_id AND {matching.SHIFT_ON_SQL}
+       WHERE dl.updated_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'"""
+
+PUBLISH_SQL = """INSERT INTO surge_multipliers (zone_id, multiplier, demand, supply, updated_at)
+       SELECT *, CURRENT_TIMESTAMP FROM unnest(%s::INTEGER[], %s::DECIMAL[], %s::INTEGER[], %s::DECIMAL[])
+       ON CONFLICT (zone_id) DO UPDATE
+       SET multiplier = EXCLUDED.multiplier, demand = EXCLUDED.demand,
+           supply = EXCLUDED.supply, updated_at = EXCLUDED.updated_at"""
+
+SNAPSHOT_SQL = """INSERT INTO surge_snapshots (zone_id, multiplier, demand, supply)
+       SELECT * FROM unnest(%s::INTEGER[], %s::DECIMAL[], %s::INTEGER[], %s::DECIMAL[])"""
+
+# Коэффициенты, которые обработчик подставляет в цену. Давно не обновлявшиеся
+# строки означают, что пересчёт остановился: цена тогда без повышения
+CURRENT_SQL = """SELECT zone_id, multiplier FROM surge_multipliers
+       WHERE multiplier > 1 AND updated_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'"""
+
+_cache = {}
+_loaded_at = None
+_load_lock = threading.Lock()
+
+
+class SlidingWindow:
+    '''Сумма за последние window секунд в кольце корзин по bucket секунд.
+
+    Добавление и чтение суммы — O(1) амортизированно: при сдвиге времени
+    из суммы вычитаются только корзины, выпавшие из окна.
+    '''
+
+    __slots__ = ('bucket_seconds', 'counts', 'total', 'head')
+
+    def __init__(self, window_seconds: int = SURGE_WINDOW_SECONDS, bucket_seconds: int = SURGE_BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.counts = [0] * max(1, window_seconds // bucket_seconds)
+        self.total = 0
+        self.head = None
+
+    def _advance(self, now: float):
+        current = int(now // self.bucket_seconds)
+        if self.head is None or current - self.head >= len(self.counts):
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        else:
+            for bucket in range(self.head + 1, current + 1):
+                index = bucket % len(self.counts)
+                self.total -= self.counts[index]
+                self.counts[index] = 0
+        self.head = current
+
+    def add(self, value: int, now: float, at: float = None):
+        '''Значение на момент at (по умолчанию now); уже выпавшее из окна отбрасывается'''
+        if self.head is None or now // self.bucket_seconds > self.head:
+            self._advance(now)
+        bucket = min(int((now if at is None else at) // self.bucket_seconds), self.head)
+        if self.head - bucket >= len(self.counts):
+            return
+        self.counts[bucket % len(self.counts)] += value
+        self.total += value
+
+    def sum(self, now: float) -> int:
+        if self.head is None or now // self.bucket_seconds > self.head:
+            self._advance(now)
+        return self.total
+
+
+class ZoneDemand:
+    '''Одна зона: заказов в окне по последнему пересчёту и окна замеров водителей на смене'''
+
+    __slots__ = ('orders', 'drivers', 'samples', 'multiplier')
+
+    def __init__(self):
+        self.orders = 0
+        self.drivers = SlidingWindow()
+        self.samples = SlidingWindow()
+        self.multiplier = 1.0
+
+    def supply(self, now: float) -> float:
+        samples = self.samples.sum(now)
+        return self.drivers.sum(now) / samples if samples else 0.0
+
+
+def target_multiplier(demand: int, supply: float) -> float:
+    '''Коэффициент без сглаживания: растёт с числом заказов на водителя сверх порога'''
+    if demand < SURGE_MIN_ORDERS:
+        return 1.0
+    ratio = demand / max(supply, 1.0)
+    return min(max(1.0, 1.0 + SURGE_SENSITIVITY * (ratio - SURGE_THRESHOLD)), SURGE_MAX_MULTIPLIER)
+
+
+class SurgeTracker:
+    '''Коэффициенты повышенного спроса по тарифным зонам в памяти процесса пересчёта.
+
+    observe() принимает число заказов в окне по зонам, дописывает в окна
+    замер водителей на смене и пересчитывает коэффициенты: экспоненциальное сглаживание не даёт цене
+    скакать от замера к замеру, шаг SURGE_STEP — дрожать в сотых. Готовые
+    коэффициенты лежат в словаре, который подменяется целиком, поэтому
+    запрос читает его без блокировок за одно обращение по id зоны.
+    '''
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.zones = {}
+        self.multipliers = {}
+        self.refreshed_at = None
+        self.snapshot_at = None
+
+    def observe(self, zone_ids, orders: dict, drivers: dict, now: float = None):
+        '''orders — {id зоны: заказов в окне}, drivers — {id зоны: водителей сейчас}'''
+        now = self.clock() if now is None else now
+        zones = {zone_id: self.zones.get(zone_id) or ZoneDemand() for zone_id in zone_ids}
+        for zone_id, state in zones.items():
+            state.orders = orders.get(zone_id, 0)
+
+        multipliers = {}
+        for zone_id, state in zones.items():
+            state.drivers.add(drivers.get(zone_id, 0), now)
+            state.samples.add(1, now)
+            target = target_multiplier(state.orders, state.supply(now))
+            state.multiplier += SURGE_SMOOTHING * (target - state.multiplier)
+            multiplier = round(round(state.multiplier / SURGE_STEP) * SURGE_STEP, 2)
+            if multiplier > 1.0:
+                multipliers[zone_id] = multiplier
+        self.zones = zones
+        self.multipliers = multipliers
+
+    def snapshot(self, now: float = None) -> list:
+        '''[(id зоны, коэффициент, заказов в окне, среднее число водителей)] по всем зонам'''
+        now = self.clock() if now is None else now
+        return [
+            (zone_id, self.multipliers.get(zone_id, 1.0), state.orders, round(state.supply(now), 2))
+            for zone_id, state in self.zones.items()
+        ]
+
+
+def refresh(cur, tracker: SurgeTracker, engine, now: float):
+    '''Пересчитывает заказы окна, дописывает позиции водителей и публикует коэффициенты всех зон.
+
+    Раз в SURGE_SNAPSHOT_INTERVAL добавляет снимок для аудита. Фиксирует
+    транзакцию вызывающий.
+    '''
+    cur.execute(WINDOW_ORDERS_SQL, (SURGE_WINDOW_SECONDS,))
+    orders = {}
+    for lat, lon in cur.fetchall():
+        for zone in engine.zones.lookup(lat, lon):
+            orders[zone.id] = orders.get(zone.id, 0) + 1
+
+    cur.execute(ON_SHIFT_DRIVERS_SQL, (DRIVER_LOCATION_TTL,))
+    drivers = {}
+    for lat, lon in cur.fetchall():
+        for zone in engine.zones.lookup(lat, lon):
+            drivers[zone.id] = drivers.get(zone.id, 0) + 1
+
+    tracker.observe([zone.id for zone in engine.zones.zones], orders, drivers, now)
+    tracker.refreshed_at = now
+
+    rows = tracker.snapshot(now)
+    columns = [list(column) for column in zip(*rows)] or [[], [], [], []]
+    cur.execute(PUBLISH_SQL, columns)
+    cur.execute("DELETE FROM surge_multipliers WHERE NOT (zone_id = ANY(%s::INTEGER[]))", (columns[0],))
+
+    if tracker.snapshot_at is None or now - tracker.snapshot_at >= SURGE_SNAPSHOT_INTERVAL:
+        if rows:
+            cur.execute(SNAPSHOT_SQL, columns)
+        tracker.snapshot_at = now
+
+
+def get_multipliers(cur) -> dict:
+    '''{id зоны: коэффициент} для зон с повышенным спросом; зон без него в словаре нет.
+
+    Не чаще раза в SURGE_REFRESH_INTERVAL один из запросов контейнера
+    перечитывает опубликованные коэффициенты на своём же курсоре (подходит
+    и реплика); остальные в это время берут словарь из памяти. Чтение идёт
+    под точкой сохранения: ошибка не обрывает транзакцию обработчика, цена
+    считается по прежним коэффициентам, а сбой пишется в лог и счётчик
+    failures метрик функции.
+    '''
+    global _cache, _loaded_at
+    now = time.monotonic()
+    if _loaded_at is not None and now - _loaded_at < SURGE_REFRESH_INTERVAL:
+        return _cache
+    if not _load_lock.acquire(blocking=False):
+        return _cache
+    try:
+        _loaded_at = now
+        cur.execute("SAVEPOINT surge_load")
+        try:
+            cur.execute(CURRENT_SQL, (SURGE_MAX_AGE,))
+            _cache = {zone_id: float(multiplier) for zone_id, multiplier in cur.fetchall()}
+            cur.execute("RELEASE SAVEPOINT surge_load")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT surge_load")
+            instrumentation.record_failure('surge.load', e)
+    finally:
+        _load_lock.release()
+    return _cache
+
+
+def _run(args):
+    import psycopg2
+    import fare
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    tracker = SurgeTracker()
+    while True:
+        started = time.monotonic()
+        cur = conn.cursor()
+        try:
+            refresh(cur, tracker, fare.get_engine(cur), started)
+            conn.commit()
+            print(f'зон с повышенным спросом: {len(tracker.multipliers)} '
+                  f'за {(time.monotonic() - started) * 1e3:.1f} мс', flush=True)
+        except psycopg2.Error as e:
+            conn.rollback()
+            instrumentation.record_failure('surge.refresh', e)
+        finally:
+            cur.close()
+        if args.once:
+            break
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    conn.close()
+
+
+def _bench(args):
+    import random
+    import timeit
+
+    rng = random.Random(1)
+    zone_ids = list(range(200))
+    tracker = SurgeTracker()
+    now = 0.0
+    for _ in range(SURGE_WINDOW_SECONDS // int(SURGE_REFRESH_INTERVAL)):
+        now += SURGE_REFRESH_INTERVAL
+        orders = {zone_id: rng.randint(0, 12) for zone_id in zone_ids}
+        drivers = {zone_id: rng.randint(0, 6) for zone_id in zone_ids}
+        tracker.observe(zone_ids, orders, drivers, now)
+
+    runs = 200000
+    lookup = timeit.timeit(lambda: tracker.multipliers.get(rng.choice(zone_ids), 1.0), number=runs) / runs
+    observe = timeit.timeit(lambda: tracker.observe(zone_ids, orders, drivers, now + SURGE_REFRESH_INTERVAL), number=20) / 20
+
+    print(f'зон с повышенным спросом: {len(tracker.multipliers)} из {len(zone_ids)}, '
+          f'максимум x{max(tracker.multipliers.values(), default=1.0)}')
+    print(f'коэффициент для запроса: {lookup * 1e6:.2f} мкс')
+    print(f'обновление окон ({len(zone_ids)} зон, {sum(orders.values())} заказов): {observe * 1e3:.2f} мс')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Коэффициенты спроса: пересчёт окон по зонам и замер скорости')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='пересчитывать и публиковать коэффициенты (один процесс)')
+    run_parser.add_argument('--once', action='store_true', help='один проход вместо бесконечного цикла')
+    run_parser.add_argument('--interval', type=float, default=SURGE_REFRESH_INTERVAL)
+    commands.add_parser('bench')
+    args = parser.parse_args()
+    _run(args) if args.command == 'run' else _bench(args)
@@ -0,0 +1,8 @@
+-- Составные индексы для постраничной истории заказов по ключу (created_at, id)
+
+CREATE INDEX IF NOT EXISTS idx_orders_passenger_created ON orders(passenger_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_driver_created ON orders(driver_id, created_at DESC, id DESC);
+
+-- Одиночные индексы покрываются составными по ведущему столбцу
+DROP INDEX IF EXISTS idx_orders_passenger;
+DROP INDEX IF EXISTS idx_orders_driver;
@@ -0,0 +1,105 @@
+-- Дневные агрегаты для дашборда админки, обновляемые триггерами при записи
+
+-- Счётчики дня разбиты на шарды, чтобы параллельные заказы не ждали блокировку одной строки
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day DATE NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    income DECIMAL(12, 2) NOT NULL DEFAULT 0.00,
+    shift_payments INTEGER NOT NULL DEFAULT 0,
+    new_users INTEGER NOT NULL DEFAULT 0,
+    new_drivers INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, shard)
+);
+
+CREATE OR REPLACE FUNCTION daily_stats_add(
+    p_day DATE, p_shard INTEGER, p_orders INTEGER, p_income DECIMAL,
+    p_shift_payments INTEGER, p_new_users INTEGER, p_new_drivers INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO daily_stats (day, shard, orders_count, income, shift_payments, new_users, new_drivers)
+    VALUES (p_day, p_shard % 16, p_orders, p_income, p_shift_payments, p_new_users, p_new_drivers)
+    ON CONFLICT (day, shard) DO UPDATE SET
+        orders_count = daily_stats.orders_count + EXCLUDED.orders_count,
+        income = daily_stats.income + EXCLUDED.income,
+        shift_payments = daily_stats.shift_payments + EXCLUDED.shift_payments,
+        new_users = daily_stats.new_users + EXCLUDED.new_users,
+        new_drivers = daily_stats.new_drivers + EXCLUDED.new_drivers;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION daily_stats_on_user() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM daily_stats_add(
+        COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::DATE, NEW.id, 0, 0, 0,
+        1, CASE WHEN NEW.role = 'driver' THEN 1 ELSE 0 END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION daily_stats_on_order() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM daily_stats_add(COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::DATE, NEW.id, 1, 0, 0, 0, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Доход учитывается в момент одобрения оплаты смены, по дате создания транзакции
+CREATE OR REPLACE FUNCTION daily_stats_on_transaction() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.type = 'shift_payment' AND NEW.status = 'approved'
+       AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'approved') THEN
+        PERFORM daily_stats_add(COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::DATE, NEW.id, 0, NEW.amount, 1, 0, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_daily_stats_users ON users;
+CREATE TRIGGER trg_daily_stats_users AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION daily_stats_on_user();
+
+DROP TRIGGER IF EXISTS trg_daily_stats_orders ON orders;
+CREATE TRIGGER trg_daily_stats_orders AFTER INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION daily_stats_on_order();
+
+DROP TRIGGER IF EXISTS trg_daily_stats_transactions ON transactions;
+CREATE TRIGGER trg_daily_stats_transactions AFTER INSERT OR UPDATE OF status ON transactions
+    FOR EACH ROW EXECUTE FUNCTION daily_stats_on_transaction();
+
+-- Полный пересчёт агрегатов из истории (первичное заполнение и исправление расхождений)
+CREATE OR REPLACE FUNCTION rebuild_daily_stats() RETURNS INTEGER AS $$
+DECLARE
+    days_count INTEGER;
+BEGIN
+    LOCK TABLE users, orders, transactions IN SHARE MODE;
+    LOCK TABLE daily_stats IN EXCLUSIVE MODE;
+
+    DELETE FROM daily_stats;
+
+    INSERT INTO daily_stats (day, shard, orders_count, income, shift_payments, new_users, new_drivers)
+    SELECT day, 0, SUM(orders_count), SUM(income), SUM(shift_payments), SUM(new_users), SUM(new_drivers)
+    FROM (
+        SELECT created_at::DATE AS day, 0 AS orders_count, 0 AS income, 0 AS shift_payments,
+               1 AS new_users, CASE WHEN role = 'driver' THEN 1 ELSE 0 END AS new_drivers
+        FROM users WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT created_at::DATE, 1, 0, 0, 0, 0
+        FROM orders WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT created_at::DATE, 0, amount, 1, 0, 0
+        FROM transactions
+        WHERE type = 'shift_payment' AND status = 'approved' AND created_at IS NOT NULL
+    ) history
+    GROUP BY day;
+
+    GET DIAGNOSTICS days_count = ROW_COUNT;
+    RETURN days_count;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_daily_stats();
+
+-- Подсчёт активных смен читает только строки с открытой сменой
+CREATE INDEX IF NOT EXISTS idx_driver_balances_shift_active ON driver_balances(user_id) WHERE shift_active = true;
@@ -0,0 +1,3 @@
+-- Частичный индекс очереди диспетчеризации: только ожидающие заказы в порядке поступления
+
+CREATE INDEX IF NOT EXISTS idx_orders_pending_queue ON orders(created_at, id) WHERE status = 'pending';
@@ -0,0 +1,41 @@
+-- Лента изменений статусов заказов для long-poll подписки через LISTEN/NOTIFY
+
+CREATE TABLE IF NOT EXISTS order_events (
+    id BIGSERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    passenger_id INTEGER,
+    driver_id INTEGER,
+    status VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_events_passenger ON order_events(passenger_id, id);
+CREATE INDEX IF NOT EXISTS idx_order_events_driver ON order_events(driver_id, id);
+
+-- id события служит версией: клиент передаёт последний полученный id в параметре since
+CREATE OR REPLACE FUNCTION order_events_on_change() RETURNS TRIGGER AS $$
+DECLARE
+    event_id BIGINT;
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.status IS NOT DISTINCT FROM OLD.status
+       AND NEW.driver_id IS NOT DISTINCT FROM OLD.driver_id THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO order_events (order_id, passenger_id, driver_id, status)
+    VALUES (NEW.id, NEW.passenger_id, NEW.driver_id, NEW.status)
+    RETURNING id INTO event_id;
+
+    PERFORM pg_notify('order_events', json_build_object(
+        'id', event_id,
+        'passenger_id', NEW.passenger_id,
+        'driver_id', NEW.driver_id
+    )::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_order_events ON orders;
+CREATE TRIGGER trg_order_events AFTER INSERT OR UPDATE OF status, driver_id ON orders
+    FOR EACH ROW EXECUTE FUNCTION order_events_on_change();
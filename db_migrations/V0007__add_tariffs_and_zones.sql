@@ -0,0 +1,38 @@
+-- Тарифы и тарифные зоны для расчёта стоимости поездки на сервере
+
+CREATE TABLE IF NOT EXISTS tariffs (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    base_fare DECIMAL(10, 2) NOT NULL,
+    per_km DECIMAL(10, 2) NOT NULL,
+    per_minute DECIMAL(10, 2) NOT NULL,
+    min_fare DECIMAL(10, 2) NOT NULL DEFAULT 0.00,
+    night_multiplier DECIMAL(4, 2) NOT NULL DEFAULT 1.00,
+    night_start_hour SMALLINT NOT NULL DEFAULT 22 CHECK (night_start_hour BETWEEN 0 AND 23),
+    night_end_hour SMALLINT NOT NULL DEFAULT 6 CHECK (night_end_hour BETWEEN 0 AND 23),
+    utc_offset_minutes INTEGER NOT NULL DEFAULT 180,
+    road_factor DECIMAL(4, 2) NOT NULL DEFAULT 1.30,
+    avg_speed_kmh DECIMAL(5, 1) NOT NULL DEFAULT 30.0,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Полигон зоны: JSON-массив вершин [[широта, долгота], ...]
+CREATE TABLE IF NOT EXISTS tariff_zones (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    surcharge DECIMAL(10, 2) NOT NULL DEFAULT 0.00,
+    polygon JSONB NOT NULL,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO tariffs (name, base_fare, per_km, per_minute, min_fare, night_multiplier)
+SELECT 'Базовый', 80.00, 18.00, 4.00, 150.00, 1.20
+WHERE NOT EXISTS (SELECT 1 FROM tariffs);
+
+-- Координаты точек заказа: по ним считается цена и пересчитывается история
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS from_lat DOUBLE PRECISION;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS from_lon DOUBLE PRECISION;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS to_lat DOUBLE PRECISION;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS to_lon DOUBLE PRECISION;
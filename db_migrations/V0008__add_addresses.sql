@@ -0,0 +1,30 @@
+-- Справочник адресов: нормализованная строка, координаты и источник геокодирования
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS addresses (
+    id SERIAL PRIMARY KEY,
+    normalized TEXT NOT NULL UNIQUE,
+    display TEXT NOT NULL,
+    lat DOUBLE PRECISION,
+    lon DOUBLE PRECISION,
+    provider VARCHAR(20),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Триграммный индекс обслуживает и префиксный LIKE 'ленина%', и поиск с опечатками
+CREATE INDEX IF NOT EXISTS idx_addresses_normalized_trgm ON addresses USING GIN (normalized gin_trgm_ops);
+
+-- Адреса пассажира: сколько раз и когда последний раз использовался
+CREATE TABLE IF NOT EXISTS passenger_addresses (
+    passenger_id INTEGER NOT NULL REFERENCES users(id),
+    address_id INTEGER NOT NULL REFERENCES addresses(id),
+    uses INTEGER NOT NULL DEFAULT 1,
+    last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (passenger_id, address_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_passenger_addresses_recent ON passenger_addresses(passenger_id, last_used_at DESC);
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS from_address_id INTEGER REFERENCES addresses(id);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS to_address_id INTEGER REFERENCES addresses(id);
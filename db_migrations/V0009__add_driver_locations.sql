@@ -0,0 +1,23 @@
+-- Последняя позиция водителя. UNLOGGED: таблица перезаписывается каждые несколько
+-- секунд, не пишет WAL и после сбоя сервера просто наполнится заново пингами
+CREATE UNLOGGED TABLE IF NOT EXISTS driver_locations (
+    driver_id INTEGER PRIMARY KEY,
+    lat DOUBLE PRECISION NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    cell BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITH (fillfactor = 70);
+
+-- Ячейка сетки ~0.01° — ключ поиска ближайших машин
+CREATE INDEX IF NOT EXISTS idx_driver_locations_cell ON driver_locations(cell);
+
+-- История треков дописывается пачками, пришедшими от приложения водителя
+CREATE TABLE IF NOT EXISTS driver_location_history (
+    id BIGSERIAL PRIMARY KEY,
+    driver_id INTEGER NOT NULL REFERENCES users(id),
+    lat DOUBLE PRECISION NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    recorded_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_driver_location_history_driver ON driver_location_history(driver_id, recorded_at);
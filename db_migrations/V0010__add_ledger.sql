@@ -0,0 +1,201 @@
+-- Двойная запись всех движений денег. Проводка — набор строк с одной ссылкой
+-- (reference_type, reference_id), сумма которых равна нулю. Балансы в
+-- passenger_balances, driver_balances и admin_balance — снимки, которые
+-- обновляются в той же транзакции, что и проводка.
+--
+-- Счета: passenger_rub, passenger_bonus, driver (account_id = users.id),
+-- системные admin, trips, external, opening (account_id = 0).
+
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    id BIGSERIAL PRIMARY KEY,
+    account_type VARCHAR(20) NOT NULL CHECK (account_type IN (
+        'passenger_rub', 'passenger_bonus', 'driver', 'admin', 'trips', 'external', 'opening'
+    )),
+    account_id INTEGER NOT NULL DEFAULT 0,
+    amount DECIMAL(12, 2) NOT NULL,
+    reference_type VARCHAR(20) NOT NULL,
+    reference_id BIGINT NOT NULL,
+    -- Номер транзакции записи: сверка идёт по горизонту завершённых транзакций, а не по id,
+    -- потому что id выдаются при вставке, а фиксируются транзакции в другом порядке
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_txid ON ledger_entries(txid);
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_account ON ledger_entries(account_type, account_id, id);
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_reference ON ledger_entries(reference_type, reference_id);
+
+-- Проводка должна сходиться к нулю на момент фиксации транзакции
+CREATE OR REPLACE FUNCTION ledger_check_posting() RETURNS TRIGGER AS $$
+DECLARE
+    total DECIMAL;
+BEGIN
+    SELECT SUM(amount) INTO total FROM ledger_entries
+    WHERE reference_type = NEW.reference_type AND reference_id = NEW.reference_id;
+    IF total <> 0 THEN
+        RAISE EXCEPTION 'ledger posting %/% is unbalanced by %', NEW.reference_type, NEW.reference_id, total;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ledger_check_posting ON ledger_entries;
+CREATE CONSTRAINT TRIGGER trg_ledger_check_posting AFTER INSERT ON ledger_entries
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION ledger_check_posting();
+
+-- Баланс платформы — одна строка
+CREATE UNIQUE INDEX IF NOT EXISTS idx_admin_balance_single ON admin_balance ((true));
+
+CREATE OR REPLACE VIEW ledger_snapshot_balances AS
+    SELECT 'passenger_rub'::VARCHAR(20) AS account_type, user_id AS account_id, rub_balance AS balance
+    FROM passenger_balances
+    UNION ALL
+    SELECT 'passenger_bonus', user_id, bonus_balance FROM passenger_balances
+    UNION ALL
+    SELECT 'driver', user_id, balance FROM driver_balances
+    UNION ALL
+    SELECT 'admin', 0, balance FROM admin_balance;
+
+-- Входящие остатки для счетов без истории: первичное заполнение и данные, залитые в обход API
+CREATE OR REPLACE FUNCTION ledger_open_balances() RETURNS INTEGER AS $$
+DECLARE
+    opened INTEGER;
+    base BIGINT;
+BEGIN
+    SELECT COALESCE(MAX(reference_id), 0) INTO base FROM ledger_entries WHERE reference_type = 'opening';
+
+    WITH missing AS (
+        SELECT s.account_type, s.account_id, s.balance,
+               base + row_number() OVER (ORDER BY s.account_type, s.account_id) AS reference_id
+        FROM ledger_snapshot_balances s
+        WHERE s.balance <> 0
+          AND NOT EXISTS (
+              SELECT 1 FROM ledger_entries e
+              WHERE e.account_type = s.account_type AND e.account_id = s.account_id
+          )
+    )
+    INSERT INTO ledger_entries (account_type, account_id, amount, reference_type, reference_id)
+    SELECT leg.account_type, leg.account_id, leg.amount, 'opening', m.reference_id
+    FROM missing m
+    CROSS JOIN LATERAL (VALUES
+        (m.account_type, m.account_id, m.balance),
+        ('opening'::VARCHAR(20), 0, -m.balance)
+    ) AS leg(account_type, account_id, amount);
+
+    GET DIAGNOSTICS opened = ROW_COUNT;
+    RETURN opened / 2;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ledger_open_balances();
+
+-- Итоги по счетам на момент последней сверки и её горизонт
+CREATE TABLE IF NOT EXISTS ledger_account_totals (
+    account_type VARCHAR(20) NOT NULL,
+    account_id INTEGER NOT NULL,
+    total DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (account_type, account_id)
+);
+
+CREATE TABLE IF NOT EXISTS ledger_reconcile_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    horizon_txid BIGINT NOT NULL DEFAULT 0,
+    checked_at TIMESTAMP
+);
+
+INSERT INTO ledger_reconcile_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+    id SERIAL PRIMARY KEY,
+    horizon_txid BIGINT NOT NULL,
+    full_scan BOOLEAN NOT NULL,
+    accounts_checked INTEGER NOT NULL,
+    mismatches INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ledger_mismatches (
+    id SERIAL PRIMARY KEY,
+    checkpoint_id INTEGER NOT NULL REFERENCES ledger_checkpoints(id),
+    account_type VARCHAR(20) NOT NULL,
+    account_id INTEGER NOT NULL,
+    snapshot_balance DECIMAL(14, 2) NOT NULL,
+    ledger_balance DECIMAL(14, 2) NOT NULL
+);
+
+-- Инкрементальная сверка снимков с журналом.
+--
+-- Читаются только записи транзакций, начиная с горизонта прошлой сверки, и
+-- проверяются только затронутые ими счета (full = true — все счета, но журнал
+-- всё равно не пересчитывается целиком). Все транзакции ниже txid_snapshot_xmin
+-- завершены, поэтому их записи добавляются к сохранённым итогам окончательно;
+-- записи более свежих транзакций учитываются в сравнении, но в итоги попадут
+-- при следующей сверке. Должна выполняться в REPEATABLE READ, чтобы журнал и
+-- снимки читались из одного снимка базы.
+CREATE OR REPLACE FUNCTION reconcile_ledger(p_full BOOLEAN DEFAULT false)
+RETURNS TABLE (checkpoint_id INTEGER, accounts_checked INTEGER, mismatches INTEGER) AS $$
+#variable_conflict use_column
+DECLARE
+    previous_horizon BIGINT;
+    next_horizon BIGINT := txid_snapshot_xmin(txid_current_snapshot());
+    v_checkpoint INTEGER;
+    v_checked INTEGER;
+    v_mismatches INTEGER;
+BEGIN
+    IF current_setting('transaction_isolation') <> 'repeatable read' THEN
+        RAISE EXCEPTION 'reconcile_ledger requires REPEATABLE READ isolation';
+    END IF;
+
+    -- Параллельная сверка, успевшая сдвинуть горизонт, приведёт к ошибке сериализации
+    SELECT s.horizon_txid INTO previous_horizon FROM ledger_reconcile_state s WHERE s.id = 1 FOR UPDATE;
+
+    INSERT INTO ledger_checkpoints (horizon_txid, full_scan, accounts_checked, mismatches)
+    VALUES (next_horizon, p_full, 0, 0)
+    RETURNING id INTO v_checkpoint;
+
+    -- Все части запроса видят один снимок: сравнение идёт с итогами до их обновления
+    WITH delta AS (
+        SELECT e.account_type, e.account_id,
+               SUM(e.amount) AS visible,
+               COALESCE(SUM(e.amount) FILTER (WHERE e.txid < next_horizon), 0) AS settled
+        FROM ledger_entries e
+        WHERE e.txid >= previous_horizon
+        GROUP BY e.account_type, e.account_id
+    ),
+    compared AS (
+        SELECT c.account_type, c.account_id,
+               COALESCE(s.balance, 0) AS snapshot_balance,
+               COALESCE(t.total, 0) + COALESCE(d.visible, 0) AS ledger_balance
+        FROM (
+            SELECT account_type, account_id FROM delta
+            WHERE NOT p_full AND account_type IN ('passenger_rub', 'passenger_bonus', 'driver', 'admin')
+            UNION ALL
+            SELECT account_type, account_id FROM ledger_snapshot_balances WHERE p_full
+        ) c
+        LEFT JOIN ledger_snapshot_balances s ON s.account_type = c.account_type AND s.account_id = c.account_id
+        LEFT JOIN ledger_account_totals t ON t.account_type = c.account_type AND t.account_id = c.account_id
+        LEFT JOIN delta d ON d.account_type = c.account_type AND d.account_id = c.account_id
+    ),
+    recorded AS (
+        INSERT INTO ledger_mismatches (checkpoint_id, account_type, account_id, snapshot_balance, ledger_balance)
+        SELECT v_checkpoint, account_type, account_id, snapshot_balance, ledger_balance
+        FROM compared
+        WHERE snapshot_balance <> ledger_balance
+        RETURNING id
+    ),
+    totals AS (
+        INSERT INTO ledger_account_totals (account_type, account_id, total)
+        SELECT account_type, account_id, settled FROM delta WHERE settled <> 0
+        ON CONFLICT (account_type, account_id)
+        DO UPDATE SET total = ledger_account_totals.total + EXCLUDED.total
+    )
+    SELECT (SELECT COUNT(*) FROM compared), (SELECT COUNT(*) FROM recorded)
+    INTO v_checked, v_mismatches;
+
+    UPDATE ledger_checkpoints SET accounts_checked = v_checked, mismatches = v_mismatches WHERE id = v_checkpoint;
+    UPDATE ledger_reconcile_state SET horizon_txid = next_horizon, checked_at = CURRENT_TIMESTAMP WHERE id = 1;
+
+    RETURN QUERY SELECT v_checkpoint, v_checked, v_mismatches;
+END;
+$$ LANGUAGE plpgsql;
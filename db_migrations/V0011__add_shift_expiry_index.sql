@@ -0,0 +1,26 @@
+-- Продолжительность смены, которую покупает водитель
+INSERT INTO system_settings (setting_key, setting_value) VALUES ('shift_hours', '12')
+ON CONFLICT (setting_key) DO NOTHING;
+
+-- Закрытие истёкших смен читает только открытые смены в порядке окончания
+CREATE INDEX IF NOT EXISTS idx_driver_balances_shift_ends ON driver_balances(shift_ends_at) WHERE shift_active = true;
+
+-- Закрывает истёкшие смены пачками, каждая пачка — отдельная короткая транзакция
+-- вызывающего. Строки, которые сейчас меняет покупка смены, пропускаются до следующего прохода.
+CREATE OR REPLACE FUNCTION expire_shifts(p_batch_size INTEGER DEFAULT 1000) RETURNS INTEGER AS $$
+DECLARE
+    closed INTEGER;
+BEGIN
+    UPDATE driver_balances
+    SET shift_active = false, updated_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+        SELECT id FROM driver_balances
+        WHERE shift_active = true AND shift_ends_at <= CURRENT_TIMESTAMP
+        ORDER BY shift_ends_at
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    );
+    GET DIAGNOSTICS closed = ROW_COUNT;
+    RETURN closed;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,31 @@
+-- Ответы на запросы с заголовком Idempotency-Key: повтор отдаёт сохранённый ответ
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INTEGER NOT NULL,
+    idempotency_key VARCHAR(64) NOT NULL,
+    scope VARCHAR(40) NOT NULL,
+    request_hash BYTEA NOT NULL,
+    status_code SMALLINT,
+    response_body TEXT,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+
+-- Удаляет просроченные ключи пачкой; вызывается в цикле, пока пачки полные
+CREATE OR REPLACE FUNCTION purge_idempotency_keys(p_batch_size INTEGER DEFAULT 5000) RETURNS INTEGER AS $$
+DECLARE
+    deleted INTEGER;
+BEGIN
+    DELETE FROM idempotency_keys
+    WHERE ctid IN (
+        SELECT ctid FROM idempotency_keys
+        WHERE expires_at <= CURRENT_TIMESTAMP
+        ORDER BY expires_at
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    );
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,19 @@
+-- Общие корзины ограничения частоты входа. UNLOGGED: состояние временное,
+-- потерять его при сбое сервера не страшно, а запись не нагружает WAL
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket_key VARCHAR(200) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+) WITH (fillfactor = 70);
+
+-- Удаляет корзины, не тронутые дольше p_max_idle_seconds: они давно полные
+CREATE OR REPLACE FUNCTION purge_rate_limit_buckets(p_max_idle_seconds INTEGER DEFAULT 86400) RETURNS INTEGER AS $$
+DECLARE
+    deleted INTEGER;
+BEGIN
+    DELETE FROM rate_limit_buckets
+    WHERE updated_at < EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) - p_max_idle_seconds;
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,11 @@
+-- Справочник пользователей в админке: поиск по телефону и имени и постраничный вывод
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Триграммы покрывают поиск подстроки и префикса: LIKE '%900123%', ILIKE '%иван%'
+CREATE INDEX IF NOT EXISTS idx_users_phone_trgm ON users USING GIN (phone gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_full_name_trgm ON users USING GIN (full_name gin_trgm_ops);
+
+-- Ключ страницы (created_at, id) для всего списка и в пределах роли
+CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_role_created ON users(role, created_at DESC, id DESC);
@@ -0,0 +1,29 @@
+-- Жизненный цикл заказа: время переходов статусов и накопительный рейтинг водителя
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS started_at TIMESTAMP;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS cancelled_at TIMESTAMP;
+
+-- Рейтинг хранится суммой и числом оценок: новая оценка меняет их на единицу,
+-- rating = rating_sum / rating_count без пересчёта AVG по всем заказам водителя
+ALTER TABLE driver_profiles ADD COLUMN IF NOT EXISTS rating_sum BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE driver_profiles ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE driver_profiles SET total_trips = 0 WHERE total_trips IS NULL;
+ALTER TABLE driver_profiles ALTER COLUMN total_trips SET NOT NULL;
+
+-- Начальные значения счётчиков по уже завершённым и оценённым заказам
+UPDATE driver_profiles dp
+SET total_trips = t.trips,
+    rating_sum = t.rating_sum,
+    rating_count = t.rating_count,
+    rating = CASE WHEN t.rating_count > 0 THEN ROUND(t.rating_sum::DECIMAL / t.rating_count, 2) ELSE dp.rating END
+FROM (
+    SELECT driver_id, COUNT(*) AS trips,
+           COALESCE(SUM(passenger_rating), 0) AS rating_sum,
+           COUNT(passenger_rating) AS rating_count
+    FROM orders
+    WHERE status = 'completed' AND driver_id IS NOT NULL
+    GROUP BY driver_id
+) t
+WHERE dp.user_id = t.driver_id;
+
@@ -0,0 +1,157 @@
+-- Помесячные секции orders и transactions по created_at и реестр выгруженных в архив секций
+
+-- Секции с именами <таблица>_pYYYYMM на каждый месяц диапазона, которых ещё нет.
+-- Секции DEFAULT нет: строка вне всех секций — ошибка вставки, поэтому секции
+-- создаются с запасом вперёд (backend/admin/partitions.py ensure по расписанию).
+CREATE OR REPLACE FUNCTION create_monthly_partitions(p_table TEXT, p_from DATE, p_to DATE) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_from)::DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= p_to LOOP
+        partition_name := format('%s_p%s', p_table, to_char(month_start, 'YYYYMM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, p_table, month_start, (month_start + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос обычной таблицы в секционированную с тем же именем, колонками, умолчаниями
+-- и CHECK. Первичный ключ секционированной таблицы обязан включать ключ секционирования,
+-- поэтому он становится (id, created_at); id по-прежнему выдаёт та же последовательность.
+-- Индексы, триггеры и внешние ключи создаются после переноса, чтобы копирование
+-- не пересчитывало агрегаты и не порождало события заказов. Повторный вызов ничего не делает.
+CREATE OR REPLACE FUNCTION convert_to_monthly_partitions(p_table TEXT, p_months_ahead INTEGER) RETURNS BIGINT AS $$
+DECLARE
+    legacy TEXT := p_table || '_unpartitioned';
+    id_sequence TEXT := pg_get_serial_sequence(p_table, 'id');
+    first_day DATE;
+    last_day DATE;
+    moved BIGINT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = p_table::REGCLASS) = 'p' THEN
+        RETURN 0;
+    END IF;
+
+    EXECUTE format('LOCK TABLE %I IN ACCESS EXCLUSIVE MODE', p_table);
+    EXECUTE format('UPDATE %I SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL', p_table);
+    EXECUTE format('SELECT MIN(created_at)::DATE, MAX(created_at)::DATE FROM %I', p_table)
+        INTO first_day, last_day;
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', p_table, legacy);
+    EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', legacy, p_table || '_pkey', legacy || '_pkey');
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS, PRIMARY KEY (id, created_at))
+         PARTITION BY RANGE (created_at)',
+        p_table, legacy
+    );
+
+    PERFORM create_monthly_partitions(
+        p_table,
+        COALESCE(first_day, CURRENT_DATE),
+        GREATEST(COALESCE(last_day, CURRENT_DATE), (CURRENT_DATE + p_months_ahead * INTERVAL '1 month')::DATE)
+    );
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', p_table, legacy);
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    IF id_sequence IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', id_sequence, p_table);
+    END IF;
+    EXECUTE format('DROP TABLE %I', legacy);
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ссылка на заказ по одному id невозможна: уникален только (id, created_at)
+ALTER TABLE order_events DROP CONSTRAINT IF EXISTS order_events_order_id_fkey;
+
+SELECT convert_to_monthly_partitions('orders', 3);
+SELECT convert_to_monthly_partitions('transactions', 3);
+
+-- Внешние ключи, индексы и триггеры прежних таблиц; индексы создаются в каждой секции,
+-- в том числе в будущих
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'orders_passenger_id_fkey') THEN
+        ALTER TABLE orders ADD CONSTRAINT orders_passenger_id_fkey FOREIGN KEY (passenger_id) REFERENCES users(id);
+        ALTER TABLE orders ADD CONSTRAINT orders_driver_id_fkey FOREIGN KEY (driver_id) REFERENCES users(id);
+        ALTER TABLE orders ADD CONSTRAINT orders_from_address_id_fkey FOREIGN KEY (from_address_id) REFERENCES addresses(id);
+        ALTER TABLE orders ADD CONSTRAINT orders_to_address_id_fkey FOREIGN KEY (to_address_id) REFERENCES addresses(id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'transactions_user_id_fkey') THEN
+        ALTER TABLE transactions ADD CONSTRAINT transactions_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(id);
+    END IF;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orders_passenger_created ON orders(passenger_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_driver_created ON orders(driver_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_pending_queue ON orders(created_at, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id);
+
+DROP TRIGGER IF EXISTS trg_daily_stats_orders ON orders;
+CREATE TRIGGER trg_daily_stats_orders AFTER INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION daily_stats_on_order();
+
+DROP TRIGGER IF EXISTS trg_order_events ON orders;
+CREATE TRIGGER trg_order_events AFTER INSERT OR UPDATE OF status, driver_id ON orders
+    FOR EACH ROW EXECUTE FUNCTION order_events_on_change();
+
+DROP TRIGGER IF EXISTS trg_daily_stats_transactions ON transactions;
+CREATE TRIGGER trg_daily_stats_transactions AFTER INSERT OR UPDATE OF status ON transactions
+    FOR EACH ROW EXECUTE FUNCTION daily_stats_on_transaction();
+
+-- Секции, выгруженные в архив: что, за какой месяц и куда ушло
+CREATE TABLE IF NOT EXISTS archived_partitions (
+    partition_name VARCHAR(63) PRIMARY KEY,
+    parent_table VARCHAR(63) NOT NULL,
+    range_from DATE NOT NULL,
+    range_to DATE NOT NULL,
+    rows_count BIGINT NOT NULL,
+    archive_file TEXT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Пересчёт агрегатов не трогает дни, чьи заказы и транзакции уже выгружены в архив:
+-- их значения остаются такими, какими были при выгрузке
+CREATE OR REPLACE FUNCTION rebuild_daily_stats() RETURNS INTEGER AS $$
+DECLARE
+    days_count INTEGER;
+    horizon DATE;
+BEGIN
+    LOCK TABLE users, orders, transactions IN SHARE MODE;
+    LOCK TABLE daily_stats IN EXCLUSIVE MODE;
+
+    SELECT COALESCE(MAX(range_to), '-infinity') INTO horizon FROM archived_partitions;
+
+    DELETE FROM daily_stats WHERE day >= horizon;
+
+    INSERT INTO daily_stats (day, shard, orders_count, income, shift_payments, new_users, new_drivers)
+    SELECT day, 0, SUM(orders_count), SUM(income), SUM(shift_payments), SUM(new_users), SUM(new_drivers)
+    FROM (
+        SELECT created_at::DATE AS day, 0 AS orders_count, 0 AS income, 0 AS shift_payments,
+               1 AS new_users, CASE WHEN role = 'driver' THEN 1 ELSE 0 END AS new_drivers
+        FROM users WHERE created_at >= horizon
+        UNION ALL
+        SELECT created_at::DATE, 1, 0, 0, 0, 0
+        FROM orders WHERE created_at >= horizon
+        UNION ALL
+        SELECT created_at::DATE, 0, amount, 1, 0, 0
+        FROM transactions
+        WHERE type = 'shift_payment' AND status = 'approved' AND created_at >= horizon
+    ) history
+    GROUP BY day;
+
+    GET DIAGNOSTICS days_count = ROW_COUNT;
+    RETURN days_count;
+END;
+$$ LANGUAGE plpgsql;
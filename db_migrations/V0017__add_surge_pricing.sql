@@ -0,0 +1,16 @@
+-- Повышающий коэффициент спроса по тарифным зонам: примененный к заказу и снимки для аудита
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS surge_multiplier DECIMAL(4, 2) NOT NULL DEFAULT 1.00;
+
+-- Снимки коэффициентов, которые функция заказов держит в памяти: раз в несколько
+-- минут каждый тёплый контейнер пишет по строке на зону
+CREATE TABLE IF NOT EXISTS surge_snapshots (
+    id BIGSERIAL PRIMARY KEY,
+    zone_id INTEGER NOT NULL,
+    multiplier DECIMAL(4, 2) NOT NULL,
+    demand INTEGER NOT NULL,
+    supply DECIMAL(8, 2) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_surge_snapshots_zone_created ON surge_snapshots(zone_id, created_at);
@@ -0,0 +1,12 @@
+-- Версия ленты событий заказов в порядке фиксации транзакций, а не выдачи id
+
+-- id из последовательности выдаётся до фиксации, поэтому событие с меньшим id может
+-- стать видимым позже большего. Клиенту отдаются только события транзакций ниже
+-- txid_snapshot_xmin — все они уже завершены, и новых событий ниже этой границы
+-- не появится; порядок ленты — (txid, id)
+ALTER TABLE order_events ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT txid_current();
+
+CREATE INDEX IF NOT EXISTS idx_order_events_passenger_txid ON order_events(passenger_id, txid, id);
+CREATE INDEX IF NOT EXISTS idx_order_events_driver_txid ON order_events(driver_id, txid, id);
+DROP INDEX IF EXISTS idx_order_events_passenger;
+DROP INDEX IF EXISTS idx_order_events_driver;
@@ -0,0 +1,21 @@
+-- Срок хранения ленты событий заказов: клиенты читают её с последней версии,
+-- старые события нужны только отставшим больше чем на срок хранения
+CREATE INDEX IF NOT EXISTS idx_order_events_created ON order_events(created_at);
+
+-- Удаляет события старше p_retention_days пачкой; вызывается в цикле, пока пачки полные
+CREATE OR REPLACE FUNCTION purge_order_events(p_retention_days INTEGER, p_batch_size INTEGER DEFAULT 5000) RETURNS INTEGER AS $$
+DECLARE
+    deleted INTEGER;
+BEGIN
+    DELETE FROM order_events
+    WHERE id IN (
+        SELECT id FROM order_events
+        WHERE created_at < CURRENT_TIMESTAMP - p_retention_days * INTERVAL '1 day'
+        ORDER BY created_at
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    );
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,10 @@
+-- Текущие коэффициенты спроса по зонам. Окна считает один процесс
+-- (backend/orders/surge.py по расписанию) и публикует их сюда, а функция заказов
+-- только читает таблицу, в том числе с реплики: driver_locations там нет
+CREATE TABLE IF NOT EXISTS surge_multipliers (
+    zone_id INTEGER PRIMARY KEY,
+    multiplier DECIMAL(4, 2) NOT NULL,
+    demand INTEGER NOT NULL,
+    supply DECIMAL(8, 2) NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,40 @@
+-- Время пингов водителей — с часовым поясом. Раньше приложение писало наивное UTC,
+-- а сравнивалось оно с CURRENT_TIMESTAMP в поясе сессии: на базе не в UTC все
+-- позиции выглядели устаревшими или слишком свежими. Прежние значения — UTC; при
+-- поясе сессии UTC смена типа не переписывает таблицу
+DO $$
+BEGIN
+    PERFORM set_config('TimeZone', 'UTC', true);
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'driver_locations' AND column_name = 'updated_at') = 'timestamp without time zone' THEN
+        ALTER TABLE driver_locations ALTER COLUMN updated_at TYPE TIMESTAMPTZ;
+    END IF;
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'driver_location_history' AND column_name = 'recorded_at') = 'timestamp without time zone' THEN
+        ALTER TABLE driver_location_history ALTER COLUMN recorded_at TYPE TIMESTAMPTZ;
+    END IF;
+END;
+$$;
+
+-- Срок хранения треков: около 86 млн точек в сутки. Строки дописываются по времени,
+-- поэтому BRIN по recorded_at почти ничего не стоит на вставке
+CREATE INDEX IF NOT EXISTS idx_driver_location_history_recorded
+    ON driver_location_history USING brin(recorded_at);
+
+-- Удаляет точки старше p_retention_days пачкой; вызывается в цикле, пока пачки полные
+CREATE OR REPLACE FUNCTION purge_driver_location_history(p_retention_days INTEGER, p_batch_size INTEGER DEFAULT 50000)
+RETURNS INTEGER AS $$
+DECLARE
+    deleted INTEGER;
+BEGIN
+    DELETE FROM driver_location_history
+    WHERE id IN (
+        SELECT id FROM driver_location_history
+        WHERE recorded_at < CURRENT_TIMESTAMP - p_retention_days * INTERVAL '1 day'
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    );
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql;
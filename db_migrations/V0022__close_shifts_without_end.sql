@@ -0,0 +1,37 @@
+-- Открытая смена без времени окончания: покупка считала её открытой (NOT от NULL —
+-- NULL), баланс — действующей, а закрытие по сроку её не видело. Такие смены
+-- закрываются, дальше открытая смена обязана иметь время окончания
+UPDATE driver_balances
+SET shift_active = false, updated_at = CURRENT_TIMESTAMP
+WHERE shift_active = true AND shift_ends_at IS NULL;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'driver_balances_shift_ends_check') THEN
+        ALTER TABLE driver_balances ADD CONSTRAINT driver_balances_shift_ends_check
+            CHECK (NOT shift_active OR shift_ends_at IS NOT NULL) NOT VALID;
+        ALTER TABLE driver_balances VALIDATE CONSTRAINT driver_balances_shift_ends_check;
+    END IF;
+END;
+$$;
+
+-- Смена действует, пока shift_active AND COALESCE(shift_ends_at > CURRENT_TIMESTAMP, false).
+-- После проверки выше у открытой смены время окончания есть всегда, поэтому закрытие
+-- по сроку снова идёт по idx_driver_balances_shift_ends в порядке окончания
+CREATE OR REPLACE FUNCTION expire_shifts(p_batch_size INTEGER DEFAULT 1000) RETURNS INTEGER AS $$
+DECLARE
+    closed INTEGER;
+BEGIN
+    UPDATE driver_balances
+    SET shift_active = false, updated_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+        SELECT id FROM driver_balances
+        WHERE shift_active = true AND shift_ends_at <= CURRENT_TIMESTAMP
+        ORDER BY shift_ends_at
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    );
+    GET DIAGNOSTICS closed = ROW_COUNT;
+    RETURN closed;
+END;
+$$ LANGUAGE plpgsql;
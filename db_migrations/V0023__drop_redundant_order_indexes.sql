@@ -0,0 +1,5 @@
+-- V0016 по ошибке вернула индексы, которые V0003 удалила: их покрывают ключевые
+-- индексы (passenger_id | driver_id, created_at DESC, id DESC), а каждая вставка
+-- заказа обновляла бы ещё два индекса в каждой секции
+DROP INDEX IF EXISTS idx_orders_passenger;
+DROP INDEX IF EXISTS idx_orders_driver;
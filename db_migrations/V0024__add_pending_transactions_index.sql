@@ -0,0 +1,3 @@
+-- Заявки, ждущие обработки: список администратора идёт по этому индексу от новых
+-- к старым и останавливается на LIMIT, не перебирая секции transactions целиком
+CREATE INDEX IF NOT EXISTS idx_transactions_pending ON transactions(created_at) WHERE status = 'pending';
@@ -0,0 +1,5 @@
+-- Координаты справочника адресов общие для всех пассажиров, а прежде первый заказ
+-- с новым адресом записывал туда непроверенную точку клиента. Такие координаты
+-- стираются: у заказов остаются свои from_lat/to_lat, справочник берёт точки
+-- только от геокодера
+UPDATE addresses SET lat = NULL, lon = NULL, provider = NULL WHERE provider = 'client';
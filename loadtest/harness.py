@@ -0,0 +1,174 @@
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ('auth', 'orders', 'balance', 'admin')
+
+
+def load_function(name: str):
+    '''Импортирует backend/<name>/index.py со своими копиями db, response и т.д.
+
+    Функции лежат в отдельных каталогах с одноимёнными модулями, поэтому после
+    загрузки модули каталога убираются из sys.modules — следующая функция
+    получит собственные экземпляры, а уже загруженная держит ссылки на свои.
+    '''
+    path = BACKEND_DIR / name
+    before = set(sys.modules)
+    sys.path.insert(0, str(path))
+    try:
+        spec = importlib.util.spec_from_file_location(f'{name}_index', path / 'index.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(path))
+        for loaded in set(sys.modules) - before:
+            origin = getattr(sys.modules[loaded], '__file__', None) or ''
+            if origin.startswith(str(path)):
+                del sys.modules[loaded]
+    return module
+
+
+def invoke(module, method: str, params: dict = None, body: dict = None, headers: dict = None,
+           source_ip: str = None) -> tuple:
+    '''Вызывает handler как платформа; возвращает (статус, секунды, запросов к БД, тело).
+
+    source_ip — адрес клиента, как его передаёт шлюз в requestContext.identity.
+    '''
+    event = {
+        'httpMethod': method,
+        'queryStringParameters': params or {},
+        'headers': headers or {},
+        'body': json.dumps(body) if body is not None else None
+    }
+    if source_ip:
+        event['requestContext'] = {'identity': {'sourceIp': source_ip}}
+    started = time.perf_counter()
+    result = module.handler(event, None)
+    elapsed = time.perf_counter() - started
+    summary = module.instrumentation.last_request()
+    return result['statusCode'], elapsed, summary['queries'], result['body']
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    '''Потокобезопасный сборщик задержек, статусов и числа запросов по операциям'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, operation: str, status: int, elapsed: float, queries: int):
+        with self._lock:
+            self._samples.setdefault(operation, []).append((status, elapsed, queries))
+
+    def report(self, wall_seconds: float) -> dict:
+        summary = {}
+        with self._lock:
+            samples = dict(self._samples)
+        for operation, rows in sorted(samples.items()):
+            latencies = sorted(row[1] for row in rows)
+            statuses = {}
+            for status, _, _ in rows:
+                statuses[status] = statuses.get(status, 0) + 1
+            summary[operation] = {
+                'requests': len(rows),
+                'throughput_rps': round(len(rows) / wall_seconds, 1) if wall_seconds else 0.0,
+                'p50_ms': round(percentile(latencies, 0.50) * 1e3, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1e3, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1e3, 2),
+                'queries_per_request': round(sum(row[2] for row in rows) / len(rows), 2),
+                'statuses': statuses
+            }
+        return summary
+
+
+def run_concurrently(step, concurrency: int, duration: float = None, requests: int = None) -> float:
+    '''Запускает step(worker_index) в concurrency потоках до истечения времени или числа запросов'''
+    deadline = time.monotonic() + duration if duration else None
+    remaining = [requests] if requests else None
+    lock = threading.Lock()
+    errors = []
+
+    def worker(index: int):
+        while True:
+            if deadline and time.monotonic() >= deadline:
+                return
+            if remaining is not None:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            try:
+                step(index)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - started
+
+
+# Замер в свежем интерпретаторе: импорт функции, первый preflight, первый отказ
+# без токена и тёплый preflight; driver_loaded — успел ли загрузиться psycopg2
+COLD_START_PROBE = """import json, sys, time, timeit
+sys.path.insert(0, sys.argv[1])
+import harness
+started = time.perf_counter()
+module = harness.load_function(sys.argv[2])
+imported = time.perf_counter()
+module.handler({'httpMethod': 'OPTIONS'}, None)
+preflight = time.perf_counter()
+module.handler({'httpMethod': 'POST', 'queryStringParameters': {'action': 'claim'}, 'body': '{}'}, None)
+rejected = time.perf_counter()
+runs = 10000
+warm = timeit.timeit(lambda: module.handler({'httpMethod': 'OPTIONS'}, None), number=runs) / runs
+print(json.dumps({
+    'import_ms': (imported - started) * 1e3,
+    'preflight_ms': (preflight - imported) * 1e3,
+    'rejected_ms': (rejected - preflight) * 1e3,
+    'warm_preflight_us': warm * 1e6,
+    'driver_loaded': 'psycopg2' in sys.modules
+}))
+"""
+
+
+def cold_start(name: str, runs: int = 10) -> dict:
+    '''Медианы холодного старта функции по runs свежим процессам; process_ms — весь процесс'''
+    env = {**os.environ, 'REQUEST_LOG': '0'}
+    env.setdefault('AUTH_TOKEN_SECRET', 'loadtest-secret')
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-c', COLD_START_PROBE, str(Path(__file__).resolve().parent), name],
+            capture_output=True, text=True, check=True, env=env
+        )
+        sample = json.loads(completed.stdout)
+        sample['process_ms'] = (time.perf_counter() - started) * 1e3
+        samples.append(sample)
+    summary = {
+        key: round(statistics.median(sample[key] for sample in samples), 2)
+        for key in ('process_ms', 'import_ms', 'preflight_ms', 'rejected_ms', 'warm_preflight_us')
+    }
+    summary['driver_loaded'] = any(sample['driver_loaded'] for sample in samples)
+    return summary
@@ -0,0 +1,614 @@
+'''Нагрузочный стенд: вызывает handler функций напрямую, в процессе, против локального Postgres.
+
+    export DATABASE_URL=postgresql://postgres@localhost/taxi_bench
+    python loadtest/run.py migrate
+    python loadtest/run.py seed --users 100000 --orders 3000000 --transactions 1000000
+    python loadtest/run.py run order_rush --concurrency 32 --duration 30
+    python loadtest/run.py run order_rush --hot-passengers 20 --requests 5000
+    python loadtest/run.py run login_storm --concurrency 16 --duration 30
+    python loadtest/run.py run admin_dashboard --concurrency 4 --duration 30
+    python loadtest/run.py run driver_pings --concurrency 16 --duration 30
+    python loadtest/run.py run admin_users --concurrency 4 --duration 30
+    python loadtest/run.py run trip_lifecycle --concurrency 16 --duration 30
+    python loadtest/run.py explain
+    python loadtest/run.py coldstart --runs 20
+    DATABASE_READ_URL=postgresql://postgres@localhost:5433/taxi_bench python loadtest/run.py replica
+    python loadtest/run.py events
+    python loadtest/run.py money
+
+Для каждой операции печатает p50/p95/p99, пропускную способность, число
+запросов к БД на вызов и распределение статусов. order_rush после прогона
+проверяет, что ни один баланс пассажира не ушёл в минус. explain печатает
+планы запросов справочника пользователей админки на засеянной базе.
+coldstart запускает каждую функцию в свежих процессах и печатает медианы
+импорта, первого preflight и первого отказа без токена; база ему не нужна.
+replica проверяет маршрутизацию чтения на двух экземплярах Postgres: основном
+(DATABASE_URL) и реплике (DATABASE_READ_URL). events проверяет ленту событий
+заказов: пробуждение по NOTIFY, фиксацию транзакций не в порядке id и то, что
+долгая транзакция не останавливает ленту дольше ORDER_EVENTS_HOLD_BACK_SECONDS.
+money проверяет денежные пути под конкуренцией: параллельные оплаты заказов не
+уводят баланс в минус, каждый заказ достаётся одному водителю, повторное
+одобрение заявки не зачисляет её дважды. Заказы проверки остаются в базе и
+закрываются истечением брошенных заказов.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+
+import psycopg2
+
+import harness
+import seed
+
+SEED_PASSWORD = 'loadtest-password'
+SAMPLE_SIZE = 10000
+CITY_CENTER = (55.965, 43.070)
+CITY_SPREAD = 0.05
+
+
+def sample_ids(cur, sql: str, limit: int = SAMPLE_SIZE) -> list:
+    cur.execute(sql + " ORDER BY random() LIMIT %s", (limit,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def random_point(rng) -> tuple:
+    return (CITY_CENTER[0] + rng.uniform(-CITY_SPREAD, CITY_SPREAD),
+            CITY_CENTER[1] + rng.uniform(-CITY_SPREAD, CITY_SPREAD))
+
+
+def order_body(rng, payment_methods: tuple) -> dict:
+    '''Заказ с координатами точек: без них сервер не считает цену и отвечает 400'''
+    (from_lat, from_lon), (to_lat, to_lon) = random_point(rng), random_point(rng)
+    return {
+        'from_address': f'ул. Ленина, {rng.randint(1, 300)}',
+        'to_address': f'ул. Мира, {rng.randint(1, 170)}',
+        'from_lat': from_lat, 'from_lon': from_lon, 'to_lat': to_lat, 'to_lon': to_lon,
+        'payment_method': rng.choice(payment_methods)
+    }
+
+
+def order_rush(handlers, cur, args):
+    '''Пик заказов: пассажиры создают оплаченные заказы, водители на смене их забирают'''
+    orders = handlers['orders']
+    passengers = sample_ids(cur, "SELECT user_id FROM passenger_balances", args.hot_passengers or SAMPLE_SIZE)
+    drivers = sample_ids(cur, "SELECT user_id FROM driver_balances WHERE shift_active = true")
+    issue = orders.router.security.issue_token
+    passenger_tokens = {pid: {'X-Auth-Token': issue(pid, 'passenger')} for pid in passengers}
+    driver_tokens = {did: {'X-Auth-Token': issue(did, 'driver')} for did in drivers}
+
+    def step(recorder, rng):
+        if drivers and rng.random() < 0.2:
+            headers = driver_tokens[rng.choice(drivers)]
+            status, elapsed, queries, _ = harness.invoke(orders, 'POST', {'action': 'claim'}, {}, headers)
+            recorder.record('orders.claim', status, elapsed, queries)
+            return
+        body = order_body(rng, ('rub', 'rub', 'bonus', 'cash'))
+        headers = passenger_tokens[rng.choice(passengers)]
+        status, elapsed, queries, _ = harness.invoke(orders, 'POST', None, body, headers)
+        recorder.record('orders.create', status, elapsed, queries)
+
+    return step
+
+
+def login_storm(handlers, cur, args):
+    '''Волна входов: 90% с верным паролем, 10% с неверным, с разных IP.
+
+    Повторы по одному телефону упираются в ограничение частоты и дают 429.
+    '''
+    auth = handlers['auth']
+    cur.execute("SELECT phone FROM users ORDER BY random() LIMIT %s", (SAMPLE_SIZE,))
+    phones = [row[0] for row in cur.fetchall()]
+
+    def step(recorder, rng):
+        password = SEED_PASSWORD if rng.random() < 0.9 else 'wrong-password'
+        body = {'action': 'login', 'phone': rng.choice(phones), 'password': password}
+        source_ip = f'10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+        status, elapsed, queries, _ = harness.invoke(auth, 'POST', None, body, source_ip=source_ip)
+        recorder.record('auth.login', status, elapsed, queries)
+
+    return step
+
+
+def admin_dashboard(handlers, cur, args):
+    '''Админка: дашборд, заявки, настройки и список пользователей'''
+    admin = handlers['admin']
+    headers = {'X-Admin-Token': admin.router.security.issue_token(1, 'admin')}
+    actions = ('stats', 'stats', 'transactions', 'settings', 'users')
+
+    def step(recorder, rng):
+        action = rng.choice(actions)
+        status, elapsed, queries, _ = harness.invoke(admin, 'GET', {'action': action}, None, headers)
+        recorder.record(f'admin.{action}', status, elapsed, queries)
+
+    return step
+
+
+def order_history(handlers, cur, args):
+    '''История поездок: первая страница и переход по next_cursor'''
+    orders = handlers['orders']
+    passengers = sample_ids(cur, "SELECT user_id FROM passenger_balances")
+    issue = orders.router.security.issue_token
+
+    def step(recorder, rng):
+        headers = {'X-Auth-Token': issue(rng.choice(passengers), 'passenger')}
+        status, elapsed, queries, body = harness.invoke(orders, 'GET', {'limit': '20'}, None, headers)
+        recorder.record('orders.history', status, elapsed, queries)
+        next_cursor = json.loads(body).get('next_cursor') if status == 200 else None
+        if next_cursor:
+            params = {'limit': '20', 'cursor': next_cursor}
+            status, elapsed, queries, _ = harness.invoke(orders, 'GET', params, None, headers)
+            recorder.record('orders.history_next_page', status, elapsed, queries)
+
+    return step
+
+
+def trip_lifecycle(handlers, cur, args):
+    '''Поездка целиком: заказ, принятие, начало, завершение и оценка; каждая пятая отменяется.
+
+    Водителей немного, поэтому оценки и счётчики поездок конкурируют за их профили.
+    '''
+    orders = handlers['orders']
+    passengers = sample_ids(cur, "SELECT user_id FROM passenger_balances")
+    drivers = sample_ids(cur, "SELECT user_id FROM driver_balances WHERE shift_active = true", 50)
+    issue = orders.router.security.issue_token
+
+    def step(recorder, rng):
+        passenger = {'X-Auth-Token': issue(rng.choice(passengers), 'passenger')}
+        driver = {'X-Auth-Token': issue(rng.choice(drivers), 'driver')}
+        body = order_body(rng, ('rub', 'cash'))
+        status, elapsed, queries, response_body = harness.invoke(orders, 'POST', None, body, passenger)
+        recorder.record('orders.create', status, elapsed, queries)
+        if status != 200:
+            return
+        order = {'order_id': json.loads(response_body)['order_id']}
+
+        if rng.random() < 0.2:
+            steps = (('cancel', passenger),)
+        else:
+            steps = (('accept', driver), ('start', driver), ('complete', driver), ('rate', passenger))
+        for action, headers in steps:
+            payload = dict(order, rating=rng.randint(3, 5)) if action == 'rate' else order
+            status, elapsed, queries, _ = harness.invoke(orders, 'POST', {'action': action}, payload, headers)
+            recorder.record(f'orders.{action}', status, elapsed, queries)
+            if status != 200:
+                return
+
+    return step
+
+
+# Типичные запросы справочника пользователей: поиск по части телефона и имени,
+# фильтры по роли и балансу, переход на следующую страницу
+USER_DIRECTORY_QUERIES = (
+    {},
+    {'role': 'driver', 'shift_active': 'true'},
+    {'role': 'passenger', 'min_balance': '1000'},
+    {'q': '999'},
+    {'q': 'Пользователь 12'},
+    {'q': '+7900001', 'role': 'passenger'}
+)
+
+
+def admin_users(handlers, cur, args):
+    '''Справочник пользователей админки: поиск, фильтры и keyset-пагинация'''
+    admin = handlers['admin']
+    headers = {'X-Admin-Token': admin.router.security.issue_token(1, 'admin')}
+
+    def step(recorder, rng):
+        params = dict(rng.choice(USER_DIRECTORY_QUERIES), action='users')
+        status, elapsed, queries, body = harness.invoke(admin, 'GET', params, None, headers)
+        recorder.record('admin.users', status, elapsed, queries)
+        next_cursor = json.loads(body).get('next_cursor') if status == 200 else None
+        if next_cursor:
+            params['cursor'] = next_cursor
+            status, elapsed, queries, _ = harness.invoke(admin, 'GET', params, None, headers)
+            recorder.record('admin.users_next_page', status, elapsed, queries)
+
+    return step
+
+
+def driver_pings(handlers, cur, args):
+    '''Город в движении: водители на смене шлют позиции, пассажиры ищут ближайшие машины'''
+    orders = handlers['orders']
+    drivers = sample_ids(cur, "SELECT user_id FROM driver_balances WHERE shift_active = true")
+    passengers = sample_ids(cur, "SELECT user_id FROM passenger_balances")
+    issue = orders.router.security.issue_token
+    driver_tokens = {did: {'X-Auth-Token': issue(did, 'driver')} for did in drivers}
+    passenger_tokens = {pid: {'X-Auth-Token': issue(pid, 'passenger')} for pid in passengers}
+
+    def step(recorder, rng):
+        if rng.random() < 0.9:
+            lat, lon = random_point(rng)
+            body = {'lat': lat, 'lon': lon}
+            headers = driver_tokens[rng.choice(drivers)]
+            status, elapsed, queries, _ = harness.invoke(orders, 'POST', {'action': 'location'}, body, headers)
+            recorder.record('orders.location', status, elapsed, queries)
+            return
+        lat, lon = random_point(rng)
+        params = {'action': 'nearby', 'from_lat': str(lat), 'from_lon': str(lon)}
+        headers = passenger_tokens[rng.choice(passengers)]
+        status, elapsed, queries, _ = harness.invoke(orders, 'GET', params, None, headers)
+        recorder.record('orders.nearby', status, elapsed, queries)
+
+    return step
+
+
+WORKLOADS = {
+    'order_rush': order_rush,
+    'login_storm': login_storm,
+    'admin_dashboard': admin_dashboard,
+    'order_history': order_history,
+    'driver_pings': driver_pings,
+    'admin_users': admin_users,
+    'trip_lifecycle': trip_lifecycle
+}
+
+
+def check_no_overdrafts(cur) -> int:
+    cur.execute(
+        "SELECT COUNT(*) FROM passenger_balances WHERE bonus_balance < 0 OR rub_balance < 0"
+    )
+    return cur.fetchone()[0]
+
+
+def run(args):
+    os.environ.setdefault('AUTH_TOKEN_SECRET', 'loadtest-secret')
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+    os.environ.setdefault('REQUEST_LOG', '0')
+    handlers = {name: harness.load_function(name) for name in harness.FUNCTIONS}
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    step = WORKLOADS[args.workload](handlers, cur, args)
+    conn.rollback()
+
+    recorder = harness.Recorder()
+    rngs = [random.Random(args.seed + i) for i in range(args.concurrency)]
+    wall = harness.run_concurrently(
+        lambda index: step(recorder, rngs[index]),
+        args.concurrency,
+        duration=None if args.requests else args.duration,
+        requests=args.requests
+    )
+
+    report = {
+        'workload': args.workload,
+        'concurrency': args.concurrency,
+        'wall_seconds': round(wall, 2),
+        'operations': recorder.report(wall)
+    }
+    exit_code = 0
+    if args.workload == 'order_rush':
+        report['overdrafts'] = check_no_overdrafts(cur)
+        exit_code = 1 if report['overdrafts'] else 0
+    conn.close()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    return exit_code
+
+
+def explain() -> int:
+    '''EXPLAIN (ANALYZE, BUFFERS) запросов справочника пользователей для проверки индексов'''
+    admin = harness.load_function('admin')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    for params in USER_DIRECTORY_QUERIES:
+        sql, query_args, _ = admin.users_query(params)
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, query_args)
+        print(f'-- {json.dumps(params, ensure_ascii=False)}')
+        print('\n'.join(row[0] for row in cur.fetchall()))
+        print()
+    conn.rollback()
+    conn.close()
+    return 0
+
+
+def coldstart(args) -> int:
+    report = {name: harness.cold_start(name, args.runs) for name in harness.FUNCTIONS}
+    for name, summary in report.items():
+        print(f"{name:<8} импорт {summary['import_ms']:.1f} мс, первый preflight {summary['preflight_ms']:.2f} мс, "
+              f"первый отказ {summary['rejected_ms']:.2f} мс, тёплый preflight {summary['warm_preflight_us']:.1f} мкс, "
+              f"процесс {summary['process_ms']:.0f} мс, psycopg2 {'загружен' if summary['driver_loaded'] else 'не загружен'}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, ensure_ascii=False, indent=2) + '\n')
+    return 0
+
+
+def replica_check() -> int:
+    '''Баланс читается с реплики, сразу после своей записи — с основной, по истечении окна — снова с реплики'''
+    if not os.environ.get('DATABASE_READ_URL'):
+        print('задайте DATABASE_READ_URL — DSN реплики или второго экземпляра Postgres')
+        return 2
+    os.environ.setdefault('AUTH_TOKEN_SECRET', 'loadtest-secret')
+    os.environ.setdefault('REQUEST_LOG', '0')
+    balance = harness.load_function('balance')
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    passenger = sample_ids(conn.cursor(), "SELECT user_id FROM passenger_balances", 1)[0]
+    conn.close()
+    headers = {'X-Auth-Token': balance.router.security.issue_token(passenger, 'passenger')}
+
+    def read_source() -> str:
+        status, _, _, _ = harness.invoke(balance, 'GET', None, None, headers)
+        assert status == 200, status
+        return 'реплика' if balance.instrumentation.last_request()['replica'] else 'основная'
+
+    checks = [('первое чтение', read_source(), 'реплика')]
+    status, _, _, _ = harness.invoke(balance, 'POST', None, {'action': 'deposit', 'amount': 1}, headers)
+    assert status == 200, status
+    checks.append(('чтение после своей записи', read_source(), 'основная'))
+    time.sleep(balance.router.db.REPLICA_MAX_LAG + 0.5)
+    checks.append(('чтение после окна read-your-writes', read_source(), 'реплика'))
+
+    for name, source, expected in checks:
+        print(f"{name}: {source}{'' if source == expected else f' (ожидалась {expected})'}")
+    return 0 if all(source == expected for _, source, expected in checks) else 1
+
+
+EVENT_ORDER_SQL = """INSERT INTO orders (passenger_id, from_address, to_address, amount, payment_method, final_price)
+    VALUES (%s, 'ул. Ленина, 1', 'ул. Мира, 1', 150, 'cash', 150) RETURNING id"""
+
+
+def events_check() -> int:
+    '''Лента событий заказов на двух соединениях-писателях и long-poll читателе'''
+    os.environ.setdefault('AUTH_TOKEN_SECRET', 'loadtest-secret')
+    os.environ.setdefault('REQUEST_LOG', '0')
+    order_events = harness.load_function('orders').order_events
+    dsn = os.environ['DATABASE_URL']
+    first, second, reader = (psycopg2.connect(dsn) for _ in range(3))
+    passenger = sample_ids(first.cursor(), "SELECT user_id FROM passenger_balances", 1)[0]
+    first.rollback()
+    created = []
+
+    def insert_order(conn) -> int:
+        cur = conn.cursor()
+        cur.execute(EVENT_ORDER_SQL, (passenger,))
+        created.append(cur.fetchone()[0])
+        return created[-1]
+
+    def latest_version() -> tuple:
+        cur = reader.cursor()
+        cur.execute(
+            "SELECT txid, id FROM order_events WHERE passenger_id = %s ORDER BY txid DESC, id DESC LIMIT 1",
+            (passenger,)
+        )
+        row = cur.fetchone()
+        reader.rollback()
+        return tuple(row) if row else (0, 0)
+
+    def wait_in_background(since: tuple, timeout: float) -> dict:
+        result = {}
+
+        def target():
+            started = time.monotonic()
+            result['events'] = order_events.wait_for_events(reader, 'passenger', passenger, since, timeout)
+            result['seconds'] = time.monotonic() - started
+
+        result['thread'] = threading.Thread(target=target)
+        result['thread'].start()
+        return result
+
+    checks = []
+    try:
+        # Первой начатая транзакция пишет событие с меньшим id, но фиксируется последней
+        since = latest_version()
+        older = insert_order(first)
+        newer = insert_order(second)
+        second.commit()
+        held = order_events.fetch_events(reader.cursor(), 'passenger', passenger, since)
+        reader.rollback()
+        checks.append(('событие придержано незавершённой более ранней транзакцией', len(held) == 0))
+
+        waiter = wait_in_background(since, 10)
+        time.sleep(0.3)
+        first.commit()
+        waiter['thread'].join()
+        received = [event['order_id'] for event in waiter['events']]
+        checks.append(('после фиксации пришли оба события в порядке (txid, id)', received == [older, newer]))
+        checks.append(('читатель разбужен уведомлением, а не таймаутом', waiter['seconds'] < 2))
+
+        # Долгая транзакция без событий заказов держит xmin, но ленту — не дольше границы
+        order_events.HELD_BACK_MAX_SECONDS = 1.0
+        since = latest_version()
+        first.cursor().execute("SELECT txid_current()")
+        waiter = wait_in_background(since, 10)
+        time.sleep(0.3)
+        blocked = insert_order(second)
+        second.commit()
+        waiter['thread'].join()
+        received = [event['order_id'] for event in waiter['events']]
+        checks.append(('долгая транзакция не останавливает ленту', received == [blocked]))
+        checks.append(('событие отдано по границе придержки, а не по таймауту', waiter['seconds'] < 5))
+    finally:
+        first.rollback()
+        if created:
+            cur = second.cursor()
+            cur.execute("UPDATE orders SET status = 'cancelled' WHERE id = ANY(%s)", (created,))
+            second.commit()
+        for conn in (first, second, reader):
+            conn.close()
+
+    for name, passed in checks:
+        print(f"{name}: {'да' if passed else 'НЕТ'}")
+    return 0 if all(passed for _, passed in checks) else 1
+
+
+MONEY_CONCURRENCY = 16
+
+
+def collect_concurrently(call, concurrency: int, requests: int) -> list:
+    '''Результаты call() из concurrency потоков, всего requests вызовов'''
+    results = []
+    lock = threading.Lock()
+
+    def step(index):
+        result = call(index)
+        with lock:
+            results.append(result)
+
+    harness.run_concurrently(step, concurrency, requests=requests)
+    return results
+
+
+def money_check() -> int:
+    '''Условное списание, SKIP LOCKED при раздаче заказов и повтор одобрения заявки'''
+    os.environ.setdefault('AUTH_TOKEN_SECRET', 'loadtest-secret')
+    os.environ.setdefault('REQUEST_LOG', '0')
+    os.environ['DB_POOL_MAX_SIZE'] = str(MONEY_CONCURRENCY)
+    orders, balance, admin = (harness.load_function(name) for name in ('orders', 'balance', 'admin'))
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    checks = []
+
+    # Параллельных оплат больше, чем помещается в баланс пассажира: лишние получают 400
+    passenger = sample_ids(cur, "SELECT user_id FROM passenger_balances WHERE rub_balance BETWEEN 500 AND 3000", 1)[0]
+    body = order_body(random.Random(1), ('rub',))
+    headers = {'X-Auth-Token': orders.router.security.issue_token(passenger, 'passenger')}
+    status, _, _, quote = harness.invoke(orders, 'GET', {
+        'action': 'quote', 'from_lat': body['from_lat'], 'from_lon': body['from_lon'],
+        'to_lat': body['to_lat'], 'to_lon': body['to_lon']
+    }, None, headers)
+    assert status == 200, quote
+    cur.execute("SELECT rub_balance FROM passenger_balances WHERE user_id = %s", (passenger,))
+    before = cur.fetchone()[0]
+    conn.rollback()
+    attempts = min(int(before // Decimal(str(json.loads(quote)['balance_price']))) + 4, 64)
+    results = collect_concurrently(
+        lambda _: harness.invoke(orders, 'POST', None, body, headers), MONEY_CONCURRENCY, attempts
+    )
+    paid = [json.loads(result[3]) for result in results if result[0] == 200]
+    cur.execute("SELECT rub_balance FROM passenger_balances WHERE user_id = %s", (passenger,))
+    after = cur.fetchone()[0]
+    conn.rollback()
+    checks.append(('баланс пассажира не ушёл в минус', after >= 0))
+    checks.append(('списано ровно столько, сколько стоят принятые заказы',
+                   before - after == sum(Decimal(str(order['final_price'])) for order in paid)))
+    checks.append(('лишние оплаты отклонены', len(paid) < attempts))
+
+    # Водители на смене одновременно забирают ожидающие заказы: ни один не выдан дважды
+    drivers = sample_ids(
+        cur, "SELECT user_id FROM driver_balances WHERE shift_active = true AND shift_ends_at > CURRENT_TIMESTAMP",
+        MONEY_CONCURRENCY
+    )
+    conn.rollback()
+    driver_tokens = [{'X-Auth-Token': orders.router.security.issue_token(d, 'driver')} for d in drivers]
+    results = collect_concurrently(
+        lambda index: harness.invoke(orders, 'POST', {'action': 'claim'}, {}, driver_tokens[index % len(drivers)]),
+        MONEY_CONCURRENCY, MONEY_CONCURRENCY * 4
+    )
+    claimed = [json.loads(result[3])['order']['id'] for result in results if result[0] == 200]
+    checks.append(('заказы розданы', len(claimed) > 0))
+    checks.append(('каждый заказ выдан одному водителю', len(claimed) == len(set(claimed))))
+
+    # Одна заявка на пополнение одобряется параллельно пачкой и по одной
+    deposit_headers = {'X-Auth-Token': balance.router.security.issue_token(passenger, 'passenger')}
+    status, _, _, created = harness.invoke(balance, 'POST', None, {'action': 'deposit', 'amount': 100}, deposit_headers)
+    assert status == 200, created
+    transaction_id = json.loads(created)['transaction_id']
+    admin_headers = {'X-Admin-Token': admin.router.security.issue_token(1, 'admin')}
+    item = {'transaction_id': transaction_id, 'action': 'approve'}
+    cur.execute("SELECT rub_balance FROM passenger_balances WHERE user_id = %s", (passenger,))
+    before = cur.fetchone()[0]
+    conn.rollback()
+
+    def approve(index):
+        if index % 2:
+            return harness.invoke(admin, 'POST', {'action': 'process_transaction'}, item, admin_headers)
+        return harness.invoke(admin, 'POST', {'action': 'process_transactions'}, {'items': [item]}, admin_headers)
+
+    def approved(status: int, result: str) -> bool:
+        payload = json.loads(result)
+        if 'results' in payload:
+            return payload['results'][0]['result'] == 'approved'
+        return status == 200 and payload.get('status') == 'approved'
+
+    results = collect_concurrently(approve, MONEY_CONCURRENCY, MONEY_CONCURRENCY)
+    approvals = sum(1 for status, _, _, result in results if approved(status, result))
+    cur.execute("SELECT rub_balance FROM passenger_balances WHERE user_id = %s", (passenger,))
+    after = cur.fetchone()[0]
+    cur.execute(
+        "SELECT COUNT(*) FROM ledger_entries WHERE reference_type = 'transaction' AND reference_id = %s",
+        (transaction_id,)
+    )
+    legs = cur.fetchone()[0]
+    conn.rollback()
+    conn.close()
+    checks.append(('заявка одобрена одним вызовом из всех', approvals == 1))
+    checks.append(('пополнение зачислено один раз', after - before == 100))
+    checks.append(('проводки заявки записаны один раз', legs == 2))
+
+    for name, passed in checks:
+        print(f"{name}: {'да' if passed else 'НЕТ'}")
+    return 0 if all(passed for _, passed in checks) else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный стенд функций такси-платформы')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('migrate', help='применить db_migrations')
+
+    seed_parser = commands.add_parser('seed', help='наполнить базу тестовыми данными')
+    seed_parser.add_argument('--users', type=int, default=100000)
+    seed_parser.add_argument('--orders', type=int, default=3000000)
+    seed_parser.add_argument('--transactions', type=int, default=1000000)
+
+    run_parser = commands.add_parser('run', help='прогнать сценарий нагрузки')
+    run_parser.add_argument('workload', choices=sorted(WORKLOADS))
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--duration', type=float, default=30.0)
+    run_parser.add_argument('--requests', type=int, help='число вызовов вместо длительности')
+    run_parser.add_argument('--hot-passengers', type=int, default=0,
+                            help='ограничить order_rush N пассажирами, чтобы заказы конкурировали за один баланс')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help='сохранить отчёт JSON в файл')
+
+    commands.add_parser('explain', help='планы запросов справочника пользователей')
+
+    commands.add_parser('replica', help='проверить чтение с реплики и read-your-writes')
+
+    commands.add_parser('events', help='проверить ленту событий заказов: NOTIFY и порядок фиксации')
+
+    commands.add_parser('money', help='проверить оплату, раздачу заказов и одобрение заявок под конкуренцией')
+
+    coldstart_parser = commands.add_parser('coldstart', help='холодный старт и preflight функций')
+    coldstart_parser.add_argument('--runs', type=int, default=10)
+    coldstart_parser.add_argument('--output', help='сохранить отчёт JSON в файл')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        return run(args)
+    if args.command == 'explain':
+        return explain()
+    if args.command == 'coldstart':
+        return coldstart(args)
+    if args.command == 'replica':
+        return replica_check()
+    if args.command == 'events':
+        return events_check()
+    if args.command == 'money':
+        return money_check()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    if args.command == 'migrate':
+        seed.apply_migrations(conn)
+    else:
+        sys.path.insert(0, str(harness.BACKEND_DIR / 'auth'))
+        import security
+        seed.seed(conn, args.users, args.orders, args.transactions, security.hash_password(SEED_PASSWORD))
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import time
+from pathlib import Path
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'db_migrations'
+ORDERS_BATCH = 250000
+
+SEED_USERS_SQL = """INSERT INTO users (phone, password_hash, role, full_name, created_at)
+    SELECT '+7900' || lpad(g::TEXT, 7, '0'), %(password_hash)s,
+           CASE WHEN g %% 10 = 0 THEN 'driver' ELSE 'passenger' END,
+           'Пользователь ' || g,
+           CURRENT_TIMESTAMP - random() * INTERVAL '730 days'
+    FROM generate_series(1, %(users)s) g
+    ON CONFLICT (phone) DO NOTHING"""
+
+SEED_BALANCES_SQL = (
+    """INSERT INTO passenger_balances (user_id, bonus_balance, rub_balance)
+       SELECT id, round((random() * 2000)::NUMERIC, 2), round((random() * 5000)::NUMERIC, 2)
+       FROM users WHERE role = 'passenger'
+       ON CONFLICT (user_id) DO NOTHING""",
+    """INSERT INTO driver_balances (user_id, balance, shift_active, shift_ends_at)
+       SELECT id, round((random() * 20000)::NUMERIC, 2), shift,
+              CASE WHEN shift THEN CURRENT_TIMESTAMP + random() * INTERVAL '12 hours' END
+       FROM (SELECT id, random() < 0.3 AS shift FROM users WHERE role = 'driver') d
+       ON CONFLICT (user_id) DO NOTHING""",
+    """INSERT INTO driver_profiles (user_id, car_brand, car_color, car_number)
+       SELECT id, 'Lada Vesta', 'белый', 'А' || lpad(mod(id, 1000)::TEXT, 3, '0') || 'ВС52'
+       FROM users WHERE role = 'driver'
+       ON CONFLICT (user_id) DO NOTHING"""
+)
+
+# Случайные значения берутся в LATERAL, связанном с g, иначе Postgres вычислит их один раз
+SEED_ORDERS_SQL = """WITH p AS (SELECT array_agg(id) AS ids FROM users WHERE role = 'passenger'),
+         d AS (SELECT array_agg(id) AS ids FROM users WHERE role = 'driver')
+    INSERT INTO orders (passenger_id, driver_id, from_address, to_address, amount, payment_method,
+                        final_price, discount, status, created_at, completed_at)
+    SELECT p.ids[1 + floor(random() * array_length(p.ids, 1))::INTEGER],
+           CASE WHEN r.status = 'pending' THEN NULL
+                ELSE d.ids[1 + floor(random() * array_length(d.ids, 1))::INTEGER] END,
+           'ул. Ленина, ' || (g %% 300 + 1), 'ул. Мира, ' || (g %% 170 + 1),
+           r.amount, r.method,
+           CASE WHEN r.method = 'cash' THEN r.amount ELSE round(r.amount * 0.7, 2) END,
+           CASE WHEN r.method = 'cash' THEN 0 ELSE round(r.amount * 0.3, 2) END,
+           r.status, r.created_at,
+           CASE WHEN r.status = 'completed' THEN r.created_at + INTERVAL '25 minutes' END
+    FROM generate_series(1, %(count)s) g
+    CROSS JOIN p CROSS JOIN d
+    CROSS JOIN LATERAL (
+        SELECT round((150 + random() * 850)::NUMERIC, 2) AS amount,
+               (ARRAY['cash', 'rub', 'bonus'])[1 + floor(random() * 3)::INTEGER] AS method,
+               CASE WHEN random() < 0.002 THEN 'pending'
+                    WHEN random() < 0.05 THEN 'cancelled'
+                    ELSE 'completed' END AS status,
+               CURRENT_TIMESTAMP - random() * INTERVAL '730 days' AS created_at
+        WHERE g > 0
+    ) r"""
+
+# Секции orders и transactions за весь период, на который раскиданы created_at
+SEED_PARTITIONS_SQL = """SELECT create_monthly_partitions(%(table)s, (CURRENT_DATE - INTERVAL '730 days')::DATE, CURRENT_DATE)"""
+
+SEED_TRANSACTIONS_SQL = """WITH u AS (SELECT array_agg(id) AS ids FROM users)
+    INSERT INTO transactions (user_id, type, amount, status, created_at, processed_at)
+    SELECT u.ids[1 + floor(random() * array_length(u.ids, 1))::INTEGER],
+           r.type, r.amount, r.status, r.created_at,
+           CASE WHEN r.status <> 'pending' THEN r.created_at + INTERVAL '1 hour' END
+    FROM generate_series(1, %(count)s) g
+    CROSS JOIN u
+    CROSS JOIN LATERAL (
+        SELECT (ARRAY['deposit_rub', 'deposit_bonus', 'withdrawal', 'shift_payment'])[1 + floor(random() * 4)::INTEGER] AS type,
+               round((100 + random() * 4900)::NUMERIC, 2) AS amount,
+               CASE WHEN random() < 0.01 THEN 'pending'
+                    WHEN random() < 0.1 THEN 'rejected'
+                    ELSE 'approved' END AS status,
+               CURRENT_TIMESTAMP - random() * INTERVAL '730 days' AS created_at
+        WHERE g > 0
+    ) r"""
+
+
+def apply_migrations(conn):
+    '''Применяет db_migrations/V*.sql по порядку номеров'''
+    cur = conn.cursor()
+    for path in sorted(MIGRATIONS_DIR.glob('V*.sql')):
+        print(f'миграция {path.name}')
+        cur.execute(path.read_text(encoding='utf-8'))
+    conn.commit()
+    cur.close()
+
+
+def seed(conn, users: int, orders: int, transactions: int, password_hash: str):
+    '''Наполняет базу объёмами, близкими к боевым.
+
+    Триггеры на время вставки отключаются (session_replication_role = replica,
+    нужны права суперпользователя), а агрегаты пересчитываются в конце.
+    Залитые балансы получают в журнале входящие остатки.
+    '''
+    cur = conn.cursor()
+    cur.execute("SET session_replication_role = replica")
+
+    started = time.monotonic()
+    cur.execute(SEED_USERS_SQL, {'users': users, 'password_hash': password_hash})
+    for statement in SEED_BALANCES_SQL:
+        cur.execute(statement)
+    conn.commit()
+    print(f'пользователи: {users} за {time.monotonic() - started:.1f} с')
+
+    for table, statement, total in (('orders', SEED_ORDERS_SQL, orders),
+                                    ('transactions', SEED_TRANSACTIONS_SQL, transactions)):
+        cur.execute(SEED_PARTITIONS_SQL, {'table': table})
+        inserted = 0
+        while inserted < total:
+            batch = min(ORDERS_BATCH, total - inserted)
+            cur.execute(statement, {'count': batch})
+            conn.commit()
+            inserted += batch
+            print(f'{table}: {inserted}/{total} за {time.monotonic() - started:.1f} с')
+
+    cur.execute("SET session_replication_role = DEFAULT")
+    cur.execute("SELECT rebuild_daily_stats()")
+    cur.execute("SELECT ledger_open_balances()")
+    conn.commit()
+
+    conn.autocommit = True
+    cur.execute("ANALYZE")
+    conn.autocommit = False
+    cur.close()
+    print(f'наполнение завершено за {time.monotonic() - started:.1f} с')